@@ -1,7 +1,15 @@
 # /usr/bin/python3
 
-from arcgis.gis import GIS
+import os
+import json
+import time
+import base64
+import hashlib
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import governor
+import metrics
 
 EXPORT_FORMATS = {
     "csv": "CSV",
@@ -15,20 +23,305 @@ EXPORT_FORMATS = {
     "xls": "Excel",
     "none": None,
 }
+# Folder holding encrypted cached tokens
+TOKEN_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".agol_backup", "tokens")
+# Minutes a cached token is valid for
+TOKEN_EXPIRATION = 1440
+# Seconds before expiry a cached token is no longer used
+TOKEN_MARGIN = 600
+# Iterations used to derive the token cache key from the password
+KDF_ITERATIONS = 390000
+# Folder holding cached item catalogues
+CATALOGUE_DIR = os.path.join(os.path.expanduser("~"), ".agol_backup", "catalogue")
+# Seconds the catalogue high-water mark is wound back, picking up items not yet indexed by search when last refreshed
+CATALOGUE_OVERLAP = 600
+# Number of entries requested per page of a content listing
+PAGE_SIZE = 100
+# Number of folders listed at the same time
+FOLDER_WORKERS = 8
+
+# Connections keyed by portal and username
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _cache_key(portal: str, uname: str):
+    # Name cache files after the portal and username
+    return hashlib.sha1(f"{portal.rstrip('/').lower()}|{uname.lower()}".encode("utf-8")).hexdigest()
+
+
+def _token_path(portal: str, uname: str):
+    # Get path of token file
+    return os.path.join(TOKEN_CACHE_DIR, f"{_cache_key(portal, uname)}.token")
+
+
+def _fernet(pword: str, salt: bytes):
+    # Derive encryption key from the password, so a cached token can only be read with the password
+    from cryptography.fernet import Fernet
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=KDF_ITERATIONS)
+    return Fernet(base64.urlsafe_b64encode(kdf.derive(pword.encode("utf-8"))))
+
+
+def load_token(portal: str, uname: str, pword: str):
+    """Loads a cached token
+
+    Args:
+        portal (str): Portal url
+        uname (str): Username
+        pword (str): Password, used to decrypt the token
+
+    Returns:
+        tuple: Token and expiry in seconds since epoch, None if no valid token is cached
+    """
+    try:
+        with open(_token_path(portal, uname), "r") as f:
+            cached = json.load(f)
+        data = _fernet(pword, base64.b64decode(cached["salt"])).decrypt(cached["token"].encode("utf-8"))
+        token = json.loads(data)
+    except Exception:
+        return None
+    # Ignore expired tokens
+    if token["expires"] - TOKEN_MARGIN < time.time():
+        return None
+    return token["token"], token["expires"]
+
+
+def save_token(portal: str, uname: str, pword: str, token: str, expires: float):
+    """Saves a token to the cache, encrypted with a key derived from the password
+
+    Args:
+        portal (str): Portal url
+        uname (str): Username
+        pword (str): Password, used to encrypt the token
+        token (str): Token
+        expires (float): Expiry in seconds since epoch
+    """
+    os.makedirs(TOKEN_CACHE_DIR, exist_ok=True)
+    salt = os.urandom(16)
+    data = _fernet(pword, salt).encrypt(json.dumps({"token": token, "expires": expires}).encode("utf-8"))
+    path = _token_path(portal, uname)
+    # Write to a temp file readable only by the user then move into place
+    tmp_path = f"{path}.tmp"
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump({"salt": base64.b64encode(salt).decode("utf-8"), "token": data.decode("utf-8")}, f)
+    os.replace(tmp_path, path)
+
+
+def connect(portal: str, uname: str, pword: str, logger: logging, rate: float = None, token_cache: bool = False):
+    """Gets a connection to a portal, reusing an open connection for the same portal and username
+
+    Args:
+        portal (str): Portal url
+        uname (str): Username
+        pword (str): Password
+        logger (logging): logging object to pass to tool for logging purposes
+        rate (float, optional): Requests per second allowed to the portal. Defaults to None.
+        token_cache (bool, optional): Flag to reuse a token cached on disk by an earlier run. Defaults to False.
+
+    Returns:
+        Agol: Connection
+    """
+    key = (portal.rstrip("/").lower(), uname.lower())
+    with _sessions_lock:
+        ago = _sessions.get(key)
+        if ago is None or not ago.gis or ago.expired:
+            ago = Agol(portal, uname, pword, logger, rate, token_cache)
+            if ago.gis:
+                _sessions[key] = ago
+        else:
+            logger.debug(f"Reusing connection to {portal}")
+    return ago
+
+
+def paged(gis, path: str, key: str = "items", params: dict = None, num: int = PAGE_SIZE, prefetch: bool = False):
+    """Yields the entries of a paged REST listing as each page arrives, requesting pages with start and num until the listing is exhausted
+
+    Args:
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        path (str): Path of listing relative to the sharing REST url, i.e. content/users/<username>
+        key (str, optional): Key of entries in each page. Defaults to "items".
+        params (dict, optional): Additional request parameters. Defaults to None.
+        num (int, optional): Number of entries per page. Defaults to PAGE_SIZE.
+        prefetch (bool, optional): Flag to request the next page while the current page is processed. Defaults to False.
+
+    Yields:
+        dict: Entry of listing
+    """
+    url = f"{gis._portal.resturl}{path}"
+
+    def _fetch(start: int):
+        # Request page
+        return gis._con.get(url, {**(params or {}), "f": "json", "start": start, "num": num})
+
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page") if prefetch else None
+    try:
+        start = 1
+        page = _fetch(start)
+        while True:
+            next_start = page.get("nextStart", -1)
+            more = next_start is not None and next_start > start
+            # Request next page in the background
+            future = metrics.submit(pool, _fetch, next_start) if pool and more else None
+            for entry in page.get(key) or []:
+                yield entry
+            if not more:
+                break
+            start = next_start
+            page = future.result() if future else _fetch(start)
+    finally:
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def user_items(gis, user, folder: dict = None, prefetch: bool = False):
+    """Yields the items of a user in a folder, with no limit on the number of items
+
+    Args:
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        user (User): Owner of items
+        folder (dict, optional): Folder as returned by User.folders, the root folder if not supplied. Defaults to None.
+        prefetch (bool, optional): Flag to request the next page while the current page is processed. Defaults to False.
+
+    Yields:
+        Item: Item in folder
+    """
+    from arcgis.gis import Item
+    path = f"content/users/{user.username}"
+    if folder and folder.get("id"):
+        path += f"/{folder['id']}"
+    for i in paged(gis, path, prefetch=prefetch):
+        yield Item(gis, i["id"], i)
+
+
+def group_items(gis, group, prefetch: bool = False):
+    """Yields the items shared to a group, with no limit on the number of items
+
+    Args:
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        group (Group): Group to list
+        prefetch (bool, optional): Flag to request the next page while the current page is processed. Defaults to False.
+
+    Yields:
+        Item: Item shared to group
+    """
+    from arcgis.gis import Item
+    for i in paged(gis, f"content/groups/{group['id']}", prefetch=prefetch):
+        yield Item(gis, i["id"], i)
+
+
+class Catalogue:
+    """Cached catalogue of the items owned by a user, letting the config GUI show items before the portal is listed
+
+    A catalogue is saved per portal and username. It is refreshed incrementally by searching for items modified since
+    the newest modified time it holds, and is listed in full when invalidated or when its item count no longer matches
+    the portal, i.e. once items have been deleted.
+    """
+
+    def __init__(self, portal: str, uname: str):
+        """Load cached catalogue for a portal and username, empty if not cached
+
+        Args:
+            portal (str): Portal url
+            uname (str): Username
+        """
+        self.path = os.path.join(CATALOGUE_DIR, f"{_cache_key(portal, uname)}.json")
+        self.items = []
+        self.modified = None
+        try:
+            with open(self.path, "r") as f:
+                cached = json.load(f)
+            self.items = cached["items"]
+            self.modified = cached["modified"]
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        """Saves catalogue to the cache
+        """
+        os.makedirs(CATALOGUE_DIR, exist_ok=True)
+        # Write to a temp file then move into place
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"modified": self.modified, "items": self.items}, f)
+        os.replace(tmp_path, self.path)
+
+    def invalidate(self):
+        """Empties catalogue, the next refresh lists every item
+        """
+        self.items = []
+        self.modified = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def refresh(self, ago: "Agol"):
+        """Brings catalogue up to date with the portal, saving it to the cache
+
+        Args:
+            ago (Agol): Connection to portal
+
+        Returns:
+            bool: Flag to indicate if the catalogue changed
+        """
+        gis = ago.gis
+        me = gis.users.me
+        folders = [{"id": None, "title": ""}] + list(me.folders)
+        if self.modified is None:
+            # List every item
+            items = [self._entry(i, i["folder"]) for i in ago.myitems]
+        else:
+            # Search for items modified since the high-water mark
+            titles = {f["id"]: f["title"] for f in folders}
+            since = max(0, int(self.modified - CATALOGUE_OVERLAP * 1000))
+            until = int((time.time() + 86400) * 1000)
+            params = {"q": f'owner:"{me.username}" AND modified:[{since:019d} TO {until:019d}]', "sortField": "modified"}
+            found = {i["id"]: self._entry(i, titles.get(i.get("ownerFolder"), "")) for i in paged(gis, "search", "results", params)}
+            # Merge into catalogue, in the order of folders then title and type
+            items = [i for i in self.items if i["id"] not in found] + list(found.values())
+            order = {f["title"]: pos for pos, f in enumerate(folders)}
+            items.sort(key=lambda i: (order.get(i["folder"], len(order)), f"{i['title']}_{i['type']}"))
+            # List every item if items have been deleted
+            total = gis._con.get(f"{gis._portal.resturl}search", {"q": f'owner:"{me.username}"', "num": 1, "f": "json"})["total"]
+            if total != len(items):
+                items = [self._entry(i, i["folder"]) for i in ago.myitems]
+        changed = items != self.items
+        self.items = items
+        self.modified = max([i["modified"] for i in items], default=None)
+        self.save()
+        return changed
+
+    @staticmethod
+    def _entry(item, folder: str):
+        # Get the fields of an item shown by the config GUI
+        return {"id": item["id"], "title": item["title"], "type": item["type"], "folder": folder, "modified": item["modified"]}
 
 
 class Agol:
     _logger = None
     _gis = None
     _error = None
+    _expires = None
 
-    def __init__(self, portal: str, uname: str, pword: str, logger: logging):
+    def __init__(self, portal: str, uname: str, pword: str, logger: logging, rate: float = None, token_cache: bool = False):
+        # Import the ArcGIS API when first connecting as it is slow to import
+        from arcgis.gis import GIS
         # Get logger
         self._logger = logger
         # Connect to portal
         try:
-            # Connect to portal, collecting connection
-            self._gis = GIS(portal, uname, pword)
+            # Try cached token, falling back to login
+            if token_cache:
+                self._gis = self._token_login(portal, uname, pword)
+            if not self._gis:
+                # Connect to portal, collecting connection
+                if token_cache:
+                    self._gis = GIS(portal, uname, pword, expiration=TOKEN_EXPIRATION)
+                    self._cache_token(portal, uname, pword)
+                else:
+                    self._gis = GIS(portal, uname, pword)
+            # Send requests through the governor for the portal
+            governor.install(self._gis, portal, rate, logger)
             # Provide success
             self._logger.info(f"Connected to {portal}")
         except ConnectionRefusedError:
@@ -42,6 +335,33 @@ class Agol:
             msg = "Error authenticating while connecting to portal"
             self._logger.exception(msg)
 
+    def _token_login(self, portal: str, uname: str, pword: str):
+        # Connect with a cached token
+        cached = load_token(portal, uname, pword)
+        if not cached:
+            return None
+        from arcgis.gis import GIS
+        try:
+            gis = GIS(portal, token=cached[0])
+            # Check token is accepted
+            if gis.users.me is None:
+                return None
+        except Exception:
+            self._logger.debug("Cached token rejected, logging in")
+            return None
+        self._expires = cached[1]
+        self._logger.debug("Connected with cached token")
+        return gis
+
+    def _cache_token(self, portal: str, uname: str, pword: str):
+        # Cache token of the connection
+        try:
+            token = self._gis._con.token
+            if token:
+                save_token(portal, uname, pword, token, time.time() + TOKEN_EXPIRATION * 60)
+        except Exception:
+            self._logger.debug("Could not cache token", exc_info=True)
+
     @property
     def gis(self):
         # Return gis
@@ -52,41 +372,27 @@ class Agol:
         # Return errors
         return self._error
 
+    @property
+    def expired(self):
+        # Return if a connection made with a cached token has expired, login connections renew their own tokens
+        return self._expires is not None and self._expires - TOKEN_MARGIN < time.time()
+
     @property
     def myitems(self):
-        # Setup items object with items not in a folder
-        myitems = []
-        # Return my items not in a folder
+        # Resolve user once, folders are listed in its name
         me = self._gis.users.me
-        folders = me.folders
-        # Setup request objects
-        requests = []
-        requests.append({'id': None, 'title': ''})
-        # Process folders
-        for f in folders:
-            # Setup folder args
-            requests.append(f)
-        # Request folder items
-        for r in requests:
-            # Collect items
-            items = self._gis.users.me.items(folder=r, max_items=9999)
-
-            def _gettitle(i: dict):
-                """Sort function
-
-                Args:
-                    i (dict): Item as dict to get key for sorting
-
-                Returns:
-                    str: Value for sort function
-                """
-                return f"{i['title']}_{i['type']}"
-            # Sort list
-            items.sort(key=_gettitle)
-            # Add folder to each item
-            for itm in items:
-                itm['folder'] = r['title']
-            # Build result list
-            myitems += items
+        # Setup request objects, starting with items not in a folder
+        requests = [{'id': None, 'title': ''}] + list(me.folders)
+        # Request folder items at the same time, paging through folders of any size
+        with ThreadPoolExecutor(max_workers=FOLDER_WORKERS, thread_name_prefix="folder") as pool:
+            listings = pool.map(lambda r: list(user_items(self._gis, me, r)), requests)
+            # Add folder to each item, keeping the position of its folder for sorting
+            myitems = []
+            for pos, (r, items) in enumerate(zip(requests, listings)):
+                for itm in items:
+                    itm['folder'] = r['title']
+                    myitems.append((pos, f"{itm['title']}_{itm['type']}", itm))
+        # Sort by folder then title and type in one pass
+        myitems.sort(key=lambda i: i[:2])
         # Return result
-        return myitems
+        return [i[2] for i in myitems]
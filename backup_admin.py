@@ -1,18 +1,128 @@
 import os
+import json
+import time
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import logging
-from arcgis.gis import GIS
+from typing import TYPE_CHECKING
 import log
 import util
+import metrics
+import state as st
 import agol
 import pathlib
 
+# Type hints only, the ArcGIS API is imported by agol on connecting
+if TYPE_CHECKING:
+    from arcgis.gis import GIS
+
 _options = {'self': ['item', 'groups', 'usrtypes', 'folders', 'linked', 'items', 'url', 'thumbnail', 'all'],
             'users': ['item', 'url', 'thumbnail', 'all'],
             'groups': ['item', 'items', 'url', 'thumbnail', 'members', 'all']}
+# Default number of users or groups backed up at the same time
+DEFAULT_WORKERS = 8
+# Maximum number of users or groups listed, folders are only removed if the listing is below this
+MAX_ENTITIES = 100000
+
+
+def _modified(entity):
+    # Get modified time of user or group in seconds since epoch
+    return entity["modified"] / 1000 if entity["modified"] else None
+
+
+def _digest(*parts):
+    # Get digest of the parts of a user or group backup which do not change its modified time
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _collect_keys(items, keys: list):
+    # Yield items, collecting their ids and modified times for the group digest
+    for i in items:
+        keys.append((i.itemid, i["modified"]))
+        yield i
+
+
+def _fingerprint(group, options: list):
+    # Get digest of group options, members and item modified times, listing only the fields needed
+    members = group.get_members() if "members" in options or "all" in options else None
+    keys = []
+    if "items" in options or "all" in options:
+        keys = [(i["id"], i["modified"]) for i in agol.paged(group._gis, f"content/groups/{group['id']}")]
+    return _digest(sorted(options), members, keys)
+
+
+def _not_modified(entity_dir: str, kind: str, entity, state: st.State):
+    # Check if modified time of user or group is unchanged since its last successful backup
+    if state is None or not os.path.exists(entity_dir):
+        return False
+    modified = _modified(entity)
+    return modified is not None and state.source(entity["id"], kind)[0] == modified
+
+
+def _unchanged(entity_dir: str, kind: str, entity, digest: str, state: st.State):
+    # Check if user or group is unchanged since its last successful backup
+    return _not_modified(entity_dir, kind, entity, state) and state.source(entity["id"], kind)[1] == digest
+
 
+def _remove_missing(entity_dir: str, kind: str, entities: list, state: st.State, changes: util.ChangeSet, logger: logging):
+    """Removes the folders of users or groups which no longer exist
 
-def backup_self(gis: GIS, directory: str, options: list, logger: logging):
+    Args:
+        entity_dir (str): Folder holding user or group folders
+        kind (str): Kind of entity, user or group
+        entities (list): Users or groups which exist
+        state (State): Backup state index to remove records from, if supplied
+        changes (ChangeSet): Change set to record removed paths in
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Skip if listing may be incomplete
+    if len(entities) >= MAX_ENTITIES:
+        logger.warning(f" > {len(entities)} {kind}s listed, not removing missing {kind}s")
+        return
+    ids = {e["id"] for e in entities}
+    # Skip staging dirs, which start with a dot
+    missing = [f for f in os.listdir(entity_dir) if not f.startswith(".") and f not in ids and os.path.isdir(os.path.join(entity_dir, f))]
+    for f in missing:
+        logger.debug(f" > Removing {kind} {f}")
+        shutil.rmtree(os.path.join(entity_dir, f))
+        if changes is not None:
+            changes.add_tree(os.path.join(entity_dir, f))
+    if state is not None:
+        state.forget(missing, kind)
+
+
+def _run_entities(kind: str, entities, fn, args: list, workers: int, logger: logging):
+    """Backs up users or groups using a pool of workers, an error backing up one entity does not stop the others
+
+    Args:
+        kind (str): Kind of entity, user or group
+        entities (iterable): Users or groups to backup
+        fn (callable): Function backing up a single entity, called with the entity, args and a logger prefixed with its id
+        args (list): Arguments passed to fn after the entity
+        workers (int): Number of entities to backup at the same time
+        logger (logging): logging object to pass to tool for logging purposes
+
+    Returns:
+        int: Number of entities which failed
+    """
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=kind) as pool:
+        futures = {}
+        for entity in entities:
+            futures[metrics.submit(pool, fn, entity, *args, log.ItemLogger(logger, entity["id"]))] = entity
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                # Log error and continue with remaining entities
+                failed += 1
+                logger.exception(f" > Unexpected error backing up {kind} {futures[future]['id']}")
+    return failed
+
+
+def backup_self(gis: "GIS", directory: str, options: list, logger: logging, changes: util.ChangeSet = None):
     """Module to grab self items and their associated resources from ArcGIS Online and to save them to disk
 
     Args:
@@ -20,110 +130,61 @@ def backup_self(gis: GIS, directory: str, options: list, logger: logging):
         directory (str): Output directory for data extracted in this tool
         options (list): Options for backup, currently supported options are item, groups, usrtypes, folders, linked, items, url, thumbnail and all
         logger (logging): logging object to pass to tool for logging purposes
+        changes (ChangeSet): Change set to record written and removed paths in (Default None)
     """
     # Setup admin folder
     directory = os.path.join(directory, "admin")
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    os.makedirs(directory, exist_ok=True)
     # Process user
     user = gis.users.me
     # Setup user path
     usr_dir = os.path.join(directory, user["id"])
-    # Setup group dir path
-    util.setup_dir(usr_dir)
-    # Update user if requested
-    if "item" in options or "all" in options:
-        # Update status
-        logger.debug(" > User Info")
-        usr_path = f"{usr_dir}/user.json"
-        # Export data
-        util.export_agolclass(usr_path, user)
-    # Get groups if requested
-    if "groups" in options or "all" in options:
-        # Update status
-        logger.debug(" > Groups")
-        usr_grps = f"{usr_dir}/groups.json"
-        util.export_agolclass_list(usr_grps, user.groups)
-    # Get user types if requested
-    if "usrtypes" in options or "all" in options:
-        # Update status
-        logger.debug(" > User Types")
-        usrtyp_path = f"{usr_dir}/usertypes.json"
-        util.export_agolclass(usrtyp_path, user.user_types)
-    # Get folders if requested
-    if "folders" in options or "all" in options:
-        # Update status
-        logger.debug(" > Folders")
-        usr_folders = f"{usr_dir}/folders.json"
-        util.export_obj(usr_folders, user.folders)
-    # Get linked accounts if requested
-    if "linked" in options or "all" in options:
-        # Update status
-        logger.debug(" > Linked Accounts")
-        usr_linkedacc = f"{usr_dir}/linked_accounts.json"
-        util.export_agolclass_list(usr_linkedacc, user.linked_accounts)
-    # Get content if requested
-    if "items" in options or "all" in options:
-        # Update status
-        logger.debug(" > Items")
-        usr_cnt = f"{usr_dir}/items.json"
-        # Setup items var
-        items = []
-        # Preporocess items
-        for i in user.items(max_items=9999):
-            # Get item dict
-            items.append(i)
-        util.export_agolclass_list(usr_cnt, items)
-    # Save URL if requested
-    if "url" in options or "all" in options:
-        # Update status
-        logger.debug(" > URL")
-        usr_url = f"{usr_dir}/me.url"
-        util.export_url(usr_url, user.homepage)
-    # Get thumbnail if requested
-    if "thumbnail" in options or "all" in options:
-        # Update status
-        logger.debug(" > Thumbnail")
-        user.download_thumbnail(usr_dir)
-    # Write timestamp
-    util.set_ts(os.path.join(directory, 'lastupdate.ts'))
-
-
-def backup_users(gis: GIS, directory: str, options: list, logger: logging):
-    """Module to grab user items and their associated resources from ArcGIS Online and to save them to disk
-
-    Args:
-        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
-        directory (str): Output directory for data extracted in this tool
-        options (list): Options for backup, currently supported options are item, url, thumbnail and all
-        logger (logging): logging object to pass to tool for logging purposes
-    """
-    # Setup groups folder
-    directory = os.path.join(directory, "admin")
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    # Setup groups folder
-    users_dir = os.path.join(directory, "users")
-    if not os.path.exists(users_dir):
-        os.makedirs(users_dir)
-    # Process groups
-    for user in gis.users.search():
-        # Setup user path
-        usr_dir = os.path.join(users_dir, user["id"])
-        # Setup group dir path
-        util.setup_dir(usr_dir)
-        # Update user groups if requested
+    # Stage dir, only files which have changed are written to it on completion
+    with util.StagedDir(usr_dir, changes=changes) as stage:
+        usr_dir = stage.path
+        # Update user if requested
         if "item" in options or "all" in options:
             # Update status
             logger.debug(" > User Info")
             usr_path = f"{usr_dir}/user.json"
             # Export data
             util.export_agolclass(usr_path, user)
+        # Get groups if requested
+        if "groups" in options or "all" in options:
+            # Update status
+            logger.debug(" > Groups")
+            usr_grps = f"{usr_dir}/groups.json"
+            util.export_agolclass_list(usr_grps, user.groups)
+        # Get user types if requested
+        if "usrtypes" in options or "all" in options:
+            # Update status
+            logger.debug(" > User Types")
+            usrtyp_path = f"{usr_dir}/usertypes.json"
+            util.export_agolclass(usrtyp_path, user.user_types)
+        # Get folders if requested
+        if "folders" in options or "all" in options:
+            # Update status
+            logger.debug(" > Folders")
+            usr_folders = f"{usr_dir}/folders.json"
+            util.export_obj(usr_folders, user.folders)
+        # Get linked accounts if requested
+        if "linked" in options or "all" in options:
+            # Update status
+            logger.debug(" > Linked Accounts")
+            usr_linkedacc = f"{usr_dir}/linked_accounts.json"
+            util.export_agolclass_list(usr_linkedacc, user.linked_accounts)
+        # Get content if requested
+        if "items" in options or "all" in options:
+            # Update status
+            logger.debug(" > Items")
+            usr_cnt = f"{usr_dir}/items.json"
+            # Write items as each page is read
+            util.export_agolclass_list(usr_cnt, agol.user_items(gis, user, prefetch=True))
         # Save URL if requested
         if "url" in options or "all" in options:
             # Update status
             logger.debug(" > URL")
-            usr_url = f"{usr_dir}/user.url"
+            usr_url = f"{usr_dir}/me.url"
             util.export_url(usr_url, user.homepage)
         # Get thumbnail if requested
         if "thumbnail" in options or "all" in options:
@@ -134,7 +195,152 @@ def backup_users(gis: GIS, directory: str, options: list, logger: logging):
     util.set_ts(os.path.join(directory, 'lastupdate.ts'))
 
 
-def backup_groups(gis: GIS, directory: str, options: list, logger: logging):
+def _backup_user(user, users_dir: str, options: list, changes: util.ChangeSet, state: st.State, incremental: bool, logger: logging):
+    """Backs up a single user
+
+    Args:
+        user (User): Arcgis Online user to backup
+        users_dir (str): Folder holding user folders
+        options (list): Options for backup, currently supported options are item, url, thumbnail and all
+        changes (ChangeSet): Change set to record written and removed paths in
+        state (State): Backup state index to record the user in, if supplied
+        incremental (bool): Flag to skip users not modified since their last backup
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    started = time.time()
+    # Setup user path
+    usr_dir = os.path.join(users_dir, user["id"])
+    with metrics.span("user", user["id"]) as user_span:
+        # Skip user if not modified, options are included in the digest so new options are backed up
+        digest = _digest(sorted(options))
+        if incremental and _unchanged(usr_dir, "user", user, digest, state):
+            logger.debug(" > Not modified")
+            user_span.result = "NotModified"
+            return
+        # Stage dir, only files which have changed are written to it on completion
+        with util.StagedDir(usr_dir, changes=changes) as stage:
+            usr_dir = stage.path
+            # Update user groups if requested
+            if "item" in options or "all" in options:
+                # Update status
+                logger.debug(" > User Info")
+                usr_path = f"{usr_dir}/user.json"
+                # Export data
+                util.export_agolclass(usr_path, user)
+            # Save URL if requested
+            if "url" in options or "all" in options:
+                # Update status
+                logger.debug(" > URL")
+                usr_url = f"{usr_dir}/user.url"
+                util.export_url(usr_url, user.homepage)
+            # Get thumbnail if requested
+            if "thumbnail" in options or "all" in options:
+                # Update status
+                logger.debug(" > Thumbnail")
+                user.download_thumbnail(usr_dir)
+    # Record user
+    if state is not None:
+        state.record(user["id"], "user", "Success", True, started, _modified(user), digest=digest)
+
+
+def backup_users(gis: "GIS", directory: str, options: list, logger: logging, changes: util.ChangeSet = None, workers: int = DEFAULT_WORKERS, state: st.State = None, incremental: bool = False):
+    """Module to grab user items and their associated resources from ArcGIS Online and to save them to disk
+
+    Args:
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        directory (str): Output directory for data extracted in this tool
+        options (list): Options for backup, currently supported options are item, url, thumbnail and all
+        logger (logging): logging object to pass to tool for logging purposes
+        changes (ChangeSet): Change set to record written and removed paths in (Default None)
+        workers (int): Number of users to backup at the same time (Default 8)
+        state (State): Backup state index to record users in (Default None)
+        incremental (bool): Flag to only backup users modified since their last backup, requires state (Default False)
+
+    Returns:
+        int: Number of users which failed to backup
+    """
+    # Setup groups folder
+    directory = os.path.join(directory, "admin")
+    os.makedirs(directory, exist_ok=True)
+    # Setup groups folder
+    users_dir = os.path.join(directory, "users")
+    os.makedirs(users_dir, exist_ok=True)
+    # Process users
+    users = gis.users.search(max_users=MAX_ENTITIES)
+    failed = _run_entities("user", users, _backup_user, [users_dir, options, changes, state, incremental], workers, logger)
+    # Remove users which no longer exist
+    _remove_missing(users_dir, "user", users, state, changes, logger)
+    # Write timestamp
+    util.set_ts(os.path.join(directory, 'lastupdate.ts'))
+    return failed
+
+
+def _backup_group(group, group_dir: str, options: list, changes: util.ChangeSet, state: st.State, incremental: bool, logger: logging):
+    """Backs up a single group
+
+    Args:
+        group (Group): Arcgis Online group to backup
+        group_dir (str): Folder holding group folders
+        options (list): Options for backup, currently supported options are item, items, url, thumbnail, members and all
+        changes (ChangeSet): Change set to record written and removed paths in
+        state (State): Backup state index to record the group in, if supplied
+        incremental (bool): Flag to skip groups not modified since their last backup
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    started = time.time()
+    # Setup group path
+    grp_dir = os.path.join(group_dir, group["id"])
+    with metrics.span("group", group["id"]) as group_span:
+        # Skip group if not modified, only fingerprinting members and content if the group modified time is unchanged
+        # as changes to them do not update it
+        if incremental and _not_modified(grp_dir, "group", group, state):
+            if _unchanged(grp_dir, "group", group, _fingerprint(group, options), state):
+                logger.debug(" > Not modified")
+                group_span.result = "NotModified"
+                return
+        # Stage dir, only files which have changed are written to it on completion
+        with util.StagedDir(grp_dir, changes=changes) as stage:
+            grp_dir = stage.path
+            # Get members if requested
+            members = None
+            if "members" in options or "all" in options:
+                # Update status
+                logger.debug(" > Members")
+                grp_members = f"{grp_dir}/members.json"
+                members = group.get_members()
+                util.export_obj(grp_members, members)
+            # Get content if requested
+            keys = []
+            if "items" in options or "all" in options:
+                # Update status
+                logger.debug(" > Items")
+                grp_items = f"{grp_dir}/items.json"
+                # Write items as each page is read, keeping their ids and modified times for the digest
+                util.export_agolclass_list(grp_items, _collect_keys(agol.group_items(group._gis, group), keys))
+            # Get digest of members and content, compared by the next incremental run
+            digest = _digest(sorted(options), members, keys)
+            # Get group if requested
+            if "item" in options or "all" in options:
+                # Update status
+                logger.debug(" > Group Info")
+                grp_path = f"{grp_dir}/group.json"
+                util.export_agolclass(grp_path, group)
+            # Get URL if requested
+            if "url" in options or "all" in options:
+                # Update status
+                logger.debug(" > URL")
+                util.export_url(f"{grp_dir}/group.url", group.homepage)
+            # Get thumbnail if requested
+            if "thumbnail" in options or "all" in options:
+                # Update status
+                logger.debug(" > Thumbnail")
+                group.download_thumbnail(grp_dir)
+    # Record group
+    if state is not None:
+        state.record(group["id"], "group", "Success", True, started, _modified(group), digest=digest)
+
+
+def backup_groups(gis: "GIS", directory: str, options: list, logger: logging, changes: util.ChangeSet = None, workers: int = DEFAULT_WORKERS, state: st.State = None, incremental: bool = False):
     """Module to grab group items and their associated resources from ArcGIS Online and to save them to disk
 
     Args:
@@ -142,57 +348,28 @@ def backup_groups(gis: GIS, directory: str, options: list, logger: logging):
         directory (str): Output directory for data extracted in this tool
         options (list): Options for backup, currently supported options are item, items, url, thumbnail, members and all
         logger (logging): logging object to pass to tool for logging purposes
+        changes (ChangeSet): Change set to record written and removed paths in (Default None)
+        workers (int): Number of groups to backup at the same time (Default 8)
+        state (State): Backup state index to record groups in (Default None)
+        incremental (bool): Flag to only backup groups modified since their last backup, requires state (Default False)
+
+    Returns:
+        int: Number of groups which failed to backup
     """
     # Setup groups folder
     directory = os.path.join(directory, "admin")
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    os.makedirs(directory, exist_ok=True)
     # Setup groups folder
     group_dir = os.path.join(directory, "groups")
-    if not os.path.exists(group_dir):
-        os.makedirs(group_dir)
+    os.makedirs(group_dir, exist_ok=True)
     # Process groups
-    for group in gis.groups.search():
-        # Setup group path
-        grp_dir = os.path.join(group_dir, group["id"])
-        # Setup group dir path
-        util.setup_dir(grp_dir)
-        # Get group if requested
-        if "item" in options or "all" in options:
-            # Update status
-            logger.debug(" > Group Info")
-            grp_path = f"{grp_dir}/group.json"
-            util.export_agolclass(grp_path, group)
-        # Get group members if requested
-        if "members" in options or "all" in options:
-            # Update status
-            logger.debug(" > Members")
-            grp_members = f"{grp_dir}/members.json"
-            util.export_obj(grp_members, group.get_members())
-        # Get content if requested
-        if "items" in options or "all" in options:
-            # Update status
-            logger.debug(" > Items")
-            grp_items = f"{grp_dir}/items.json"
-            # Setup items var
-            items = []
-            # Preporocess items
-            for i in group.content(9999):
-                # Add item to list
-                items.append(i)
-            util.export_agolclass_list(grp_items, items)
-        # Get URL if requested
-        if "url" in options or "all" in options:
-            # Update status
-            logger.debug(" > URL")
-            util.export_url(f"{grp_dir}/group.url", group.homepage)
-        # Get thumbnail if requested
-        if "thumbnail" in options or "all" in options:
-            # Update status
-            logger.debug(" > Thumbnail")
-            group.download_thumbnail(grp_dir)
+    groups = gis.groups.search(max_groups=MAX_ENTITIES)
+    failed = _run_entities("group", groups, _backup_group, [group_dir, options, changes, state, incremental], workers, logger)
+    # Remove groups which no longer exist
+    _remove_missing(group_dir, "group", groups, state, changes, logger)
     # Write timestamp
     util.set_ts(os.path.join(directory, 'lastupdate.ts'))
+    return failed
 
 
 if __name__ == "__main__":
@@ -210,6 +387,19 @@ if __name__ == "__main__":
     component_parser.add_argument("username", help="AGOL Username")
     component_parser.add_argument("password", help="AGOL Password")
     component_parser.add_argument("outputdir", help="Output directory", type=pathlib.Path)
+    component_parser.add_argument(
+        "-w",
+        dest="workers",
+        default=DEFAULT_WORKERS,
+        type=int,
+        help=f"Number of users or groups to backup at the same time (Default {DEFAULT_WORKERS})",
+    )
+    component_parser.add_argument(
+        "-i",
+        action="store_true",
+        dest="incremental",
+        help="Incremental, only backup users or groups modified since the last backup",
+    )
     component_parser.add_argument(
         "-v",
         action="store_true",
@@ -269,14 +459,22 @@ if __name__ == "__main__":
         ago = agol.Agol(args.portal, args.username, args.password, logger)
         # Update status
         log.post(logger, "- Collecting Group Items")
+        # Open state index, used to find users and groups modified since the last backup
+        state = None
+        if args.incremental:
+            os.makedirs(args.outputdir, exist_ok=True)
+            state = st.State(str(args.outputdir))
         # Run with args
-        if args.component == 'self':
-            backup_self(ago.gis, directory=args.outputdir, options=args.options, logger=logger)
-        elif args.component == 'users':
-            backup_users(ago.gis, directory=args.outputdir, options=args.options, logger=logger)
-        elif args.component == 'self':
-            backup_groups(ago.gis, directory=args.outputdir, options=args.options, logger=logger)
-            
+        try:
+            if args.component == 'self':
+                backup_self(ago.gis, directory=args.outputdir, options=args.options, logger=logger)
+            elif args.component == 'user':
+                backup_users(ago.gis, directory=args.outputdir, options=args.options, logger=logger, workers=args.workers, state=state, incremental=args.incremental)
+            elif args.component == 'group':
+                backup_groups(ago.gis, directory=args.outputdir, options=args.options, logger=logger, workers=args.workers, state=state, incremental=args.incremental)
+        finally:
+            if state is not None:
+                state.close()
     except Exception:
         # Catch everything else
         msg = "Script failed unexpectedly"
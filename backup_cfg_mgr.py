@@ -1,11 +1,11 @@
 # /usr/bin/python3
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import messagebox
 import tkinter.ttk as ttk
 from tkinter import filedialog
-from pygubu.widgets.tkscrolledframe import TkScrolledFrame
 import agol
 import log
 import util
@@ -22,7 +22,13 @@ PROJECT_PATH = pathlib.Path(__file__).parent
 CONFIG_PATH = f"{PROJECT_PATH}/config"
 TITLE = "Backup Manager GUI"
 CONFIG_BLANK = {"label": "Unnamed", "outdir": '', "portal": "", "pword": "", "uname": "", "admin": {"hours_diff": 168.0, "component": ['all'], "options": ["all"]}, "items": {}}
+# Milliseconds between checks for a finished catalogue refresh
+CATALOGUE_POLL = 100
 FREQUENCY_OPTIONS = {'Ignore': 0.0, 'Hourly': 1.0, 'Daily': 24.0, 'Weekly': 168.0, 'Fortnightly': 336.0, 'Montly': 730.0, 'Quarterly': 2190.0, 'Yearly': 8760.0, 'Custom': None}
+# Columns of the item grid after the item title, with their heading and width
+GRID_COLUMNS = {'folder': ('Folder', 120), 'type': ('Type', 130), 'id': ('ID', 230), 'last': ('Last Updated', 120), 'freq': ('Freq', 80), 'hours': ('Hours', 60), 'options': ('Options', 100), 'format': ('Format', 80)}
+# Ids of admin items, which have no options or format
+ADMIN_IDS = ['self', 'users', 'groups']
 
 
 class BackupMgrGUI:
@@ -31,6 +37,10 @@ class BackupMgrGUI:
     _cfg = CONFIG_BLANK
     _items = {}
     _ago = None
+    _catalogue = None
+    _catalogue_job = None
+    _connect_job = None
+    _editor = None
 
     def __init__(self, master: tk.Tk, logger: logging):
         """Initiate the Backup Manager GUI
@@ -51,6 +61,9 @@ class BackupMgrGUI:
         self._gui.rowconfigure(6, weight=1)
         # Capture logger
         self._logger = logger
+        # Setup worker to refresh the item catalogue in the background, shut down when the GUI is closed
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalogue")
+        self._gui.protocol("WM_DELETE_WINDOW", self._quit)
         # Setup vars
         self._exportadmin = tk.BooleanVar(value=True)
         self._exportme = tk.BooleanVar(value=True)
@@ -80,7 +93,7 @@ class BackupMgrGUI:
         menu_file.add_command(label="Save", command=self.config_save)
         menu_file.add_command(label="Save As", command=self.config_saveas)
         menu_file.add_separator()
-        menu_file.add_command(label="Exit", command=self._gui.quit)
+        menu_file.add_command(label="Exit", command=self._quit)
         menu_main.add_cascade(label="File", menu=menu_file)
         # Add run commands
         menu_run = tk.Menu(menu_main, tearoff=0)
@@ -173,14 +186,36 @@ class BackupMgrGUI:
         self.txt_filter.configure(font='{Arial} 8 {}', textvariable=self._filter)
         self.txt_filter.grid(column=3, padx=2, pady=2, row=0, sticky='ew')
         btn_refresh = tk.Button(frame_items)
-        btn_refresh.configure(font='{Arial} 8 {}', text='Refresh', command=self._loaditems)
+        btn_refresh.configure(font='{Arial} 8 {}', text='Refresh', command=lambda: self._loaditems(refresh=True))
         btn_refresh.grid(column=4, row=0, sticky='e', padx=2, pady=2)
-        # Setup items frame
-        self.frame_items = TkScrolledFrame(self._gui, scrolltype='both')
-        self.frame_items.innerframe.configure(bg='white')
-        self.frame_items.innerframe.columnconfigure(0, weight=1)
-        self.frame_items.configure(usemousewheel=True)
-        self.frame_items.grid(column=0, row=6, padx=5, pady=5, sticky='nesw', columnspan=2)
+        # Setup items grid, rows are drawn by the treeview so the only item widget is the editor in use
+        frame_grid = tk.Frame(self._gui)
+        frame_grid.columnconfigure(0, weight=1)
+        frame_grid.rowconfigure(0, weight=1)
+        frame_grid.grid(column=0, row=6, padx=5, pady=5, sticky='nesw', columnspan=2)
+        style = ttk.Style(self._gui)
+        style.configure('Items.Treeview', font='{Arial} 8 {}', rowheight=22)
+        style.configure('Items.Treeview.Heading', font='{Arial} 8 {bold}')
+        self.tree_items = ttk.Treeview(frame_grid, columns=list(GRID_COLUMNS), style='Items.Treeview', selectmode='browse')
+        self.tree_items.heading('#0', text='Item', anchor='w')
+        self.tree_items.column('#0', width=300, stretch=True)
+        for k, (text, width) in GRID_COLUMNS.items():
+            self.tree_items.heading(k, text=text, anchor='w')
+            self.tree_items.column(k, width=width, stretch=False)
+        self.tree_items.tag_configure('unselected', foreground='#808080')
+        self.tree_items.grid(column=0, row=0, sticky='nesw')
+        # Setup scrollbars, closing the editor when the grid scrolls
+        scroll_y = ttk.Scrollbar(frame_grid, orient='vertical', command=self.tree_items.yview)
+        scroll_y.grid(column=1, row=0, sticky='ns')
+        scroll_x = ttk.Scrollbar(frame_grid, orient='horizontal', command=self.tree_items.xview)
+        scroll_x.grid(column=0, row=1, sticky='ew')
+        self.tree_items.configure(
+            yscrollcommand=lambda first, last: (self._close_editor(), scroll_y.set(first, last)),
+            xscrollcommand=lambda first, last: (self._close_editor(), scroll_x.set(first, last)))
+        # Setup item events
+        self.tree_items.bind('<Button-1>', self._click_item)
+        self.tree_items.bind('<Double-Button-1>', self._edit_item)
+        self.tree_items.bind('<space>', lambda e: self._toggle_item(self.tree_items.focus()))
         # Set main window
         self.mainwindow = self._gui
 
@@ -191,24 +226,6 @@ class BackupMgrGUI:
         else:
             self.frame_admin.grid_remove()
 
-    def _populate_hours(self, source_var: tk.StringVar, target_var: tk.StringVar, target_ctl: tk.Entry):
-        """Handler to populate hours on the form based on frequency combobox
-
-        Args:
-            source_var (tk.StringVar): Frequency combo box variable
-            target_var (tk.StringVar): Hours text box variable
-            target_ctl (tk.Entry): Hours entry control to update
-        """
-        # Update the hours of the target field if valid
-        freq = source_var.get()
-        hours = FREQUENCY_OPTIONS[freq]
-        # Update hours
-        if hours or (hours == 0.0):
-            target_var.set(hours)
-            target_ctl.configure(state="readonly")
-        else:
-            target_ctl.configure(state="normal")
-
     def config_new(self, e=None):
         """Sets up a new config item
 
@@ -313,9 +330,26 @@ class BackupMgrGUI:
             # Set admin to blank
             self._cfg['admin'] = None
         # Process items
+        self._sync_items()
+        # Update config items
+        try:
+            # Save object
+            util.export_obj(path, self._cfg)
+            # Update page title
+            msg = os.path.basename(self._cfgpath.get())
+            self._update_title(msg)
+        except IOError as err:
+            # Display save failed error
+            messagebox.showerror(
+                "Save Failed", f"Save was not successful.\n{str(err)}")
+
+    def _sync_items(self):
+        """Updates config items from the item grid
+        """
+        # Process items
         for k, i in self._items.items():
             # Check if export is requested
-            if i['selected'].get():
+            if i['selected']:
                 # Get item
                 try:
                     itm = self._cfg['items'][i['id']]
@@ -323,26 +357,15 @@ class BackupMgrGUI:
                     itm = {}
                     self._cfg['items'][i['id']] = itm
                 # Update data
-                itm['hours_diff'] = i['hours_diff'].get()
-                itm['options'] = i['options'].get().split(',')
-                itm['format'] = i['format'].get()
+                itm['hours_diff'] = i['hours_diff']
+                itm['options'] = i['options'].split(',')
+                itm['format'] = i['format']
             else:
                 # Remove item
                 try:
                     del self._cfg['items'][i['id']]
                 except KeyError:
                     pass
-        # Update config items
-        try:
-            # Save object
-            util.export_obj(path, self._cfg)
-            # Update page title
-            msg = os.path.basename(self._cfgpath.get())
-            self._update_title(msg)
-        except IOError as err:
-            # Display save failed error
-            messagebox.showerror(
-                "Save Failed", f"Save was not successful.\n{str(err)}")
 
     def config_saveas(self, e=None):
         """Prompt for a path to save config file to
@@ -376,15 +399,43 @@ class BackupMgrGUI:
             self._config_save(self._cfgpath.get())
 
     def _agol_connect(self, init: bool = False):
-        """Connects to AGOL or Portal instance
+        """Connects to AGOL or Portal instance in the background, showing the cached catalogue while signing in
 
         Args:
             init (bool, optional): Flag to indicate if this call is being made in init. Defaults to False.
         """
-        # Attempt connection to AGOL
-        self._ago = agol.Agol(self._portal.get(), self._uname.get(), self._pword.get(), logger)
+        # Drop any running refresh of the previous connection
+        self._catalogue_job = None
+        # Show cached items for portal and user straight away
+        self._close_editor()
+        self._catalogue = agol.Catalogue(self._portal.get(), self._uname.get())
+        self._showitems(self._catalogue.items)
+        # Sign in on the background worker, superseding any earlier attempt
+        self._connect_job = self._pool.submit(agol.Agol, self._portal.get(), self._uname.get(), self._pword.get(), logger)
+        self._gui.after(CATALOGUE_POLL, self._poll_connect, self._connect_job, init)
+
+    def _poll_connect(self, job, init: bool):
+        """Finishes connecting once the background sign in completes, called on the UI thread by after
+
+        Args:
+            job (Future): Sign in job
+            init (bool): Flag to indicate if the connection was made in init
+        """
+        # Ignore superseded attempts
+        if job is not self._connect_job:
+            return
+        # Check again later if still running
+        if not job.done():
+            self._gui.after(CATALOGUE_POLL, self._poll_connect, job, init)
+            return
+        self._connect_job = None
+        try:
+            self._ago = job.result()
+        except Exception:
+            self._logger.exception("Could not connect to portal")
+            self._ago = None
         # Test GIS connection
-        if not self._ago.gis:
+        if not (self._ago and self._ago.gis):
             # Update text colour to indicate failure
             self.txt_portal.configure(foreground='#d7191c')
             self.txt_uname.configure(foreground='#d7191c')
@@ -399,8 +450,8 @@ class BackupMgrGUI:
             self.txt_portal.configure(foreground='#1a9641')
             self.txt_uname.configure(foreground='#1a9641')
             self.txt_pword.configure(foreground='#1a9641')
-            # Reload items
-            self._loaditems(init=True)
+            # Bring the catalogue shown while signing in up to date
+            self._refresh_catalogue()
             # Show message if not init (Disabled, loading of items and changing text colour implies connection successful)
             # if not init:
             #    messagebox.showinfo('AGOL Connection Success', f'Connection to {self._portal.get()} successful!')
@@ -420,7 +471,8 @@ class BackupMgrGUI:
             reloaditems = False
         else:
             reloaditems = True
-        # Delete ago object
+        # Delete ago object, dropping any sign in still running
+        self._connect_job = None
         self._ago = None
         # Reload items
         if reloaditems:
@@ -467,233 +519,278 @@ class BackupMgrGUI:
             self._usegit.set(self._cfg["usegit"])
         else:
             self._usegit.set(True)
-        # If uname, pword and portal is supplied, test connection
+        # If uname, pword and portal is supplied, test connection, which also loads items
         if not (self._cfg["pword"] is None or self._cfg["uname"] is None or self._cfg["portal"] is None):
             self._agol_connect(init=True)
-        # Load items
-        self._loaditems(init=True)
+        else:
+            # Load items
+            self._loaditems(init=True)
         
     def _clearitems(self):
         """Clear out old items
         """
-        # Remove old items
-        for widget in self.frame_items.innerframe.winfo_children():
-            widget.destroy()
-
-    def _showTkObj(self, obj, show):
-        if show:
-            obj.grid()
-        else:
-            obj.grid_remove()
-        
+        # Remove old rows
+        self._close_editor(commit=False)
+        self.tree_items.delete(*self.tree_items.get_children())
 
     def _filteritems(self, var, index, mode):
         """Filter Items
-        
+
         """
-        filter_value = self._filter.get()
-        # Process items
-        for k, itm in self._items.items():
-            # Check if matches filter
-            match = filter_value.lower() in itm['kwords']
-            # Turn objects on or off
-            self._showTkObj(itm['chk_itm'], match)
-            self._showTkObj(itm['txt_itm_folder'], match)
-            self._showTkObj(itm['txt_itm_type'], match)
-            self._showTkObj(itm['txt_itm_id'], match)
-            self._showTkObj(itm['txt_itm_lastupd'], match)
-            self._showTkObj(itm['cmb_itm_freq'], match)
-            self._showTkObj(itm['txt_itm_hours'], match)
-            self._showTkObj(itm['txt_itm_options'], match)
-            self._showTkObj(itm['cmb_itm_format'], match)
-                
-    def _loaditems(self, init: bool = False):
-        """Load items
+        # Save any open cell edit, then redraw rows matching filter
+        self._close_editor(commit=True)
+        self._drawitems()
+
+    def _loaditems(self, init: bool = False, refresh: bool = False):
+        """Load items, showing the cached catalogue straight away and refreshing it in the background
 
         Args:
             init (bool, optional): Flag to indicate if this call is being made in init. Defaults to False.
+            refresh (bool, optional): Flag to discard the cached catalogue and list every item. Defaults to False.
         """
         # Clear items
         self._clearitems()
         # Check GIS has been loaded
         if self._ago and self._ago.gis:
-            # Setup item grid headers
-            lbl_itm_name = tk.Label(self.frame_items.innerframe, bg='white')
-            lbl_itm_name.configure(font='{Arial} 8 {bold}', text='Item')
-            lbl_itm_name.grid(column=0, row=0, sticky='w')
-            lbl_itm_folder = tk.Label(self.frame_items.innerframe, bg='white')
-            lbl_itm_folder.configure(font='{Arial} 8 {bold}', text='Folder')
-            lbl_itm_folder.grid(column=1, row=0, sticky='w')
-            lbl_itm_type = tk.Label(self.frame_items.innerframe, bg='white')
-            lbl_itm_type.configure(font='{Arial} 8 {bold}', text='Type')
-            lbl_itm_type.grid(column=2, row=0, sticky='w')
-            lbl_itm_link = tk.Label(self.frame_items.innerframe, bg='white')
-            lbl_itm_link.configure(font='{Arial} 8 {bold}', text='ID')
-            lbl_itm_link.grid(column=3, row=0, sticky='w')
-            lbl_itm_lastupd = tk.Label(self.frame_items.innerframe, bg='white')
-            lbl_itm_lastupd.configure(font='{Arial} 8 {bold}', text='Last Updated')
-            lbl_itm_lastupd.grid(column=4, row=0, sticky='w')
-            lbl_itm_freq = tk.Label(self.frame_items.innerframe, bg='white')
-            lbl_itm_freq.configure(font='{Arial} 8 {bold}', text='Freq')
-            lbl_itm_freq.grid(column=5, row=0, sticky='w')
-            lbl_itm_hours = tk.Label(self.frame_items.innerframe, bg='white')
-            lbl_itm_hours.configure(font='{Arial} 8 {bold}', text='Hours')
-            lbl_itm_hours.grid(column=6, row=0, sticky='w')
-            lbl_itm_options = tk.Label(self.frame_items.innerframe, bg='white')
-            lbl_itm_options.configure(font='{Arial} 8 {bold}', text='Options')
-            lbl_itm_options.grid(column=7, row=0, sticky='w')
-            lbl_itm_format = tk.Label(self.frame_items.innerframe, bg='white')
-            lbl_itm_format.configure(font='{Arial} 8 {bold}', text='Format')
-            lbl_itm_format.grid(column=8, row=0, sticky='w')
-            # Setup row items
-            row = 1
-            # Reset items
-            self._items = {}
-            # Setup agol items
-            me = {'id': "self", 'title': 'My Details (Admin)', 'folder': '', 'type': 'Admin Item'}
-            users = {'id': "users", 'title': 'Users (Admin)', 'folder': '', 'type': 'Admin Item'}
-            groups = {'id': "groups", 'title': 'Groups (Admin)', 'folder': '', 'type': 'Admin Item'}
-            # Add admin items
-            agol_items = [me, users, groups]
-            # Load agol items
-            agol_items += self._ago.myitems
-            # Setup admin items
-            # Collect AGOL items
-            for i in agol_items:
-                # Setup itme
-                itm = {}
-                # Get cfg item if exists
-                try:
-                    itmcfg = self._cfg['items'][i['id']]
-                except KeyError:
-                    itmcfg = None
-                # Setup item label
-                itm['id'] = i['id']
-                itm['row'] = row
-                itm['kwords'] = str(row)
-                itm['selected'] = tk.IntVar(value=1 if itmcfg else 0)
-                itm['chk_itm'] = tk.Checkbutton(self.frame_items.innerframe, text=i['title'], variable=itm['selected'], bg='white')
-                itm['chk_itm'].configure(font='{Arial} 8 {}')
-                itm['chk_itm'].grid(column=0, row=row, sticky='w', padx=2, pady=2) 
-                itm['selected'].trace('w', lambda name, index, mode, id=itm['id']: self._select_item(id))
-                itm['kwords'] += i['title']
-                itm['kwords'] += 'selected' if itmcfg else ''
-                # Setup item id
-                itm['txt_itm_folder'] = tk.Label(self.frame_items.innerframe, bg='white')
-                itm['txt_itm_folder'].configure(font='{Arial} 8 {}', text=i['folder'])
-                itm['txt_itm_folder'].grid(column=1, row=row, sticky='w', padx=2, pady=2,)
-                itm['kwords'] += i['folder']
-                # Setup item type
-                itm['txt_itm_type'] = tk.Label(self.frame_items.innerframe, bg='white')
-                itm['txt_itm_type'].configure(font='{Arial} 8 {}', text=i['type'])
-                itm['txt_itm_type'].grid(column=2, row=row, sticky='w', padx=2, pady=2)
-                itm['kwords'] += i['type']
-                # Setup item id
-                itm['txt_itm_id'] = tk.Label(self.frame_items.innerframe, bg='white')
-                itm['txt_itm_id'].configure(font='{Arial} 8 {}', text=itm['id'])
-                itm['txt_itm_id'].grid(column=3, row=row, sticky='w', padx=2, pady=2,)
-                itm['kwords'] += itm['id']
-                # Setup item last update flag
-                if itmcfg and 'last' in itmcfg:
-                    lastrun = datetime.fromisoformat(self._cfg["last"]).strftime("%Y/%m/%d %H:%M:%S")
-                else:
-                    lastrun = 'Never'
-                itm['last'] = tk.StringVar(value=lastrun)
-                itm['txt_itm_lastupd'] = tk.Label(self.frame_items.innerframe, bg='white')
-                itm['txt_itm_lastupd'].configure(font='{Arial} 8 {}', text='NA', textvariable=itm['last'])
-                itm['txt_itm_lastupd'].grid(column=4, row=row, sticky='w', padx=2, pady=2)
-                # Setup item freq
-                itm['hours_freq'] = tk.StringVar()
-                itm['cmb_itm_freq'] = ttk.Combobox(self.frame_items.innerframe, width=6)
-                itm['cmb_itm_freq'].configure(font='{Arial} 8 {}', textvariable=itm['hours_freq'], values=list(FREQUENCY_OPTIONS.keys()))
-                itm['cmb_itm_freq'].grid(column=5, row=row, sticky='ew', padx=2, pady=2)
-                # Load item freq
-                hours = itmcfg['hours_diff'] if itmcfg else 168.0
-                # Setup item hours
-                itm['hours_diff'] = tk.DoubleVar(value=hours)
-                itm['txt_itm_hours'] = tk.Entry(self.frame_items.innerframe, width=6, bg='white')
-                itm['txt_itm_hours'].configure(font='{Arial} 8 {}', relief=tk.FLAT, textvariable=itm['hours_diff'])
-                itm['txt_itm_hours'].grid(column=6, row=row, sticky='w', padx=2, pady=2)
-                # Update frequency
-                freq = [k for k, v in FREQUENCY_OPTIONS.items() if v == hours]
-                if freq:
-                    itm['hours_freq'].set(freq[0])
-                    itm['txt_itm_hours'].configure(state="readonly")
-                else:
-                    itm['hours_freq'].set('Custom')
-                    itm['txt_itm_hours'].configure(state="normal")
-                # Setup freq command
-                itm['cmb_itm_freq'].bind('<<ComboboxSelected>>', lambda e, source_var=itm['hours_freq'], target_ctl=itm['txt_itm_hours'], target_var=itm['hours_diff']: self._populate_hours(source_var, target_var, target_ctl))
-                # Setup item Options
-                itm['options'] = tk.StringVar(value=','.join(itmcfg['options']) if itmcfg else 'all')
-                itm['txt_itm_options'] = tk.Entry(self.frame_items.innerframe, width=12, bg='white')
-                itm['txt_itm_options'].configure(font='{Arial} 8 {}', relief=tk.FLAT, text='options', textvariable=itm['options'])
-                itm['txt_itm_options'].grid(column=7, row=row, sticky='w', padx=2, pady=2)
-                # Setup item format
-                export_default = 'none'
-                # Setup export formats
-                if i['type'] == "Feature Service":
-                    export_types = [f for f in agol.EXPORT_FORMATS if not f == 'spkg']
-                    export_default = 'fgdb'
-                elif i['type'] == "Vector Tile Service":
-                    export_types = ['none', 'vtpk']
-                elif i['type'] == "Scene Service":
-                    export_types = ['none', 'spkg']
-                else:
-                    export_types = ['none']
-                # Setup default
-                itm['format'] = tk.StringVar(value=itmcfg['format'] if itmcfg else export_default)
-                # Setup item format
-                itm['cmb_itm_format'] = ttk.Combobox(self.frame_items.innerframe, width=6)
-                itm['cmb_itm_format'].configure(font='{Arial} 8 {}', values=export_types, textvariable=itm['format'])
-                itm['cmb_itm_format'].grid(column=8, row=row, sticky='w', padx=2, pady=2)
-                itm['kwords'] += itm['format'].get()
-                # Disable inputs if not selected
-                if itm['selected'].get() == 0:
-                    itm['txt_itm_lastupd'].configure(state='disabled')
-                    itm['cmb_itm_freq'].configure(state='disabled')
-                    itm['txt_itm_hours'].configure(state='disabled')
-                    itm['txt_itm_options'].configure(state='disabled')
-                    itm['cmb_itm_format'].configure(state='disabled')
-                # Disable options and format for admin items
-                if itm['id'] in ['self', 'users', 'groups']:
-                    itm['txt_itm_options'].grid_remove()
-                    itm['cmb_itm_format'].grid_remove()
-                # Add item to list
-                itm['kwords'] = itm['kwords'].lower()
-                self._items[i['id']] = itm
-                # Update row placeholder
-                row += 1
+            # Get cached catalogue for portal and user
+            self._catalogue = agol.Catalogue(self._portal.get(), self._uname.get())
+            if refresh:
+                self._catalogue.invalidate()
+            # Show cached items
+            self._showitems(self._catalogue.items)
+            # Bring catalogue up to date in the background
+            self._refresh_catalogue()
         else:
+            # Drop any running refresh
+            self._catalogue_job = None
             # Check if this is the call to load items on init or if its after init
             if not init:
                 # Display message
                 messagebox.showwarning('Not connected to AGOL', 'Please connect to your portal using the button in the Connection Properties section above.')
 
-    def _select_item(self, id):
-        """Helper function to select an item
+    def _refresh_catalogue(self):
+        """Refreshes the catalogue in the background, superseding any earlier refresh
+        """
+        self._catalogue_job = self._pool.submit(self._catalogue.refresh, self._ago)
+        self._gui.after(CATALOGUE_POLL, self._poll_catalogue, self._catalogue, self._catalogue_job)
+
+    def _poll_catalogue(self, catalogue: agol.Catalogue, job):
+        """Shows refreshed catalogue items once the background refresh finishes, called on the UI thread by after
 
         Args:
-            id ([type]): Item to select
+            catalogue (agol.Catalogue): Catalogue being refreshed
+            job (Future): Refresh job
         """
-        # Get item
-        itm = self._items[id]
-        # Determine if queued for export
-        if itm['selected'].get() == 1:
-            itm['txt_itm_lastupd'].configure(state='normal')
-            itm['cmb_itm_freq'].configure(state='normal')
-            if itm['cmb_itm_freq'].get() == 'Custom':
-                itm['txt_itm_hours'].configure(state='normal')
+        # Ignore superseded refreshes
+        if job is not self._catalogue_job:
+            return
+        # Check again later if still running
+        if not job.done():
+            self._gui.after(CATALOGUE_POLL, self._poll_catalogue, catalogue, job)
+            return
+        try:
+            changed = job.result()
+        except Exception:
+            self._logger.exception("Could not refresh item catalogue")
+            return
+        # Redraw items, keeping changes made while refreshing
+        if changed:
+            self._close_editor()
+            self._sync_items()
+            self._showitems(catalogue.items)
+
+    def _showitems(self, catalogue: list):
+        """Show items in the item grid
+
+        Args:
+            catalogue (list): Catalogue items to show after the admin items
+        """
+        # Reset items
+        self._items = {}
+        # Setup agol items
+        me = {'id': "self", 'title': 'My Details (Admin)', 'folder': '', 'type': 'Admin Item'}
+        users = {'id': "users", 'title': 'Users (Admin)', 'folder': '', 'type': 'Admin Item'}
+        groups = {'id': "groups", 'title': 'Groups (Admin)', 'folder': '', 'type': 'Admin Item'}
+        # Add admin items
+        agol_items = [me, users, groups]
+        # Load agol items
+        agol_items += catalogue
+        # Collect AGOL items into the grid model
+        for row, i in enumerate(agol_items, start=1):
+            # Get cfg item if exists
+            try:
+                itmcfg = self._cfg['items'][i['id']]
+            except KeyError:
+                itmcfg = None
+            # Setup item last update flag
+            if itmcfg and 'last' in itmcfg:
+                lastrun = datetime.fromisoformat(self._cfg["last"]).strftime("%Y/%m/%d %H:%M:%S")
+            else:
+                lastrun = 'Never'
+            # Load item freq
+            hours = itmcfg['hours_diff'] if itmcfg else 168.0
+            freq = [k for k, v in FREQUENCY_OPTIONS.items() if v == hours]
+            # Setup export formats
+            export_default = 'none'
+            if i['type'] == "Feature Service":
+                export_types = [f for f in agol.EXPORT_FORMATS if not f == 'spkg']
+                export_default = 'fgdb'
+            elif i['type'] == "Vector Tile Service":
+                export_types = ['none', 'vtpk']
+            elif i['type'] == "Scene Service":
+                export_types = ['none', 'spkg']
             else:
-                itm['txt_itm_hours'].configure(state='readonly')
-            itm['txt_itm_options'].configure(state='normal')
-            itm['cmb_itm_format'].configure(state='normal')
+                export_types = ['none']
+            # Setup item
+            itm = {
+                'id': i['id'],
+                'title': i['title'],
+                'folder': i['folder'],
+                'type': i['type'],
+                'last': lastrun,
+                'selected': bool(itmcfg),
+                'freq': freq[0] if freq else 'Custom',
+                'hours_diff': hours,
+                'options': ','.join(itmcfg['options']) if itmcfg else 'all',
+                'format': itmcfg['format'] if itmcfg else export_default,
+                'formats': export_types,
+                'admin': i['id'] in ADMIN_IDS,
+            }
+            # Setup filter keywords
+            itm['kwords'] = f"{row}{i['title']}{'selected' if itmcfg else ''}{i['folder']}{i['type']}{i['id']}{itm['format']}".lower()
+            # Add item to list
+            self._items[i['id']] = itm
+        # Draw rows
+        self._drawitems()
+
+    def _drawitems(self):
+        """Draws the rows of items matching the filter
+        """
+        self._clearitems()
+        filter_value = self._filter.get().lower()
+        for itm in self._items.values():
+            if filter_value in itm['kwords']:
+                self.tree_items.insert('', 'end', iid=itm['id'], **self._row(itm))
+
+    def _row(self, itm: dict):
+        """Gets the options of the row showing an item
+
+        Args:
+            itm (dict): Item in the grid model
+
+        Returns:
+            dict: Text, values and tags of row
+        """
+        # Options and format are not shown for admin items
+        values = [itm['folder'], itm['type'], itm['id'], itm['last'], itm['freq'], itm['hours_diff'],
+                  '' if itm['admin'] else itm['options'], '' if itm['admin'] else itm['format']]
+        text = f"{'☑' if itm['selected'] else '☐'} {itm['title']}"
+        return {'text': text, 'values': values, 'tags': () if itm['selected'] else ('unselected',)}
+
+    def _update_row(self, id: str):
+        """Updates the row of an item from the grid model
+
+        Args:
+            id (str): Item to update
+        """
+        self.tree_items.item(id, **self._row(self._items[id]))
+
+    def _toggle_item(self, id: str):
+        """Selects or deselects an item for backup
+
+        Args:
+            id (str): Item to toggle
+        """
+        if id in self._items:
+            self._close_editor()
+            self._items[id]['selected'] = not self._items[id]['selected']
+            self._update_row(id)
+
+    def _click_item(self, e):
+        """Handler toggling an item when its title is clicked
+
+        Args:
+            e (Event): Click event
+        """
+        # Save any open edit
+        self._close_editor()
+        if self.tree_items.identify_region(e.x, e.y) == 'tree':
+            self._toggle_item(self.tree_items.identify_row(e.y))
+
+    def _edit_item(self, e):
+        """Handler placing an editor over the clicked cell, only selected items can be edited
+
+        Args:
+            e (Event): Double click event
+        """
+        id = self.tree_items.identify_row(e.y)
+        column = self.tree_items.identify_column(e.x)
+        if id not in self._items or column == '#0':
+            return
+        itm = self._items[id]
+        key = list(GRID_COLUMNS)[int(column[1:]) - 1]
+        # Check cell can be edited
+        if not itm['selected'] or key not in ['freq', 'hours', 'options', 'format']:
+            return
+        if itm['admin'] and key in ['options', 'format']:
+            return
+        if key == 'hours' and itm['freq'] != 'Custom':
+            return
+        self._close_editor()
+        # Setup editor
+        if key == 'freq':
+            editor = ttk.Combobox(self.tree_items, font='{Arial} 8 {}', values=list(FREQUENCY_OPTIONS.keys()), state='readonly')
+            editor.set(itm['freq'])
+        elif key == 'format':
+            editor = ttk.Combobox(self.tree_items, font='{Arial} 8 {}', values=itm['formats'], state='readonly')
+            editor.set(itm['format'])
         else:
-            itm['txt_itm_lastupd'].configure(state='disabled')
-            itm['cmb_itm_freq'].configure(state='disabled')
-            itm['txt_itm_hours'].configure(state='disabled')
-            itm['txt_itm_options'].configure(state='disabled')
-            itm['cmb_itm_format'].configure(state='disabled')
+            editor = tk.Entry(self.tree_items, font='{Arial} 8 {}', relief=tk.FLAT)
+            editor.insert(0, itm['hours_diff'] if key == 'hours' else itm['options'])
+            editor.select_range(0, tk.END)
+            # Save when focus leaves the entry, comboboxes lose focus to their dropdown so save on selection
+            editor.bind('<FocusOut>', lambda e: self._close_editor())
+        editor.bind('<<ComboboxSelected>>', lambda e: self._close_editor())
+        editor.bind('<Return>', lambda e: self._close_editor())
+        editor.bind('<Escape>', lambda e: self._close_editor(commit=False))
+        # Place editor over cell
+        x, y, width, height = self.tree_items.bbox(id, column)
+        editor.place(x=x, y=y, width=width, height=height)
+        editor.focus_set()
+        self._editor = (editor, id, key)
+
+    def _close_editor(self, commit: bool = True):
+        """Closes the cell editor, saving its value to the grid model
+
+        Args:
+            commit (bool, optional): Flag to save the edited value. Defaults to True.
+        """
+        if self._editor is None:
+            return
+        editor, id, key = self._editor
+        self._editor = None
+        value = editor.get()
+        editor.destroy()
+        if not commit or id not in self._items:
+            return
+        itm = self._items[id]
+        # Update item
+        if key == 'freq':
+            itm['freq'] = value
+            # Populate hours based on frequency, custom keeps the current hours
+            if FREQUENCY_OPTIONS[value] is not None:
+                itm['hours_diff'] = FREQUENCY_OPTIONS[value]
+        elif key == 'hours':
+            try:
+                itm['hours_diff'] = float(value)
+            except ValueError:
+                pass
+        elif key == 'options':
+            itm['options'] = value.strip()
+        elif key == 'format':
+            itm['format'] = value
+        if self.tree_items.exists(id):
+            self._update_row(id)
 
     def _openurl(self, url: str):
         """Opens URL in default browser
@@ -719,6 +816,16 @@ class BackupMgrGUI:
         # Run main loop
         self.mainwindow.mainloop()
 
+    def _quit(self):
+        """Stops the background catalogue refresh and closes the GUI
+        """
+        # Drop any running sign in or refresh so its result is not shown, and cancel any queued work
+        self._connect_job = None
+        self._catalogue_job = None
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        # Close GUI
+        self._gui.destroy()
+
     def _runnow(self):
         # Prompt to confirm
         res = messagebox.askyesno("Run Backup Now", "Backup jobs may take a while, and will lock the config app while they run. There is no progress bar for this operation so you are on your own! Do you wish to proceed?")
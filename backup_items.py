@@ -2,26 +2,388 @@
 
 from enum import Enum
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
-from arcgis.gis import GIS
+from typing import TYPE_CHECKING
 import log
 import util
 import agol
+import exports as exp
+import download
+import state as st
+import functools
+import changes as chg
+import blobs as bl
+import metrics
 import pathlib
+import tempfile
 import json
 import time
 import sys
 
+# Only import the ArcGIS API for type checking, it is slow to import and is loaded when connecting
+if TYPE_CHECKING:
+    from arcgis.gis import GIS
+
 
 class Response(Enum):
     Success = 1
     ItemNotFound = 2
     ItemNotModified = 3
     ExportNotSupported = 4
+    ExportQueued = 5
+
+
+def _backup_data(item, item_dir: str, logger: logging):
+    """Downloads the data associated with an item
+
+    Args:
+        item (Item): Arcgis Online item to backup
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Update status
+    logger.debug(" > Data")
+    # Backup data, streamed to a part file which is resumed if cut off
+    download.item_data(item, item_dir, file_name=f"{download.item_file_name(item)}.data")
+
+
+def _backup_metadata(item, item_dir: str, logger: logging):
+    """Downloads the metadata document of an item, if it has one
+
+    Args:
+        item (Item): Arcgis Online item to backup
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Update status
+    logger.debug(" > Metadata")
+    # Backup meta, if it exists
+    if "Metadata" in item["typeKeywords"]:
+        # Export metadata
+        item.download_metadata(item_dir)
+
+
+def _backup_thumbnail(item, item_dir: str, logger: logging):
+    """Downloads the thumbnail of an item to the thumbnail subfolder
+
+    Args:
+        item (Item): Arcgis Online item to backup
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Update status
+    logger.debug(" > Thumbnail")
+    # Backup meta
+    item.download_thumbnail(os.path.join(item_dir, "thumbnail"))
+
+
+def _backup_url(item, item_dir: str, logger: logging):
+    """Writes a URL file linking to the item on AGOL
+
+    Args:
+        item (Item): Arcgis Online item to backup
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Update status
+    logger.debug(" > URL")
+    # Backup url file
+    util.export_url(f"{item_dir}/item.url", item.homepage)
+
+
+def _backup_sharing(item, item_dir: str, logger: logging):
+    """Exports the sharing settings of an item
+
+    Args:
+        item (Item): Arcgis Online item to backup
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Update status
+    logger.debug(" > Sharing")
+    # Backup sharing
+    util.export_obj(f"{item_dir}/sharing.json", item.shared_with)
+
+
+def _backup_comments(item, item_dir: str, logger: logging):
+    """Exports the comments associated with an item, if any
+
+    Args:
+        item (Item): Arcgis Online item to backup
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Update status
+    logger.debug(" > Comments")
+    # Get comments
+    comments = item.comments
+    # Backup comments
+    if comments:
+        util.export_agolclass_list(f"{item_dir}/comments.json", comments)
+
+
+def _backup_appinfo(item, item_dir: str, logger: logging):
+    """Exports the registered app info of an item, if any
+
+    Args:
+        item (Item): Arcgis Online item to backup
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Update status
+    logger.debug(" > App Info")
+    # Get app info
+    appinfo = item.app_info
+    # Backup appinfo
+    if appinfo:
+        util.export_obj(f"{item_dir}/appinfo.json", appinfo)
+
+
+def _backup_resources(item, item_dir: str, logger: logging):
+    """Exports the resources of an item to a zip file, if any
+
+    Args:
+        item (Item): Arcgis Online item to backup
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Update status
+    logger.debug(" > Resources")
+    # Backup resources
+    res = item.resources
+    if res.list():
+        # Export resources to the partial download folder, then move into place once complete
+        partial_dir = download.part_dir(item_dir)
+        os.makedirs(partial_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=partial_dir) as tmp_dir:
+            res.export(tmp_dir, 'resources.zip')
+            os.replace(os.path.join(tmp_dir, 'resources.zip'), os.path.join(item_dir, 'resources.zip'))
+
+
+# Relationship types between items, see https://developers.arcgis.com/rest/users-groups-and-items/relationship-types.htm
+RELTYPES = [
+    "Map2Service",
+    "WMA2Code",
+    "Map2FeatureCollection",
+    "MobileApp2Code",
+    "Service2Data",
+    "Service2Service",
+    "Map2AppConfig",
+    "Item2Attachment",
+    "Item2Report",
+    "Listed2Provisioned",
+    "Style2Style",
+    "Service2Style",
+    "Survey2Service",
+    "Survey2Data",
+    "Service2Route",
+    "Area2Package",
+    "Map2Area",
+    "Service2Layer",
+    "Area2CustomPackage",
+    "TrackView2Map",
+    "SurveyAddIn2Data",
+    "WorkforceMap2FeatureService",
+    "Theme2Story",
+    "WebStyle2DesktopStyle",
+    "Solution2Item",
+    "APIKey2Item",
+]
+
+# Number of relationship types queried at the same time when an item has related items
+RELATED_WORKERS = 8
+
+
+def _related_any(item, direction: str):
+    """Requests the related items of an item across all relationship types in a single request
+
+    Args:
+        item (Item): Arcgis Online item to check
+        direction (str): Direction of relationship, forward or reverse
+
+    Returns:
+        list: Related items of any relationship type
+    """
+    # Request all relationship types at once, the REST API accepts a comma separated list
+    path = f"content/items/{item.itemid}/relatedItems"
+    params = {"f": "json", "relationshipTypes": ",".join(RELTYPES), "direction": direction}
+    res = item._gis._con.post(path, params)
+    # Return related items
+    return res.get("relatedItems", []) if res else []
+
+
+def _backup_related(item, item_dir: str, logger: logging):
+    """Exports the relationships between an item and others
 
+    Most items have no relationships, so each direction is first checked for related items of any type in a
+    single request. The individual relationship types are then only queried when something is found.
 
-def backup(gis: GIS, itemid: str, directory: str, options: list, fmt: str, skip_unmodified: bool, logger: logging):
+    Args:
+        item (Item): Arcgis Online item to backup
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Update status
+    logger.debug(" > Related Items")
+    # Setup related items, defaulting all types to no relationships
+    related_items = {r: {"forward": [], "backward": []} for r in RELTYPES}
+    for key, direction in [("forward", "forward"), ("backward", "reverse")]:
+        # Check for related items of any type
+        try:
+            found = _related_any(item, direction)
+        except Exception:
+            # Fall back to querying each type
+            logger.debug(f" > Combined related items request failed, querying each type ({direction})")
+            found = True
+        # Skip direction if nothing is related
+        if not found:
+            continue
+        # Query each relationship type concurrently
+        with ThreadPoolExecutor(max_workers=RELATED_WORKERS) as pool:
+            futures = [metrics.submit(pool, item.related_items, r, direction) for r in RELTYPES]
+            for r, future in zip(RELTYPES, futures):
+                related_items[r][key] = future.result()
+    # Write related items to file
+    util.export_obj(f"{item_dir}/related.json", related_items)
+
+
+# Item components which can be fetched independently of each other, keyed by backup option
+COMPONENTS = {
+    "data": _backup_data,
+    "metadata": _backup_metadata,
+    "thumbnail": _backup_thumbnail,
+    "url": _backup_url,
+    "sharing": _backup_sharing,
+    "comments": _backup_comments,
+    "appinfo": _backup_appinfo,
+    "resources": _backup_resources,
+    "related": _backup_related,
+}
+
+# Default number of components fetched at the same time for an item
+DEFAULT_WORKERS = 4
+
+
+def _service_layers(item, cache: dict):
+    """Gets the definitions of all layers and tables in a feature service in a single request, cached for the rest of the item's backup
+
+    Args:
+        item (Item): Feature service item
+        cache (dict): Cache of service definitions for the item
+
+    Returns:
+        dict: Layer and table definitions of the service
+    """
+    if "layers" not in cache:
+        cache["layers"] = item._gis._con.get(f"{item.url}/layers", {"f": "json"})
+    return cache["layers"]
+
+
+def _last_modified(item, cache: dict, logger: logging):
+    """Gets the last modified date of an item, using the last edit date of its layers and tables for feature services
+
+    Args:
+        item (Item): Item to check
+        cache (dict): Cache of service definitions for the item
+        logger (logging): logging object to pass to tool for logging purposes
+
+    Returns:
+        int: Last modified date in ms since epoch, sys.maxsize if it cannot be determined
+    """
+    # Check item against existing item
+    if item["type"] != "Feature Service":
+        return item['modified']
+    # Check for max datestamp from feature service
+    try:
+        layers = _service_layers(item, cache)
+    except Exception as ex:
+        logger.debug(f" > Could not read service definition, assuming modified ({ex})")
+        return sys.maxsize
+    edit_dates = [
+        i["editingInfo"]["lastEditDate"]
+        for i
+        in layers.get("layers", []) + layers.get("tables", [])
+        if "lastEditDate" in i.get("editingInfo", {})
+    ]
+    if not edit_dates:
+        logger.debug(" > Service layers do not report a last edit date, assuming modified")
+        return sys.maxsize
+    return max(edit_dates)
+
+
+def _run_component(k: str, item, item_dir: str, logger: logging, state: st.State = None):
+    """Runs an item component, recording its result in the state index if supplied
+
+    Args:
+        k (str): Component option key
+        item (Item): Arcgis Online item to backup
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+        state (State, optional): Backup state index. Defaults to None.
+    """
+    started = time.time()
+    try:
+        with metrics.span("component", item.itemid, k):
+            COMPONENTS[k](item, item_dir, logger)
+    except Exception:
+        if state is not None:
+            state.record(item.itemid, k, "Error", False, started)
+        raise
+    if state is not None:
+        state.record(item.itemid, k, "Success", True, started)
+
+
+def _finalize(stage: util.StagedDir, result: Response, state: st.State = None, itemid: str = None, started: float = None, modified: float = None, blob_store: bl.BlobStore = None):
+    """Finalises an item backup, writing the timestamp file if successful and applying staged changes to the item dir
+
+    Args:
+        stage (util.StagedDir): Staged item dir
+        result (Response): Result of the backup, the timestamp is only written on success
+        state (State, optional): Backup state index to record the result in. Defaults to None.
+        itemid (str, optional): ID of item, required if state is supplied. Defaults to None.
+        started (float, optional): Time backup started in seconds since epoch. Defaults to None.
+        modified (float, optional): Time item was last modified in seconds since epoch. Defaults to None.
+        blob_store (BlobStore, optional): Store to move large files to, leaving a pointer in the item dir. Defaults to None.
+
+    Returns:
+        list: Paths in item dir which were written or removed
+    """
+    success = result == Response.Success
+    # Write out timestamp file
+    if success:
+        util.set_ts(os.path.join(stage.path, "lastupdate.ts"))
+    # Apply changes
+    size = util.dir_size(stage.path)
+    # Move large files to the blob store
+    if blob_store is not None:
+        blob_store.stash(stage.path)
+    changed = stage.commit()
+    # Record result
+    if state is not None:
+        state.record(itemid, "item", result.name, success, started, modified, size)
+    return changed
+
+
+def _export_done(finalize, changes_dir: str, changes: util.ChangeSet, success: bool, path: str):
+    """Finalises an item backup once its service export has finished
+
+    Args:
+        finalize (callable): Finalise function of the item backup
+        changes_dir (str): Changes folder of the item if a change tracking baseline was taken, otherwise None
+        changes (ChangeSet): Change set to record written paths in, may be None
+        success (bool): Flag to indicate the export succeeded
+        path (str): Path of the exported file, None if the export failed
+    """
+    if success and changes_dir:
+        chg.set_export(changes_dir, os.path.basename(path))
+        if changes is not None:
+            changes.add([os.path.join(changes_dir, chg.STATE_FILE)])
+    finalize(Response.Success if success else Response.ExportNotSupported)
+
+
+def backup(gis: "GIS", itemid: str, directory: str, options: list, fmt: str, skip_unmodified: bool, logger: logging, workers: int = DEFAULT_WORKERS, exports: exp.ExportPipeline = None, baseline_days: float = None, item=None, state: st.State = None, changes: util.ChangeSet = None, blob_store: bl.BlobStore = None):
     """Module to grab an item and its associated resources from ArcGIS Online and to save them to disk
 
     Args:
@@ -31,189 +393,128 @@ def backup(gis: GIS, itemid: str, directory: str, options: list, fmt: str, skip_
         options (list): Options for backup, currently supported options are item, data, metadata, thumbnail, url, sharing, appinfo, related, service or all
         fmt (str): Format for export of service (only works for the following types "Feature Service", "Vector Tile Service", "Scene Service")
         logger (logging): logging object to pass to tool for logging purposes
+        workers (int): Number of item components to fetch at the same time (Default 4)
+        exports (ExportPipeline): Pipeline to queue service exports on, if not supplied exports are run before returning (Default None)
+        baseline_days (float): If set, feature services with change tracking are backed up incrementally, extracting changes since the last backup and only exporting a full baseline every baseline_days (Default None)
+        item (Item): Item to backup if already retrieved, requested by itemid if not supplied (Default None)
+        state (State): Backup state index to record item and component results in (Default None)
+        changes (ChangeSet): Change set to record written and removed paths in (Default None)
+        blob_store (BlobStore): Store to move large files such as exports and data to, git then only tracks a pointer file (Default None)
     """
+    # Get start time
+    started = time.time()
     # Setup item folder
     directory = os.path.join(directory, "items")
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    # Get item
-    item = gis.content.get(itemid)
+    os.makedirs(directory, exist_ok=True)
+    # Get item if not supplied
+    if item is None:
+        item = gis.content.get(itemid)
     # Check if item exists
     if not item:
         # Update status
         logger.info(" > Item not found")
+        if state is not None:
+            state.record(itemid, "item", Response.ItemNotFound.name, False, started)
         # End module
         return Response.ItemNotFound
     # Setup item dir
     item_dir = os.path.join(directory, itemid)
+    # Setup cache for service definitions requested during the backup
+    service = {}
+    # Default last modified date to the item modified date
+    modified = item["modified"] / 1000
     # Process modification flag
     if skip_unmodified:
         # Get timestamp file
         last_backedup = util.get_ts(os.path.join(item_dir,"lastupdate.ts"))
         # Get last modified date
-        if item["type"] == "Feature Service":
-            # Check for max datestamp from feature service
-            try:
-                last_modified = max(
-                    i.properties.editingInfo.lastEditDate
-                    for i
-                    in item.layers + item.tables
-                )
-            except ValueError:
-                last_modified = sys.maxsize
-        else:
-            # Check item against existing item
-            last_modified = item['modified']
-        # Convert last modified to datetime for comparison 
-        last_modified = datetime.fromtimestamp(last_modified/1000)
+        last_modified = _last_modified(item, service, logger)
+        if last_modified != sys.maxsize:
+            modified = last_modified / 1000
         # Check if item has been modified
-        if last_modified <= last_backedup:
+        if last_modified != sys.maxsize and datetime.fromtimestamp(modified) <= last_backedup:
             # Bypass as item has not been modified since last backup
             logger.info(" > Item not modified")
+            if state is not None:
+                state.record(itemid, "item", Response.ItemNotModified.name, True, started, modified)
             return Response.ItemNotModified
-    # Clear our old and setup new dir
-    util.setup_dir(item_dir)
-    # Backup status
-    logger.debug(" Exporting:")
-    # Check if requested
-    if "item" in options or "all" in options:
-        # Remove number of views as it changes each request and is always picked up in GIT change tracking
-        del item["numViews"]
-        # Update status
-        logger.debug(" > Item")
-        # Backup item
-        util.export_agolclass(f"{item_dir}/content.json", item)
-    # Check if requested
-    if "data" in options or "all" in options:
-        # Update status
-        logger.debug(" > Data")
-        # Backup meta
-        data = item.download(item_dir)
-        os.rename(data,f"{data}.data")
-    # Check if requested
-    if "metadata" in options or "all" in options:
-        # Update status
-        logger.debug(" > Metadata")
-        # Backup meta, if it exists
-        if "Metadata" in item["typeKeywords"]:
-            # Export metadata
-            item.download_metadata(item_dir)
-    # Check if requested
-    if "thumbnail" in options or "all" in options:
-        # Update status
-        logger.debug(" > Thumbnail")
-        # Backup meta
-        item.download_thumbnail(os.path.join(item_dir, "thumbnail"))
-    # Check if requested
-    if "url" in options or "all" in options:
-        # Update status
-        logger.debug(" > URL")
-        # Backup url file
-        util.export_url(f"{item_dir}/item.url", item.homepage)
-    # Check if requested
-    if "sharing" in options or "all" in options:
-        # Update status
-        logger.debug(" > Sharing")
-        # Backup sharing
-        util.export_obj(f"{item_dir}/sharing.json", item.shared_with)
-    # Check if requested
-    if "comments" in options or "all" in options:
-        # Update status
-        logger.debug(" > Comments")
-        # Get comments
-        comments = item.comments
-        # Backup comments
-        if comments:
-            util.export_agolclass_list(f"{item_dir}/comments.json", comments)
-    # Check if requested
-    if "appinfo" in options or "all" in options:
-        # Update status
-        logger.debug(" > App Info")
-        # Get app info
-        appinfo = item.app_info
-        # Backup appinfo
-        if appinfo:
-            util.export_obj(f"{item_dir}/appinfo.json", appinfo)
-    # Check if requested
-    if "resources" in options or "all" in options:
-        # Update status
-        logger.debug(" > Resources")
-        # Backup resources
-        res = item.resources
-        if res.list():
-            #Export resources
-            res.export(item_dir, 'resources.zip')
-    # Check if requested
-    if "related" in options or "all" in options:
-        # Update status
-        logger.debug(" > Related Items")
-        # Backup related items
-        related_items = {}
-        reltypes = [
-            "Map2Service",
-            "WMA2Code",
-            "Map2FeatureCollection",
-            "MobileApp2Code",
-            "Service2Data",
-            "Service2Service",
-            "Map2AppConfig",
-            "Item2Attachment",
-            "Item2Report",
-            "Listed2Provisioned",
-            "Style2Style",
-            "Service2Style",
-            "Survey2Service",
-            "Survey2Data",
-            "Service2Route",
-            "Area2Package",
-            "Map2Area",
-            "Service2Layer",
-            "Area2CustomPackage",
-            "TrackView2Map",
-            "SurveyAddIn2Data",
-            "WorkforceMap2FeatureService",
-            "Theme2Story",
-            "WebStyle2DesktopStyle",
-            "Solution2Item",
-            "APIKey2Item",
-        ]
-        for r in reltypes:
-            related_items[r] = {}
-            related_items[r]["forward"] = item.related_items(r, "forward")
-            related_items[r]["backward"] = item.related_items(r, "reverse")
-        # Write related items to file
-        util.export_obj(f"{item_dir}/related.json", related_items)
-    # Get requested fmt
+    # Stage backup next to the item dir, only files which have changed are written to the item dir
+    stage = util.StagedDir(item_dir, keep=[chg.CHANGES_DIR], changes=changes)
+    # Setup finalise function, recording the result in the state index
+    finalize = functools.partial(_finalize, stage, state=state, itemid=itemid, started=started, modified=modified, blob_store=blob_store)
     try:
-        fmt = agol.EXPORT_FORMATS[fmt]
-    except KeyError:
-        fmt = agol.EXPORT_FORMATS["gdb"]
-    # Check if requested
-    if ("service" in options or "all" in options) and fmt:
-        # Check type is compatible
-        if item["type"] in ["Feature Service", "Vector Tile Service", "Scene Service"]:
-            # Update Status
-            logger.debug(" > Service")
-            # Setup title
-            postfix = "_tmpbackup"
-            title = f"{item['title']}{postfix}"
-            try:
-                # Setup export
-                export = item.export(title=title, export_format=fmt, wait=True, tags="Backup")
-                # Grab data
-                file_data = export.download(item_dir)
-                os.rename(file_data, file_data.replace(postfix, ''))
-            except Exception:
-                logger.exception(" > Service Export Failed")
-                return Response.ExportNotSupported
-            finally:
-                # Try to delete export
+        # Backup status
+        logger.debug(" Exporting:")
+        # Check if requested
+        if "item" in options or "all" in options:
+            # Remove number of views as it changes each request and is always picked up in GIT change tracking
+            del item["numViews"]
+            # Update status
+            logger.debug(" > Item")
+            # Backup item
+            util.export_agolclass(f"{stage.path}/content.json", item)
+        # Fetch requested components concurrently, each writes to its own file in the item dir
+        requested = [k for k in COMPONENTS if k in options or "all" in options]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [metrics.submit(pool, _run_component, k, item, stage.path, logger, state) for k in requested]
+            # Wait for all components, raising the first error encountered
+            for future in futures:
+                future.result()
+        # Get requested fmt
+        try:
+            fmt = agol.EXPORT_FORMATS[fmt]
+        except KeyError:
+            fmt = agol.EXPORT_FORMATS["fgdb"]
+        # Check if requested
+        if ("service" in options or "all" in options) and fmt:
+            # Check type is compatible
+            if item["type"] in ["Feature Service", "Vector Tile Service", "Scene Service"]:
+                # Update Status
+                logger.debug(" > Service")
+                # Extract changes instead of a full export if running incrementally
+                changes_dir = None
+                if baseline_days and item["type"] == "Feature Service":
+                    changes_dir = os.path.join(item_dir, chg.CHANGES_DIR)
+                    delta = chg.backup(item, item_dir, baseline_days, logger, layers=_service_layers(item, service))
+                    # Move large baseline and delta files to the blob store, state is read on each run so stays in place
+                    if blob_store is not None:
+                        blob_store.stash(changes_dir, skip=[chg.STATE_FILE])
+                    # Changes are written straight to the item dir so are not picked up by the stage
+                    if changes is not None:
+                        changes.add_tree(changes_dir)
+                    if delta:
+                        # Keep the export taken with the baseline, it is not exported again until the next baseline
+                        export_name = chg.load_state(changes_dir).get("export")
+                        if export_name:
+                            stage.keep.extend([export_name, f"{export_name}{bl.POINTER_POSTFIX}"])
+                            # Keep the kept export out of git if it was moved to the blob store
+                            if os.path.exists(os.path.join(item_dir, f"{export_name}{bl.POINTER_POSTFIX}")):
+                                bl.ignore(stage.path, export_name)
+                        finalize(Response.Success)
+                        return Response.Success
+                # Setup export callback, recording the export taken with a baseline so later deltas keep it
+                on_done = functools.partial(_export_done, finalize, changes_dir, changes)
+                # Queue export if using a pipeline, the backup is finalised once the export is downloaded
+                if exports is not None:
+                    exports.submit(item, fmt, stage.path, logger, on_done=on_done)
+                    return Response.ExportQueued
                 try:
-                    export.delete()
+                    # Run export
+                    path = exp.export(item, fmt, stage.path, logger)
                 except Exception:
-                    pass
-    # Write out timestamp file
-    util.set_ts(os.path.join(item_dir,"lastupdate.ts"))
+                    logger.exception(" > Service Export Failed")
+                    on_done(False, None)
+                    return Response.ExportNotSupported
+                on_done(True, path)
+                return Response.Success
+    except Exception:
+        # Leave existing backup untouched
+        stage.discard()
+        if state is not None:
+            state.record(itemid, "item", "Error", False, started, modified)
+        raise
+    # Write out timestamp file and apply changes
+    finalize(Response.Success)
     # Return success
     return Response.Success
 
@@ -259,6 +560,20 @@ if __name__ == "__main__":
         help="Options for export",
         nargs="+",
     )
+    parser.add_argument(
+        "-w",
+        dest="workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of item components to fetch at the same time (Default {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "-i",
+        dest="baseline_days",
+        type=float,
+        default=None,
+        help="Backup feature services with change tracking incrementally, exporting a full baseline every BASELINE_DAYS days",
+    )
     parser.add_argument(
         "-s",
         action="store_true",
@@ -296,7 +611,7 @@ if __name__ == "__main__":
             # Update status
             log.post(logger, f" - Collecting Item {args.itemid}")
             # Run script with args
-            res = backup(ago.gis, itemid=args.itemid, directory=args.outputdir, fmt=args.format, options=args.options, skip_unmodified=args.skipunmodified, logger=logger)
+            res = backup(ago.gis, itemid=args.itemid, directory=args.outputdir, fmt=args.format, options=args.options, skip_unmodified=args.skipunmodified, logger=logger, workers=args.workers, baseline_days=args.baseline_days)
             # Update status
             log.post(logger, f" - {res}")
     except Exception:
@@ -1,8 +1,11 @@
 # /usr/bin/python3
 
 import os
-import git
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import threading
+import heapq
+import itertools
+from datetime import datetime
 import json
 import logging
 import log
@@ -10,154 +13,699 @@ import util
 import agol
 import backup_admin as ba
 import backup_items as bi
-
-# TODO: Multithreading on item download
+import exports as exp
+import download
+import state as st
+import blobs as bl
+import metrics
+import time
+import subprocess
 
 """Script to leverage the functionality of backup_admin and backup_items to manage a series of backups for an AGOL account"""
 
 # Run cert override
 os.environ['REQUESTS_CA_BUNDLE'] = "certifi/cacert.pem"
 
+# Patterns excluded from the backup repo, timestamp files, partial downloads and staging dirs
+GITIGNORE = ['*.ts', f'{download.PART_DIR}/', f'*{util.STAGING_POSTFIX}/', f'{st.STATE_FILE}*', f'{bl.BLOB_DIR}/', f'{metrics.REPORT_DIR}/', f'{util.PENDING_FILE}*']
+# Config keys of admin items
+ADMIN_ITEMS = ['self', 'users', 'groups']
+# Number of item ids resolved per search request
+PREFETCH_PAGE = 50
+# Default number of items backed up at the same time
+DEFAULT_WORKERS = 4
+# Hours between backups in daemon mode for items with no schedule
+DAEMON_DEFAULT_HOURS = 24.0
+# Seconds before failed items are retried in daemon mode
+DAEMON_RETRY = 900
+# Maximum seconds the scheduler sleeps between checks in daemon mode
+DAEMON_MAX_SLEEP = 300
+# Seconds between commits in daemon mode
+DAEMON_COMMIT_INTERVAL = 900
 
-def run(cfg_paths: list, logger: logging, reset: bool = False):
-    """Module to manage backups as defined in a backup config file
+
+def _write_gitignore(backup_dir: str):
+    """Writes gitignore for the backup repo, adding any patterns missing from an existing file
 
     Args:
-        cfg_paths (str): List of paths to config files to process
+        backup_dir (str): Backup directory for config
+
+    Returns:
+        bool: True if the file was written
+    """
+    # Get existing patterns
+    gitignore_path = os.path.join(backup_dir, '.gitignore')
+    content = ''
+    if os.path.exists(gitignore_path):
+        with open(gitignore_path, 'r') as f:
+            content = f.read()
+    # Append missing patterns
+    missing = [p for p in GITIGNORE if p not in content.splitlines()]
+    if missing:
+        with open(gitignore_path, 'a') as f:
+            # Ensure patterns start on a new line
+            if content and not content.endswith('\n'):
+                f.write('\n')
+            f.write('\n'.join(missing))
+    return bool(missing)
+
+
+def _git(backup_dir: str, *args, input: str = None, env: dict = None, codes: tuple = (0,)):
+    """Runs a git command in the backup repo
+
+    Args:
+        backup_dir (str): Backup directory for config
+        input (str, optional): Data passed to the command on stdin. Defaults to None.
+        env (dict, optional): Environment variables added for the command. Defaults to None.
+        codes (tuple, optional): Exit codes which are not errors. Defaults to (0,).
+
+    Returns:
+        str: Output of the command
+    """
+    res = subprocess.run(
+        ["git", "-C", backup_dir, *args],
+        input=input.encode("utf-8") if input is not None else None,
+        env={**os.environ, **env} if env else None,
+        capture_output=True,
+    )
+    if res.returncode not in codes:
+        raise Exception(f"git {args[0]} failed: {res.stderr.decode('utf-8', 'replace').strip()}")
+    return res.stdout.decode("utf-8")
+
+
+def _plan(cfg_items: dict, backup_dir: str, state: st.State, reset: bool):
+    """Works out which items in a config are due for backup from the state index
+
+    Args:
+        cfg_items (dict): Item configs keyed by item id
+        backup_dir (str): Backup directory for config
+        state (State): Backup state index
+        reset (bool): Ignores timestamps and resets download timing logic
+
+    Returns:
+        list: Due item ids, in config order
+    """
+    # Check for reset
+    if reset:
+        return list(cfg_items)
+    # Get schedules, admin items with no hours are always due
+    admin = {k: i["hours_diff"] or None for k, i in cfg_items.items() if k in ADMIN_ITEMS}
+    items = {k: i["hours_diff"] for k, i in cfg_items.items() if k not in ADMIN_ITEMS}
+    # Carry over timestamps of items backed up before the state index existed
+    for itemid in state.missing(list(items)):
+        last_run = util.get_ts(os.path.join(backup_dir, "items", itemid, "lastupdate.ts"))
+        if last_run != datetime.min:
+            state.seed(itemid, last_run.timestamp())
+    # Get due items
+    due = set(state.due(items)) | set(state.due(admin, component="admin"))
+    return [k for k in cfg_items if k in due]
+
+
+def _backup_admin(gis, k: str, item: dict, backup_dir: str, state: st.State, changes: util.ChangeSet, logger: logging):
+    """Backs up an admin item (self, users or groups)
+
+    Args:
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        k (str): Admin item key, one of self, users or groups
+        item (dict): Item config
+        backup_dir (str): Backup directory for config
+        state (State): Backup state index
+        changes (ChangeSet): Change set to record written and removed paths in
         logger (logging): logging object to pass to tool for logging purposes
-        reset (bool): Ignores timestamps and resets download timing logic (Default false)
     """
-    # Parse config files
-    for cfg in cfg_paths:
+    # Get start time
+    started = time.time()
+    # Get options
+    options = item['options'] if 'options' in item else 'all'
+    # Get number of users or groups to backup at the same time
+    workers = item['workers'] if 'workers' in item else ba.DEFAULT_WORKERS
+    # Get incremental flag, only users and groups modified since the last backup are backed up
+    incremental = item['incremental'] if 'incremental' in item else False
+    failed = 0
+    try:
+        # Backup admin item
+        with metrics.span("admin", k) as admin_span:
+            if k == 'users':
+                failed = ba.backup_users(gis, backup_dir, options, logger, changes, workers, state, incremental)
+            elif k == 'groups':
+                failed = ba.backup_groups(gis, backup_dir, options, logger, changes, workers, state, incremental)
+            elif k == 'self':
+                ba.backup_self(gis, backup_dir, options, logger, changes)
+            if failed:
+                admin_span.result = "Partial"
+    except Exception:
+        state.record(k, "admin", "Error", False, started)
+        raise
+    if failed:
+        # Not recorded as a success so the admin item is retried
+        state.record(k, "admin", "Partial", False, started)
+        log.post(logger, f" > {item['title']} backed up, {failed} {k} failed", logging.WARNING)
+        return
+    state.record(k, "admin", "Success", True, started)
+    log.post(logger, f" > {item['title']} successfully backed up")
+
+
+def _prefetch(gis, itemids: list, logger: logging):
+    """Resolves item ids to items using batched search requests
+
+    Args:
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        itemids (list): Item ids to resolve
+        logger (logging): logging object to pass to tool for logging purposes
+
+    Returns:
+        dict: Items keyed by item id, ids not found by search are excluded
+    """
+    items = {}
+    # Search for items a page of ids at a time
+    for i in range(0, len(itemids), PREFETCH_PAGE):
+        page = itemids[i:i + PREFETCH_PAGE]
+        query = f"id:({' OR '.join(page)})"
+        for itm in gis.content.search(query=query, max_items=len(page), outside_org=True):
+            items[itm.itemid] = itm
+    # Report missing items in a single pass
+    missing = [i for i in itemids if i not in items]
+    if missing:
+        log.post(logger, f" - {len(missing)} items not found by search, these will be requested individually: {', '.join(missing)}")
+    return items
+
+
+def _backup_item(gis, itemid: str, item: dict, backup_dir: str, reset: bool, exports: exp.ExportPipeline, state: st.State, changes: util.ChangeSet, blob_store: bl.BlobStore, logger: logging, agol_item=None):
+    """Backs up a content item, run from the worker pool
+
+    Args:
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        itemid (str): ID of Arcgis Online item to backup
+        item (dict): Item config
+        backup_dir (str): Backup directory for config
+        reset (bool): Ignores timestamps and resets download timing logic
+        exports (ExportPipeline): Pipeline to queue service exports on
+        state (State): Backup state index
+        changes (ChangeSet): Change set to record written and removed paths in
+        blob_store (BlobStore): Store to move large files to, None to keep them in the item dir
+        logger (logging): Item logging object
+        agol_item (Item, optional): Prefetched item, requested by id if not supplied. Defaults to None.
+
+    Returns:
+        Response: Result of item backup
+    """
+    # Get format
+    if "format" in item:
+        fmt = item["format"]
+    else:
+        fmt = None
+    # Get options
+    if 'options' in item:
+        options = item["options"]
+    else:
+        options = 'all'
+    # Get number of components to fetch at the same time
+    if 'workers' in item:
+        workers = item['workers']
+    else:
+        workers = bi.DEFAULT_WORKERS
+    # Get incremental baseline frequency for feature services
+    if 'baseline_days' in item:
+        baseline_days = item['baseline_days']
+    else:
+        baseline_days = None
+    # Run backup for item
+    skipunmod = False if reset else True
+    with metrics.span("item", itemid) as item_span:
+        res = bi.backup(gis, itemid, backup_dir, options, fmt, skip_unmodified=skipunmod, logger=logger, workers=workers, exports=exports, baseline_days=baseline_days, item=agol_item, state=state, changes=changes, blob_store=blob_store)
+        item_span.result = res.name
+    return res
+
+
+def _report_item(item_logger: logging, res: bi.Response):
+    """Logs the result of an item backup
+
+    Args:
+        item_logger (logging): Item logging object
+        res (Response): Result of item backup
+    """
+    # Update status if appropriate
+    if res == bi.Response.ExportQueued:
+        log.post(item_logger, " > Backed up, service export queued")
+    elif res.value > 1:
+        log.post(item_logger, f" > Skipped item, {res}")
+    else:
+        log.post(item_logger, " > Backed up")
+
+
+def _run_items(gis, due: dict, backup_dir: str, reset: bool, exports: exp.ExportPipeline, state: st.State, changes: util.ChangeSet, blob_store: bl.BlobStore, workers: int, logger: logging):
+    """Backs up content items using a pool of workers
+
+    Args:
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        due (dict): Item configs keyed by item id
+        backup_dir (str): Backup directory for config
+        reset (bool): Ignores timestamps and resets download timing logic
+        exports (ExportPipeline): Pipeline to queue service exports on
+        state (State): Backup state index
+        changes (ChangeSet): Change set to record written and removed paths in
+        blob_store (BlobStore): Store to move large files to, None to keep them in the item dir
+        workers (int): Number of items to backup at the same time
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Resolve items up front rather than one request per item
+    try:
+        prefetched = _prefetch(gis, list(due), logger)
+    except Exception:
+        logger.exception(" - Item prefetch failed, items will be requested individually")
+        prefetched = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Submit items
+        futures = {}
+        for itemid, item in due.items():
+            # Setup item logger so concurrent output can be traced to its item
+            item_logger = log.ItemLogger(logger, itemid)
+            future = metrics.submit(pool, _backup_item, gis, itemid, item, backup_dir, reset, exports, state, changes, blob_store, item_logger, prefetched.get(itemid))
+            futures[future] = item_logger
+        # Collect results as they complete
+        for future in as_completed(futures):
+            item_logger = futures[future]
+            try:
+                _report_item(item_logger, future.result())
+            except Exception:
+                # Report error and continue with other items
+                item_logger.exception(' > Unexpected error occured backing up item')
+                state.record(item_logger.extra['item'], "item", "Error", False)
+
+
+class _Config:
+    """Loaded backup config with its backup dir, git repo and state index
+    """
+
+    def __init__(self, cfg_path: str, logger: logging, workers: int = None, export_jobs: int = None, readonly: bool = False):
+        """Loads a config file and sets up its backup dir
+
+        Args:
+            cfg_path (str): Path to config file
+            logger (logging): logging object to pass to tool for logging purposes
+            workers (int): Number of items to backup at the same time, overrides the config workers value (Default None)
+            export_jobs (int): Number of service export jobs in flight on the server, overrides the config export_jobs value (Default None)
+            readonly (bool): Only reads the backup dir, without creating folders, the gitignore or the state index (Default false)
+        """
         # Get config path
-        cfg_path = os.path.abspath(cfg)
+        cfg_path = os.path.abspath(cfg_path)
         log.post(logger, f"Using config file at {cfg_path}")
+        self.path = cfg_path
         # Check config file exists
         if not os.path.exists(cfg_path):
             log.post(logger, " - Config file not found")
         # Process config items
         with open(cfg_path, "r") as f:
             cfg = json.load(f)
+        self.cfg = cfg
         # Check if folder exists
-        if not os.path.exists(cfg["outdir"]):
+        if not os.path.exists(cfg["outdir"]) and not readonly:
             # Build folder if not exists
             os.makedirs(cfg["outdir"])
         # Setup backup folder
         backup_dir = os.path.join(cfg["outdir"], cfg["label"])
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
+        if not readonly:
+            os.makedirs(backup_dir, exist_ok=True)
+        self.backup_dir = backup_dir
         # Default git var
-        usegit = cfg['usegit'] if 'usegit' in cfg else True
-        # Setup git if requested
-        if usegit:
+        self.usegit = cfg['usegit'] if 'usegit' in cfg else True
+        # Get number of workers, args take precedence over config
+        self.workers = workers or (cfg['workers'] if 'workers' in cfg else DEFAULT_WORKERS)
+        self.export_jobs = export_jobs or (cfg['export_jobs'] if 'export_jobs' in cfg else exp.DEFAULT_JOBS)
+        # Get requests per second allowed to the portal
+        self.rate_limit = cfg['rate_limit'] if 'rate_limit' in cfg else None
+        # Get run report folders
+        self.report_dir = cfg['report_dir'] if 'report_dir' in cfg else os.path.join(backup_dir, metrics.REPORT_DIR)
+        self.metrics_dir = cfg['metrics_dir'] if 'metrics_dir' in cfg else None
+        # Get token cache flag
+        self.token_cache = cfg['token_cache'] if 'token_cache' in cfg else False
+        # Use git file system monitor if requested
+        self.fsmonitor = cfg['git_fsmonitor'] if 'git_fsmonitor' in cfg else False
+        # Setup blob store if large files are to be kept out of git
+        self.blob_store = None
+        if 'blob_threshold_mb' in cfg and cfg['blob_threshold_mb']:
+            self.blob_store = bl.BlobStore(os.path.join(backup_dir, bl.BLOB_DIR), int(cfg['blob_threshold_mb'] * 1024 * 1024))
+        # Setup change set, recording paths written so only those are staged
+        self.changes = util.ChangeSet(os.path.join(backup_dir, util.PENDING_FILE) if self.usegit and not readonly else None)
+        # Update gitignore with any missing patterns, the repo is opened when first committing
+        self._repo = None
+        if self.usegit and not readonly and _write_gitignore(backup_dir):
+            self.changes.add([os.path.join(backup_dir, '.gitignore')])
+        # Open state index
+        self.state = st.State(backup_dir, readonly)
+        # Setup lock, serialising commits when batches of this config overlap
+        self.lock = threading.Lock()
+
+    @property
+    def repo(self):
+        # Import GitPython on first use as it is slow to import
+        if self._repo is None:
+            import git
             # Setup git dir if not exists, else open
-            if not os.path.exists(os.path.join(backup_dir, ".git")):
+            if not os.path.exists(os.path.join(self.backup_dir, ".git")):
                 # Build folder if not exists
-                repo = git.Repo.init(backup_dir)
+                self._repo = git.Repo.init(self.backup_dir)
+            else:
+                self._repo = git.Repo(self.backup_dir)
+            # Cache untracked files and use the file system monitor if requested, keeping status checks fast on large repos
+            _git(self.backup_dir, "config", "core.untrackedCache", "true")
+            if self.fsmonitor:
+                _git(self.backup_dir, "config", "core.fsmonitor", "true")
+        return self._repo
+
+    def _staged_paths(self, paths: set, trees: set):
+        # Get paths relative to the repo, expanding folders to the files on disk and in the index
+        for tree in trees:
+            for root, dirs, files in os.walk(tree):
+                paths.update(os.path.join(root, f) for f in files)
+        rel_trees = [os.path.relpath(t, self.backup_dir).replace(os.sep, "/") for t in trees]
+        rel_paths = {os.path.relpath(p, self.backup_dir).replace(os.sep, "/") for p in paths}
+        if rel_trees:
+            rel_paths.update(p for p in _git(self.backup_dir, "ls-files", "-z", "--", *rel_trees).split("\0") if p)
+        rel_paths = [p for p in rel_paths if not p.startswith("../")]
+        # Drop ignored paths, update-index adds whatever it is given
+        if rel_paths:
+            ignored = _git(self.backup_dir, "check-ignore", "-z", "--stdin", input="\0".join(rel_paths), codes=(0, 1))
+            ignored = set(ignored.split("\0"))
+            rel_paths = [p for p in rel_paths if p not in ignored]
+        return sorted(rel_paths)
+
+    def commit(self):
+        """Commits changes to the git repo, if git is used
+
+        Only paths recorded in the change set are staged, so the working tree is never scanned. No commit is made if
+        nothing changed. Paths are only cleared from the change set journal once the commit is made, so paths which
+        failed to commit are staged by the next commit.
+        """
+        if self.usegit:
+            with self.lock:
+                # Open repo, creating it if needed
+                repo = self.repo
+                paths, trees = self.changes.pop()
+                try:
+                    self._commit(repo, paths, trees)
+                except Exception:
+                    self.changes.restore(paths, trees)
+                    raise
+                self.changes.done()
+
+    def _commit(self, repo, paths: set, trees: set):
+        # Stage recorded paths and commit them
+        import git
+        head = _git(self.backup_dir, "rev-parse", "-q", "--verify", "HEAD", codes=(0, 1)).strip()
+        if not head:
+            # Add everything on the first commit
+            _git(self.backup_dir, "add", "--all")
+        elif paths or trees:
+            # Stage recorded paths, removing those which no longer exist
+            staged = self._staged_paths(paths, trees)
+            if staged:
+                _git(self.backup_dir, "update-index", "--add", "--remove", "-z", "--stdin", input="\0".join(staged) + "\0")
+        else:
+            return
+        # Skip commit if the tree is unchanged
+        tree = _git(self.backup_dir, "write-tree").strip()
+        if head and tree == _git(self.backup_dir, "rev-parse", "HEAD^{tree}").strip():
+            return
+        # Commit tree, using the same identity as GitPython
+        cr = repo.config_reader()
+        author, committer = git.Actor.author(cr), git.Actor.committer(cr)
+        env = {
+            "GIT_AUTHOR_NAME": author.name,
+            "GIT_AUTHOR_EMAIL": author.email,
+            "GIT_COMMITTER_NAME": committer.name,
+            "GIT_COMMITTER_EMAIL": committer.email,
+        }
+        parents = ["-p", head] if head else []
+        commit = _git(self.backup_dir, "commit-tree", tree, *parents, "-m", f"Data commit @ {datetime.now()}", env=env).strip()
+        _git(self.backup_dir, "update-ref", "HEAD", commit, *([head] if head else []))
+
+    def close(self):
+        """Closes the state index
+        """
+        self.state.close()
+
+
+def _process(config: _Config, gis, planned: list, reset: bool, logger: logging):
+    """Backs up the planned items of a config
+
+    Args:
+        config (_Config): Loaded config
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        planned (list): Due item ids
+        reset (bool): Ignores timestamps and resets download timing logic
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Record timings of the run
+    recorder = metrics.Recorder(config.cfg["label"])
+    token = recorder.activate()
+    # Process items
+    try:
+        # Update status
+        log.post(logger, "Processing Items")
+        # Collect due items
+        due = {}
+        for k in planned:
+            item = config.cfg["items"][k]
+            # Process admin if this is an admin item
+            if k in ADMIN_ITEMS:
+                log.post(logger, f" - {k}")
+                # Backup admin item, these walk the whole org so are kept out of the item pool
+                try:
+                    _backup_admin(gis, k, item, config.backup_dir, config.state, config.changes, logger)
+                except Exception:
+                    logger.exception(f" > Unexpected error backing up {k}")
             else:
-                repo = git.Repo(backup_dir)
-            # Write gitignore if absent
-            gitignore_path = os.path.join(backup_dir, '.gitignore')
-            if not os.path.exists(gitignore_path):
-                # Write git ignore for ts files
-                with open(gitignore_path, 'w') as f:
-                    f.write('*.ts')
-        # Get arcgis online connection object
-        ago = agol.Agol(cfg["portal"], cfg["uname"], cfg["pword"], logger)
+                # Queue item for backup
+                due[k] = item
+        # Setup export pipeline so service exports queue on the server alongside item backups
+        exports = exp.ExportPipeline(logger, jobs=config.export_jobs)
+        # Backup due items using worker pool
+        log.post(logger, f"Backing up {len(due)} items using {config.workers} workers")
+        try:
+            _run_items(gis, due, config.backup_dir, reset, exports, config.state, config.changes, config.blob_store, config.workers, logger)
+        finally:
+            # Wait for queued exports to finish
+            failed = exports.join()
+            if failed:
+                log.post(logger, f"{failed} service exports failed", logging.WARNING)
+    except Exception:
+        # Report error and continue
+        logger.exception('Unexpected error occured backing up files, please review code and try again.')
+    finally:
+        # Write run report
+        recorder.deactivate(token)
+        try:
+            recorder.write(config.report_dir, config.metrics_dir)
+        except Exception:
+            logger.exception("Could not write run report")
+
+
+def run(cfg_paths: list, logger: logging, reset: bool = False, workers: int = None, export_jobs: int = None, plan: bool = False):
+    """Module to manage backups as defined in a backup config file
+
+    Args:
+        cfg_paths (str): List of paths to config files to process
+        logger (logging): logging object to pass to tool for logging purposes
+        reset (bool): Ignores timestamps and resets download timing logic (Default false)
+        workers (int): Number of items to backup at the same time, overrides the config workers value (Default None)
+        export_jobs (int): Number of service export jobs in flight on the server, overrides the config export_jobs value (Default None)
+        plan (bool): Only reports due items, without connecting to AGOL or writing to the backup dir (Default false)
+    """
+    # Parse config files
+    for cfg_path in cfg_paths:
+        # Load config
+        config = _Config(cfg_path, logger, workers, export_jobs, readonly=plan)
+        cfg = config.cfg
+        # Work out due items
+        planned = _plan(cfg["items"], config.backup_dir, config.state, reset)
+        # Report skipped items
+        for k, item in cfg["items"].items():
+            if k not in planned:
+                log.post(logger, f" - {k}")
+                if k not in ADMIN_ITEMS and item["hours_diff"] == 0.0:
+                    log.post(logger, " > Skipped item, item set to ignore (hours_diff=0.0)")
+                else:
+                    log.post(logger, " > Skipped item, not yet due")
+        # Report due items and move on if only planning
+        if plan:
+            for k in planned:
+                log.post(logger, f" - {k}")
+                log.post(logger, " > Due")
+            config.close()
+            continue
+        # Get arcgis online connection object if anything is due
+        ago = agol.connect(cfg["portal"], cfg["uname"], cfg["pword"], logger, config.rate_limit, config.token_cache) if planned else None
         # Check for error
-        if ago: 
-            # Process items
-            try:
-                # Update status
-                log.post(logger, "Processing Items")
-                # Process backup items
-                for k, item in cfg["items"].items():
-                    # Get item id
-                    itemid = k
-                    log.post(logger, f" - {itemid}")
-                    # Process admin if this is an admin item     
-                    if k in ['self', 'users', 'groups']:
-                        # Check for due date
-                        if reset:
-                            admin_due = True
-                        elif not os.path.exists(backup_dir):
-                            # If item folder does not exist mark as due
-                            admin_due = True
-                        elif item["hours_diff"]:
-                            # Setup diff with a 2% margin
-                            diff = item["hours_diff"] * 0.98
-                            # Get last run date
-                            last_ts = item["last"] if 'last' in item else '2000-01-01'
-                            last_run = datetime.fromisoformat(last_ts)
-                            # Check if item is due based on last run and hours_diff
-                            admin_duedate = last_run + timedelta(hours=diff)
-                            admin_due = admin_duedate < datetime.now()
-                        else:
-                            # Default to due
-                            admin_due = True
-                        # Check if due
-                        if admin_due:
-                            # Backup admin item
-                            if k == 'users':
-                                ba.backup_users(ago.gis, backup_dir, options, logger)
-                            elif k == 'groups':
-                                ba.backup_groups(ago.gis, backup_dir, options, logger)
-                            elif k == 'self':
-                                ba.backup_self(ago.gis, backup_dir, options, logger)
-                            log.post(logger, f" > {item['title']} successfully backed up")
-                        else:
-                            # Update status
-                            log.post(logger, f" > Skipped {item['title']}, not due yet")
-                    else:  
-                        # Check if backup is not yet due
-                        itmdir = os.path.join(backup_dir, "items")
-                        # Get format
-                        if "format" in item:
-                            fmt = item["format"]
-                        else:
-                            fmt = None
-                        # Get options
-                        if 'options' in item:
-                            options = item["options"]
-                        else:
-                            options = 'all'
-                        # Check for due date
-                        if reset:
-                            admin_due = True
-                        elif not os.path.exists(itmdir):
-                            # If item folder does mark as due
-                            item_due = True
-                        elif item["hours_diff"] == 0.0:
-                            # If item is set at 0, skip
-                            log.post(logger, " > Skipped item, item set to ignore (hours_diff=0.0)")
-                            admin_due = False
-                        elif item["hours_diff"] > 0.0:
-                            # Setup diff with a 2% margin
-                            diff = item["hours_diff"] * 0.98
-                            # Check if item is due based on last run and hours_diff
-                            last_run = util.get_ts(os.path.join(itmdir, itemid, 'lastupdate.ts'))
-                            item_duedate = last_run + timedelta(hours=diff)
-                            item_due = item_duedate < datetime.now()
-                        else:
-                            item_due = True
-                        # Continue to next item if not due
-                        if item_due:
-                            # Run backup for item
-                            skipunmod = False if reset else True
-                            res = bi.backup(ago.gis, itemid, backup_dir, options, fmt, skip_unmodified=skipunmod, logger=logger)
-                            # Update status if appropriate
-                            if res.value > 1:
-                                log.post(logger, f" > Skipped item, {res}")
-                        else:
-                            log.post(logger, " > Skipped item, not yet due")
-            except Exception:
-                # Report error and continue
-                logger.exception('Unexpected error occured backing up files, please review code and try again.')
-        # Commit changes to git repo
-        if usegit:
-            # Add all files and committ
-            repo.git.add(all=True)
-            repo.index.commit(f"Data commit @ {datetime.now()}")
+        if ago and ago.gis:
+            _process(config, ago.gis, planned, reset, logger)
+        # Close state index
+        config.close()
+        # Commit changes to git repo, including changes left uncommitted by an earlier run
+        if planned or len(config.changes):
+            config.commit()
+
+
+def _next_due(config: _Config, k: str, now: float):
+    """Gets the next time an item is due in daemon mode
+
+    Args:
+        config (_Config): Loaded config
+        k (str): Item id or admin item key
+        now (float): Current time in seconds since epoch
+
+    Returns:
+        float: Next due time in seconds since epoch, None if the item is ignored
+    """
+    hours = config.cfg["items"][k]["hours_diff"]
+    # Ignore items set to 0, admin items with no hours run at the default interval
+    if k in ADMIN_ITEMS:
+        hours = hours or DAEMON_DEFAULT_HOURS
+        component = "admin"
+    elif hours == 0.0:
+        return None
+    else:
+        hours = hours if hours > 0 else DAEMON_DEFAULT_HOURS
+        component = "item"
+    # Get due time from last success
+    last_success = config.state.last_success(k, component)
+    if last_success is None:
+        return now
+    return last_success + hours * st.DUE_MARGIN * 3600
+
+
+def _daemon_item(config: _Config, k: str, logger: logging):
+    """Backs up a single due item of a config in daemon mode, reusing the portal session
+
+    Service exports are run on the calling worker rather than queued, so the item is only rescheduled once its export
+    has been downloaded.
+
+    Args:
+        config (_Config): Loaded config
+        k (str): Due item id or admin item key
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    cfg = config.cfg
+    item = cfg["items"][k]
+    # Get session, connecting if not already connected
+    ago = agol.connect(cfg["portal"], cfg["uname"], cfg["pword"], logger, config.rate_limit, config.token_cache)
+    if not ago.gis:
+        raise Exception(f"Could not connect to {cfg['portal']}")
+    # Backup admin item
+    if k in ADMIN_ITEMS:
+        log.post(logger, f" - {k}")
+        _backup_admin(ago.gis, k, item, config.backup_dir, config.state, config.changes, logger)
+        return
+    # Backup content item
+    item_logger = log.ItemLogger(logger, k)
+    try:
+        res = _backup_item(ago.gis, k, item, config.backup_dir, False, None, config.state, config.changes, config.blob_store, item_logger)
+    except Exception:
+        # Report error so the item is retried
+        item_logger.exception(' > Unexpected error occured backing up item')
+        config.state.record(k, "item", "Error", False)
+        return
+    _report_item(item_logger, res)
+
+
+def _daemon_commit(config: _Config, recorder: metrics.Recorder, logger: logging):
+    """Writes the run report of a config and commits its changes in daemon mode
+
+    Args:
+        config (_Config): Loaded config
+        recorder (Recorder): Recorder holding the timings since the last commit
+        logger (logging): logging object to pass to tool for logging purposes
+
+    Returns:
+        Recorder: Recorder for the timings until the next commit
+    """
+    # Write run report if anything was backed up
+    if recorder.spans:
+        try:
+            recorder.write(config.report_dir, config.metrics_dir)
+        except Exception:
+            logger.exception("Could not write run report")
+    # Commit changes to git repo
+    if len(config.changes):
+        try:
+            config.commit()
+        except Exception:
+            logger.exception(f"Could not commit changes to {config.backup_dir}")
+    return metrics.Recorder(config.cfg["label"])
+
+
+def daemon(cfg_paths: list, logger: logging, workers: int = None, export_jobs: int = None):
+    """Runs as a long running scheduler, holding every item of every config in a queue ordered by next due time
+
+    Sessions are kept open between items. The scheduler sleeps until the next item is due and dispatches each due item
+    to a shared item pool on its own, rescheduling it as soon as it finishes, so short interval items keep running on
+    schedule alongside long running items. Changes are committed every DAEMON_COMMIT_INTERVAL seconds.
+
+    Args:
+        cfg_paths (str): List of paths to config files to process
+        logger (logging): logging object to pass to tool for logging purposes
+        workers (int): Number of items to backup at the same time, overrides the config workers value (Default None)
+        export_jobs (int): Number of service export jobs in flight on the server, overrides the config export_jobs value (Default None)
+    """
+    # Load configs, each recording timings until its next commit
+    configs = [_Config(p, logger, workers, export_jobs) for p in cfg_paths]
+    recorders = [metrics.Recorder(config.cfg["label"]) for config in configs]
+    # Build queue of items keyed by next due time
+    queue = []
+    seq = itertools.count()
+    now = time.time()
+    for idx, config in enumerate(configs):
+        _plan(config.cfg["items"], config.backup_dir, config.state, False)
+        for k in config.cfg["items"]:
+            due = _next_due(config, k, now)
+            if due is not None:
+                heapq.heappush(queue, (due, next(seq), idx, k))
+    log.post(logger, f"Scheduler started with {len(queue)} items from {len(configs)} configs")
+    # Size item pool for the items and service exports of every config, exports run on the item worker
+    pool_size = max(1, sum(config.workers + config.export_jobs for config in configs))
+    running = {}
+    committed = time.time()
+    with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="item") as pool:
+        try:
+            while queue or running:
+                # Dispatch due items, recording their timings against their config
+                now = time.time()
+                while queue and queue[0][0] <= now:
+                    _, _, idx, k = heapq.heappop(queue)
+                    token = recorders[idx].activate()
+                    try:
+                        future = metrics.submit(pool, _daemon_item, configs[idx], k, logger)
+                    finally:
+                        recorders[idx].deactivate(token)
+                    running[future] = (idx, k)
+                # Reschedule completed items
+                for future in [f for f in running if f.done()]:
+                    idx, k = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception:
+                        logger.exception(f"Unexpected error backing up {k}")
+                    now = time.time()
+                    due = _next_due(configs[idx], k, now)
+                    if due is not None:
+                        # Retry failed items after a delay rather than immediately
+                        heapq.heappush(queue, (max(due, now + DAEMON_RETRY), next(seq), idx, k))
+                # Commit changes periodically
+                if time.time() - committed >= DAEMON_COMMIT_INTERVAL:
+                    recorders = [_daemon_commit(config, recorder, logger) for config, recorder in zip(configs, recorders)]
+                    committed = time.time()
+                # Sleep until the next item is due, an item completes or a commit is due
+                timeout = min(max(0, queue[0][0] - time.time()), DAEMON_MAX_SLEEP) if queue else DAEMON_MAX_SLEEP
+                timeout = min(timeout, max(0, committed + DAEMON_COMMIT_INTERVAL - time.time()))
+                if running:
+                    wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(timeout)
+        finally:
+            # Commit changes of completed items, changes of items still running are committed by the next run
+            for config, recorder in zip(configs, recorders):
+                _daemon_commit(config, recorder, logger)
+                config.close()
 
 
 if __name__ == '__main__':
@@ -170,12 +718,42 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=desc)
     parser.add_argument('-c', '--config', dest='config', help="Config item defining items to backup", nargs='+')
     parser.add_argument("-v", action="store_true", dest="verbose", help="Verbose, also logs debug messages")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        type=int,
+        default=None,
+        help=f"Number of items to backup at the same time, overrides the config workers value (Default {DEFAULT_WORKERS})",
+    )
     parser.add_argument(
         "-r",
         action="store_true",
         dest="reset",
         help="Reset items by ignoring timestamps",
     )
+    parser.add_argument(
+        "-e",
+        "--exports",
+        dest="export_jobs",
+        type=int,
+        default=None,
+        help=f"Number of service export jobs in flight on the server, overrides the config export_jobs value (Default {exp.DEFAULT_JOBS})",
+    )
+    parser.add_argument(
+        "-p",
+        "--plan",
+        action="store_true",
+        dest="plan",
+        help="Only report which items are due, without connecting to AGOL or writing to the backup folder",
+    )
+    parser.add_argument(
+        "-d",
+        "--daemon",
+        action="store_true",
+        dest="daemon",
+        help="Run as a long running scheduler, backing up items as they fall due",
+    )
     parser.add_argument(
         "-q",
         action="store_false",
@@ -197,7 +775,10 @@ if __name__ == '__main__':
     logger.debug(msg)
     try:
         # Run script with args
-        run(cfg_paths=args.config, logger=logger, reset=args.reset)
+        if args.daemon:
+            daemon(cfg_paths=args.config, logger=logger, workers=args.workers, export_jobs=args.export_jobs)
+        else:
+            run(cfg_paths=args.config, logger=logger, reset=args.reset, workers=args.workers, export_jobs=args.export_jobs, plan=args.plan)
     except Exception:
         # Catch everything else
         log.post(logger, "Script failed unexpectedly", logging.ERROR)
@@ -0,0 +1,619 @@
+# /usr/bin/python3
+
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+"""Local stand-in for the ArcGIS REST API, emulating the portal and feature service endpoints hit by the backup modules with configurable latency, payload size and throttling"""
+
+# Owner of generated content, also the user logged in as
+OWNER = "bench_admin"
+# Size of the block repeated to build binary payloads
+BLOCK_SIZE = 64 * 1024
+# Size of chunks written to the socket
+CHUNK_SIZE = 1024 * 1024
+# Scenario defaults
+DEFAULTS = {
+    "seed": 1,
+    "items": 0,
+    "item_types": {"Web Map": 0.5, "Feature Service": 0.3, "CSV": 0.2},
+    "users": 0,
+    "groups": 0,
+    "group_members": 10,
+    "group_items": 10,
+    "data_kb": 16,
+    "export_mb": 1,
+    "export_seconds": 2,
+    "latency_ms": 0,
+    "jitter_ms": 0,
+    "throttle_rps": None,
+}
+# Extensions of data files by item type
+EXTENSIONS = {"CSV": "csv", "Shapefile": "zip", "File Geodatabase": "zip", "PDF": "pdf"}
+# Small PNG returned for thumbnails
+THUMBNAIL = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+
+def _id(kind: str, n: int):
+    # Stable 32 character id
+    return hashlib.md5(f"{kind}{n}".encode("utf-8")).hexdigest()
+
+
+class Catalogue:
+    """Content, users and groups generated from a scenario
+    """
+
+    def __init__(self, scenario: dict, base_url: str):
+        """Generates catalogue
+
+        Args:
+            scenario (dict): Scenario settings, see DEFAULTS
+            base_url (str): Root url of the mock server
+        """
+        self.scenario = scenario
+        self.base_url = base_url
+        rnd = random.Random(scenario["seed"])
+        now = int(time.time() * 1000)
+        # Build items
+        types = list(scenario["item_types"])
+        weights = [scenario["item_types"][t] for t in types]
+        self.items = {}
+        for n in range(scenario["items"]):
+            itype = rnd.choices(types, weights)[0]
+            itemid = _id("item", n)
+            ext = EXTENSIONS.get(itype)
+            self.items[itemid] = {
+                "id": itemid,
+                "owner": OWNER,
+                "title": f"Item {n}",
+                "type": itype,
+                "name": f"item_{n}.{ext}" if ext else None,
+                "typeKeywords": ["Metadata"] if n % 2 else [],
+                "tags": ["benchmark"],
+                "snippet": "",
+                "description": "",
+                "created": now - 86400000,
+                "modified": now - rnd.randint(0, 86400000),
+                "url": f"{base_url}/server/rest/services/svc_{n}/FeatureServer" if itype == "Feature Service" else None,
+                "thumbnail": "thumbnail/thumbnail.png",
+                "numViews": rnd.randint(0, 1000),
+                "access": "private",
+                "ownerFolder": None,
+                "size": scenario["data_kb"] * 1024,
+            }
+        # Index services by name
+        self.services = {urlparse(i["url"]).path.split("/")[-2]: i for i in self.items.values() if i["url"]}
+        # Build users
+        self.users = {OWNER: self._user(OWNER, now)}
+        for n in range(scenario["users"]):
+            name = f"user_{n}"
+            self.users[name] = self._user(name, now)
+        # Build groups
+        usernames = list(self.users)
+        itemids = list(self.items)
+        self.groups = {}
+        for n in range(scenario["groups"]):
+            groupid = _id("group", n)
+            self.groups[groupid] = {
+                "group": {
+                    "id": groupid,
+                    "title": f"Group {n}",
+                    "owner": OWNER,
+                    "access": "org",
+                    "thumbnail": "thumbnail.png",
+                    "created": now - 86400000,
+                    "modified": now,
+                    "tags": ["benchmark"],
+                },
+                "users": rnd.sample(usernames, min(len(usernames), scenario["group_members"])),
+                "items": rnd.sample(itemids, min(len(itemids), scenario["group_items"])),
+            }
+        # Export items created by export jobs
+        self.exports = {}
+        self.lock = threading.Lock()
+        # Block repeated to build binary payloads
+        self.block = bytes(rnd.getrandbits(8) for _ in range(BLOCK_SIZE))
+
+    def _user(self, name: str, now: int):
+        # Generate user
+        return {
+            "username": name,
+            "fullName": name.replace("_", " ").title(),
+            "email": f"{name}@example.com",
+            "role": "org_admin" if name == OWNER else "org_user",
+            "userType": "creatorUT",
+            "thumbnail": "thumbnail.png",
+            "groups": [],
+            "created": now - 86400000,
+            "modified": now,
+            "orgId": "mock",
+        }
+
+    def item(self, itemid: str):
+        """Gets an item or export item
+
+        Args:
+            itemid (str): Item id
+
+        Returns:
+            dict: Item, None if not found
+        """
+        with self.lock:
+            return self.items.get(itemid) or self.exports.get(itemid)
+
+
+class Stats:
+    """Request counters of the mock server
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+        self.routes = {}
+        self.unhandled = {}
+
+    def add(self, route: str, size: int, throttled: bool = False, unhandled: str = None):
+        """Records a request
+
+        Args:
+            route (str): Name of route
+            size (int): Bytes sent
+            throttled (bool, optional): Flag to indicate the request was throttled. Defaults to False.
+            unhandled (str, optional): Path of a request with no emulated endpoint. Defaults to None.
+        """
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += size
+            self.throttled += 1 if throttled else 0
+            self.routes[route] = self.routes.get(route, 0) + 1
+            if unhandled:
+                self.unhandled[unhandled] = self.unhandled.get(unhandled, 0) + 1
+
+    def to_dict(self):
+        """Gets counters
+
+        Returns:
+            dict: Counters
+        """
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "bytes_sent": self.bytes_sent,
+                "routes": dict(self.routes),
+                "unhandled": dict(self.unhandled),
+            }
+
+
+class Throttle:
+    """Token bucket rejecting requests above the scenario request rate
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Takes a token if one is available
+
+        Returns:
+            bool: True if the request is allowed
+        """
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+# Portal routes, relative to /portal/sharing/rest
+ROUTES = [
+    (r"", "rest"),
+    (r"/info", "info"),
+    (r"/generateToken", "token"),
+    (r"/oauth2/token", "token"),
+    (r"/portals/self", "portal"),
+    (r"/community/self", "me"),
+    (r"/search", "search"),
+    (r"/content/items/(?P<id>\w+)", "item"),
+    (r"/content/items/(?P<id>\w+)/data", "data"),
+    (r"/content/items/(?P<id>\w+)/info/metadata/metadata\.xml", "metadata"),
+    (r"/content/items/(?P<id>\w+)/info/(?P<file>.+)", "thumbnail"),
+    (r"/content/items/(?P<id>\w+)/relatedItems", "related"),
+    (r"/content/items/(?P<id>\w+)/comments", "comments"),
+    (r"/content/users/(?P<user>[^/]+)/export", "export"),
+    (r"/content/users/(?P<user>[^/]+)/items/(?P<id>\w+)", "sharing"),
+    (r"/content/users/(?P<user>[^/]+)/items/(?P<id>\w+)/status", "status"),
+    (r"/content/users/(?P<user>[^/]+)/items/(?P<id>\w+)/delete", "delete"),
+    (r"/content/users/(?P<user>[^/]+)/items/(?P<id>\w+)/resources", "resources"),
+    (r"/content/users/(?P<user>[^/]+)(/(?P<folder>\w+))?", "user_content"),
+    (r"/community/users", "users"),
+    (r"/community/users/(?P<user>[^/]+)", "user"),
+    (r"/community/users/(?P<user>[^/]+)/info/(?P<file>.+)", "thumbnail"),
+    (r"/community/groups", "groups"),
+    (r"/community/groups/(?P<id>\w+)", "group"),
+    (r"/community/groups/(?P<id>\w+)/users", "members"),
+    (r"/community/groups/(?P<id>\w+)/info/(?P<file>.+)", "thumbnail"),
+    (r"/content/groups/(?P<id>\w+)(/search)?", "group_content"),
+]
+# Feature service routes, relative to /server/rest/services/<name>/FeatureServer
+SERVICE_ROUTES = [
+    (r"", "service"),
+    (r"/layers", "layers"),
+    (r"/(?P<layer>\d+)", "layer"),
+    (r"/(?P<layer>\d+)/query", "query"),
+]
+PORTAL_PREFIX = "/portal/sharing/rest"
+SERVICE_PATTERN = re.compile(r"/server/rest/services/(?P<svc>[^/]+)/FeatureServer(?P<rest>.*)")
+
+
+def _page(results: list, params: dict, key: str = "results"):
+    # Page a result list with start (1 based) and num
+    start = int(params.get("start", 1) or 1)
+    num = int(params.get("num", 100) or 100)
+    page = results[start - 1:start - 1 + num]
+    next_start = start + len(page) if start - 1 + num < len(results) else -1
+    return {"total": len(results), "start": start, "num": len(page), "nextStart": next_start, key: page}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Request handler emulating the ArcGIS REST API
+    """
+    protocol_version = "HTTP/1.1"
+    # Set by MockServer
+    catalogue = None
+    stats = None
+    throttle = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        # Read form body
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        body = self.rfile.read(length).decode("utf-8", "replace") if length else ""
+        form = {}
+        if "urlencoded" in self.headers.get("Content-Type", ""):
+            form = {k: v[-1] for k, v in parse_qs(body).items()}
+        self._handle(form)
+
+    def _handle(self, form: dict):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        params.update(form)
+        path = url.path.rstrip("/")
+        # Emulate latency
+        scenario = self.catalogue.scenario
+        if scenario["latency_ms"] or scenario["jitter_ms"]:
+            time.sleep((scenario["latency_ms"] + random.uniform(0, scenario["jitter_ms"])) / 1000)
+        # Emulate throttling
+        if not self.throttle.allow():
+            body = json.dumps({"error": {"code": 429, "message": "Too many requests"}}).encode("utf-8")
+            self._send(429, body, "application/json", headers={"Retry-After": "1"})
+            self.stats.add("throttled", len(body), throttled=True)
+            return
+        # Find route
+        route, match, routes, prefix = None, None, [], ""
+        svc = SERVICE_PATTERN.fullmatch(path)
+        if svc:
+            routes, rest = SERVICE_ROUTES, svc.group("rest")
+        elif path.startswith(PORTAL_PREFIX):
+            routes, rest = ROUTES, path[len(PORTAL_PREFIX):]
+        elif path in ["/server/rest/info", "/portal/sharing/rest/info"]:
+            routes, rest = [(r".*", "info")], ""
+        for pattern, name in routes:
+            match = re.fullmatch(pattern, rest)
+            if match:
+                route = name
+                break
+        try:
+            if route is None:
+                # Unknown endpoints return an empty result so clients carry on, and are reported
+                size = self._json({})
+                self.stats.add("unhandled", size, unhandled=path)
+                return
+            kwargs = {k: v for k, v in match.groupdict().items() if v is not None}
+            if svc:
+                kwargs["svc"] = svc.group("svc")
+            size = getattr(self, f"_{route}")(params, **kwargs)
+            self.stats.add(route, size)
+        except KeyError:
+            size = self._json({"error": {"code": 400, "message": "Item does not exist or is inaccessible."}})
+            self.stats.add(route or "unhandled", size)
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        # Send a complete response
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def _json(self, data: object):
+        # Send a JSON response
+        return self._send(200, json.dumps(data).encode("utf-8"), "application/json")
+
+    def _binary(self, key: str, size: int, content_type: str = "application/octet-stream"):
+        # Stream a generated payload, supporting range requests so resumed downloads can be measured
+        etag = f'"{hashlib.sha1(f"{key}{size}".encode("utf-8")).hexdigest()}"'
+        start, status = 0, 200
+        rng = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if rng and self.headers.get("If-Range", etag) == etag:
+            start, status = int(rng.group(1)), 206
+            if start >= size:
+                return self._send(416, b"", content_type)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(size - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.end_headers()
+        block = self.catalogue.block
+        sent = 0
+        while start + sent < size:
+            n = min(CHUNK_SIZE, size - start - sent)
+            offset = (start + sent) % BLOCK_SIZE
+            chunk = (block[offset:] + block * (n // BLOCK_SIZE + 1))[:n]
+            self.wfile.write(chunk)
+            sent += n
+        return sent
+
+    # Portal
+    def _rest(self, params):
+        return self._json({"currentVersion": "10.3"})
+
+    def _info(self, params):
+        base = self.catalogue.base_url
+        return self._json({
+            "owningSystemUrl": f"{base}/portal",
+            "authInfo": {"isTokenBasedSecurity": True, "tokenServicesUrl": f"{base}/portal/sharing/rest/generateToken"},
+            "currentVersion": "10.3",
+        })
+
+    def _token(self, params):
+        expires = int((time.time() + 86400) * 1000)
+        return self._json({"token": "mocktoken", "access_token": "mocktoken", "expires": expires, "expires_in": 86400, "ssl": False})
+
+    def _portal(self, params):
+        port = self.server.server_address[1]
+        return self._json({
+            "id": "mock",
+            "name": "Mock Portal",
+            "isPortal": True,
+            "portalMode": "multitenant",
+            "portalName": "Mock Portal",
+            "portalHostname": f"127.0.0.1:{port}/portal",
+            "urlKey": None,
+            "customBaseUrl": None,
+            "currentVersion": "10.3",
+            "allSSL": False,
+            "httpPort": port,
+            "httpsPort": port,
+            "supportsOAuth": False,
+            "helperServices": {},
+            "user": self.catalogue.users[OWNER],
+        })
+
+    def _me(self, params):
+        return self._json(self.catalogue.users[OWNER])
+
+    def _search(self, params):
+        q = params.get("q", "")
+        ids = re.findall(r"[0-9a-f]{32}", q)
+        if ids:
+            results = [self.catalogue.item(i) for i in ids if self.catalogue.item(i)]
+        else:
+            results = list(self.catalogue.items.values())
+        return self._json(_page(results, params))
+
+    # Items
+    def _item(self, params, id):
+        item = self.catalogue.item(id)
+        if item is None:
+            raise KeyError(id)
+        return self._json(item)
+
+    def _data(self, params, id):
+        item = self.catalogue.item(id)
+        if item is None:
+            raise KeyError(id)
+        return self._binary(id, item["size"])
+
+    def _metadata(self, params, id):
+        body = f"<?xml version='1.0' encoding='UTF-8'?><metadata><Esri><ArcGISFormat>1.0</ArcGISFormat></Esri><dataIdInfo><idCitation><resTitle>{id}</resTitle></idCitation></dataIdInfo></metadata>"
+        return self._send(200, body.encode("utf-8"), "application/xml")
+
+    def _thumbnail(self, params, file, id=None, user=None):
+        return self._send(200, THUMBNAIL, "image/png")
+
+    def _related(self, params, id):
+        return self._json({"total": 0, "relatedItems": []})
+
+    def _comments(self, params, id):
+        return self._json({"comments": []})
+
+    def _sharing(self, params, user, id):
+        item = self.catalogue.item(id)
+        if item is None:
+            raise KeyError(id)
+        return self._json({"item": item, "sharing": {"access": item["access"], "groups": []}})
+
+    def _resources(self, params, user, id):
+        return self._json({"total": 0, "start": 1, "num": 0, "nextStart": -1, "resources": []})
+
+    def _user_content(self, params, user, folder=None):
+        items = [i for i in self.catalogue.items.values() if i["owner"] == user and not folder]
+        res = _page(items, params, key="items")
+        res.update({"username": user, "folders": [], "currentFolder": None})
+        return self._json(res)
+
+    # Exports
+    def _export(self, params, user):
+        source = self.catalogue.item(params.get("itemId", ""))
+        if source is None:
+            raise KeyError(params.get("itemId"))
+        fmt = params.get("exportFormat", "File Geodatabase")
+        export_id = uuid.uuid4().hex
+        job_id = uuid.uuid4().hex
+        export = dict(source)
+        export.update({
+            "id": export_id,
+            "title": params.get("title", source["title"]),
+            "type": fmt,
+            "name": f"{params.get('title', source['title'])}.zip",
+            "url": None,
+            "size": int(self.catalogue.scenario["export_mb"] * 1024 * 1024),
+            "jobStarted": time.time(),
+        })
+        with self.catalogue.lock:
+            self.catalogue.exports[export_id] = export
+        return self._json({"type": fmt, "size": export["size"], "jobId": job_id, "exportItemId": export_id, "serviceItemId": source["id"]})
+
+    def _status(self, params, user, id):
+        export = self.catalogue.item(id)
+        if export is None:
+            raise KeyError(id)
+        done = time.time() - export.get("jobStarted", 0) >= self.catalogue.scenario["export_seconds"]
+        return self._json({"status": "completed" if done else "processing", "statusMessage": "", "itemId": id})
+
+    def _delete(self, params, user, id):
+        with self.catalogue.lock:
+            self.catalogue.exports.pop(id, None)
+        return self._json({"success": True, "itemId": id})
+
+    # Users and groups
+    def _users(self, params):
+        return self._json(_page(list(self.catalogue.users.values()), params))
+
+    def _user(self, params, user):
+        return self._json(self.catalogue.users[user])
+
+    def _groups(self, params):
+        return self._json(_page([g["group"] for g in self.catalogue.groups.values()], params))
+
+    def _group(self, params, id):
+        return self._json(self.catalogue.groups[id]["group"])
+
+    def _members(self, params, id):
+        group = self.catalogue.groups[id]
+        return self._json({"owner": OWNER, "admins": [OWNER], "users": group["users"]})
+
+    def _group_content(self, params, id):
+        items = [self.catalogue.items[i] for i in self.catalogue.groups[id]["items"]]
+        res = _page(items, params)
+        res["items"] = res["results"]
+        return self._json(res)
+
+    # Feature services
+    def _service(self, params, svc):
+        item = self.catalogue.services[svc]
+        return self._json({
+            "currentVersion": 10.9,
+            "serviceItemId": item["id"],
+            "capabilities": "Query,Extract",
+            "layers": [{"id": 0, "name": "Layer"}],
+            "tables": [],
+        })
+
+    def _layer_definition(self, svc):
+        item = self.catalogue.services[svc]
+        return {"id": 0, "name": "Layer", "type": "Feature Layer", "objectIdField": "OBJECTID", "editingInfo": {"lastEditDate": item["modified"]}}
+
+    def _layers(self, params, svc):
+        return self._json({"layers": [self._layer_definition(svc)], "tables": []})
+
+    def _layer(self, params, svc, layer):
+        return self._json(self._layer_definition(svc))
+
+    def _query(self, params, svc, layer):
+        return self._json({"objectIdFieldName": "OBJECTID", "features": []})
+
+
+class MockServer:
+    """Mock ArcGIS REST server run on a background thread
+    """
+
+    def __init__(self, scenario: dict, host: str = "127.0.0.1", port: int = 0):
+        """Setup server, generating its catalogue from a scenario
+
+        Args:
+            scenario (dict): Scenario settings, missing settings are taken from DEFAULTS
+            host (str, optional): Host to listen on. Defaults to "127.0.0.1".
+            port (int, optional): Port to listen on, a free port if 0. Defaults to 0.
+        """
+        self.scenario = {**DEFAULTS, **{k: v for k, v in scenario.items() if k in DEFAULTS}}
+        self.stats = Stats()
+        handler = type("MockHandler", (Handler,), {"stats": self.stats, "throttle": Throttle(self.scenario["throttle_rps"])})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://{host}:{self._server.server_address[1]}"
+        self.catalogue = handler.catalogue = Catalogue(self.scenario, self.base_url)
+        self._thread = None
+
+    @property
+    def portal_url(self):
+        # Return portal url to use in configs
+        return f"{self.base_url}/portal"
+
+    def start(self):
+        """Starts serving on a background thread
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# Facilitate access to module standalone
+if __name__ == "__main__":
+    """Tool to serve the mock ArcGIS REST API for a scenario"""
+    # Setup argparse if not called as a module
+    import argparse
+    desc = "This tool serves a local stand-in for the ArcGIS REST API, generated from a scenario file"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("scenario", help="Scenario file")
+    parser.add_argument("-p", dest="port", type=int, default=8080, help="Port to listen on (Default 8080)")
+    args = parser.parse_args()
+    # Load scenario
+    with open(args.scenario, "r") as f:
+        scenario = json.load(f)
+    # Serve until interrupted
+    server = MockServer(scenario, port=args.port).start()
+    print(f"Serving {scenario.get('name', args.scenario)} at {server.portal_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+        print(json.dumps(server.stats.to_dict(), indent=2))
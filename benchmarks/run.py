@@ -0,0 +1,159 @@
+# /usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+import subprocess
+from datetime import datetime
+from mock_agol import MockServer
+
+"""Offline benchmark of backup_mgr, running a scenario against the mock ArcGIS REST server and reporting throughput and peak memory"""
+
+# Root of the project
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Folder holding scenario files
+SCENARIO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenarios")
+# Titles of admin items
+ADMIN_TITLES = {"self": "My Details (Admin)", "users": "Users (Admin)", "groups": "Groups (Admin)"}
+
+
+def _config(server: MockServer, scenario: dict, work_dir: str):
+    # Build a backup config for the mock portal with every item due
+    run_cfg = scenario.get("config", {})
+    items = {}
+    if run_cfg.get("content", True):
+        for itemid, item in server.catalogue.items.items():
+            items[itemid] = {
+                "title": item["title"],
+                "hours_diff": -1,
+                "format": run_cfg.get("format", "fgdb"),
+                "options": run_cfg.get("options", ["all"]),
+            }
+    for k in run_cfg.get("admin", []):
+        items[k] = {"title": ADMIN_TITLES[k], "hours_diff": None, "options": ["all"]}
+    cfg = {
+        "portal": server.portal_url,
+        "uname": "bench_admin",
+        "pword": "bench_admin",
+        "outdir": work_dir,
+        "label": scenario.get("name", "benchmark"),
+        "usegit": run_cfg.get("usegit", False),
+        "workers": run_cfg.get("workers", 4),
+        "export_jobs": run_cfg.get("export_jobs", 4),
+        "items": items,
+    }
+    cfg_path = os.path.join(work_dir, "benchmark.json")
+    with open(cfg_path, "w") as f:
+        json.dump(cfg, f)
+    return cfg_path, os.path.join(work_dir, cfg["label"])
+
+
+def _run(cmd: list, verbose: bool):
+    # Run command, collecting its peak memory where supported
+    out = None if verbose else subprocess.DEVNULL
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=out, stderr=out)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in kilobytes on linux and bytes on mac
+        rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    else:
+        proc.wait()
+        rss = None
+    return proc.returncode, rss
+
+
+def _completed(backup_dir: str):
+    # Count successful item and admin backups in the state index
+    con = sqlite3.connect(os.path.join(backup_dir, ".backup_state.db"))
+    try:
+        return dict(con.execute(
+            "SELECT component, COUNT(*) FROM runs WHERE component IN ('item', 'admin') AND result = 'Success' GROUP BY component"
+        ).fetchall())
+    finally:
+        con.close()
+
+
+def run(scenario: dict, verbose: bool = False, keep: bool = False):
+    """Runs backup_mgr over a scenario served by the mock server
+
+    Args:
+        scenario (dict): Scenario settings
+        verbose (bool, optional): Show backup_mgr output. Defaults to False.
+        keep (bool, optional): Keep the backup folder. Defaults to False.
+
+    Returns:
+        dict: Results
+    """
+    server = MockServer(scenario).start()
+    work_dir = tempfile.mkdtemp(prefix="agol_backup_bench_")
+    try:
+        cfg_path, backup_dir = _config(server, scenario, work_dir)
+        # Run backup
+        cmd = [sys.executable, os.path.join(ROOT, "backup_mgr.py"), "-c", cfg_path]
+        if not verbose:
+            cmd.append("-q")
+        start = time.perf_counter()
+        code, rss = _run(cmd, verbose)
+        seconds = time.perf_counter() - start
+        # Collect results
+        stats = server.stats.to_dict()
+        completed = _completed(backup_dir)
+        items = completed.get("item", 0)
+        return {
+            "scenario": scenario.get("name"),
+            "timestamp": datetime.now().isoformat(),
+            "exit_code": code,
+            "seconds": round(seconds, 3),
+            "items": items,
+            "admin": completed.get("admin", 0),
+            "items_per_s": round(items / seconds, 3),
+            "requests": stats["requests"],
+            "requests_per_s": round(stats["requests"] / seconds, 3),
+            "throttled": stats["throttled"],
+            "mb_sent": round(stats["bytes_sent"] / 1024 / 1024, 3),
+            "peak_rss_mb": round(rss / 1024 / 1024, 1) if rss else None,
+            "routes": stats["routes"],
+            "unhandled": stats["unhandled"],
+        }
+    finally:
+        server.stop()
+        if keep:
+            print(f"Backup kept at {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# Facilitate access to module standalone
+if __name__ == "__main__":
+    """Tool to benchmark backup_mgr offline"""
+    # Setup argparse if not called as a module
+    import argparse
+    desc = "This tool runs backup_mgr against a local mock of the ArcGIS REST API and reports items/s, requests/s and peak memory"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("scenarios", nargs="+", help=f"Scenario files, or names of scenarios in {SCENARIO_DIR}")
+    parser.add_argument("-o", dest="output", default=None, help="Append results as JSON lines to this file, for comparing runs")
+    parser.add_argument("-k", action="store_true", dest="keep", help="Keep the backup folder")
+    parser.add_argument("-v", action="store_true", dest="verbose", help="Show backup_mgr output")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        # Load scenario
+        path = name if os.path.exists(name) else os.path.join(SCENARIO_DIR, f"{name}.json")
+        with open(path, "r") as f:
+            scenario = json.load(f)
+        # Run benchmark
+        res = run(scenario, args.verbose, args.keep)
+        # Report results
+        print(f"{res['scenario']}: {res['items']} items, {res['admin']} admin in {res['seconds']}s")
+        print(f"  {res['items_per_s']} items/s, {res['requests_per_s']} requests/s, {res['throttled']} throttled, peak RSS {res['peak_rss_mb']} MB")
+        if res["exit_code"]:
+            print(f"  backup_mgr exited with code {res['exit_code']}, run with -v to see its output")
+        if res["unhandled"]:
+            print(f"  Unhandled endpoints: {', '.join(res['unhandled'])}")
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(res) + "\n")
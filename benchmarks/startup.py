@@ -0,0 +1,106 @@
+# /usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+
+"""Benchmark of backup_mgr startup, timing a scheduled run where nothing is due"""
+
+# Root of the project
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules which should not be imported when nothing is due
+HEAVY_MODULES = ["arcgis", "git"]
+# Default number of items in the benchmark config
+DEFAULT_ITEMS = 500
+# Default number of times each command is run
+DEFAULT_REPEAT = 5
+
+
+def _config(work_dir: str, count: int):
+    # Build a config of items which were all backed up just now
+    sys.path.insert(0, ROOT)
+    import state as st
+    items = {f"{i:032x}": {"hours_diff": 24.0, "format": "fgdb", "options": ["all"]} for i in range(count)}
+    items["self"] = {"hours_diff": 24.0}
+    cfg = {
+        "portal": "https://www.arcgis.com",
+        "uname": "benchmark",
+        "pword": "benchmark",
+        "outdir": work_dir,
+        "label": "benchmark",
+        "usegit": True,
+        "items": items,
+    }
+    cfg_path = os.path.join(work_dir, "benchmark.json")
+    with open(cfg_path, "w") as f:
+        json.dump(cfg, f)
+    # Record every item as backed up
+    backup_dir = os.path.join(work_dir, "benchmark")
+    os.makedirs(backup_dir, exist_ok=True)
+    state = st.State(backup_dir)
+    for k in items:
+        state.record(k, "admin" if k == "self" else "item", "Success", True)
+    state.close()
+    return cfg_path
+
+
+def _time(cmd: list, repeat: int):
+    # Run a command, collecting the wall time of each run
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run(count: int = DEFAULT_ITEMS, repeat: int = DEFAULT_REPEAT):
+    """Times backup_mgr startup when nothing is due
+
+    Args:
+        count (int, optional): Number of items in the benchmark config. Defaults to DEFAULT_ITEMS.
+        repeat (int, optional): Number of times each command is run. Defaults to DEFAULT_REPEAT.
+
+    Returns:
+        dict: Median seconds for each command and heavy modules loaded on import
+    """
+    work_dir = tempfile.mkdtemp(prefix="agol_backup_bench_")
+    try:
+        cfg_path = _config(work_dir, count)
+        script = os.path.join(ROOT, "backup_mgr.py")
+        # Check which heavy modules are loaded by importing backup_mgr
+        check = f"import sys, backup_mgr; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        loaded = subprocess.run([sys.executable, "-c", check], cwd=ROOT, check=True, capture_output=True, text=True)
+        results = {
+            "interpreter": statistics.median(_time([sys.executable, "-c", "pass"], repeat)),
+            "import": statistics.median(_time([sys.executable, "-c", "import backup_mgr"], repeat)),
+            "plan": statistics.median(_time([sys.executable, script, "-c", cfg_path, "-p", "-q"], repeat)),
+            "run": statistics.median(_time([sys.executable, script, "-c", cfg_path, "-q"], repeat)),
+            "heavy_modules": [m for m in loaded.stdout.strip().split(",") if m],
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+# Facilitate access to module standalone
+if __name__ == "__main__":
+    """Tool to benchmark backup_mgr startup"""
+    # Setup argparse if not called as a module
+    import argparse
+    desc = "This tool times backup_mgr starting up for a scheduled run where nothing is due"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("-n", dest="count", type=int, default=DEFAULT_ITEMS, help=f"Number of items in the config (Default {DEFAULT_ITEMS})")
+    parser.add_argument("-r", dest="repeat", type=int, default=DEFAULT_REPEAT, help=f"Number of times each command is run (Default {DEFAULT_REPEAT})")
+    args = parser.parse_args()
+    # Run benchmark
+    res = run(args.count, args.repeat)
+    # Report results
+    for k in ["interpreter", "import", "plan", "run"]:
+        print(f"{k:<12} {res[k]:.3f}s")
+    print(f"{'loaded':<12} {', '.join(res['heavy_modules']) or 'none'}")
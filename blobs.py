@@ -0,0 +1,308 @@
+# /usr/bin/python3
+
+import os
+import json
+import stat
+import uuid
+import shutil
+import hashlib
+import logging
+import pathlib
+import tarfile
+import subprocess
+from datetime import datetime
+import log
+import util
+import download
+import state as st
+
+"""Content addressed store for large binary files, keeping exports and data downloads out of git and tracking a small pointer file in their place"""
+
+# Name of blob store folder in the backup dir
+BLOB_DIR = ".blobs"
+# Postfix of pointer files written in place of stored files
+POINTER_POSTFIX = ".blob"
+# Size of chunks read when hashing files
+CHUNK_SIZE = 1024 * 1024
+# Folders in a backup dir which are not copied when rehydrating
+SKIP_DIRS = [".git", BLOB_DIR]
+
+
+def _hash(path: str):
+    # Get sha256 of file
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def ignore(folder: str, name: str):
+    """Adds a file to the gitignore of its folder, so git only tracks its pointer
+
+    Args:
+        folder (str): Folder holding the file
+        name (str): File name
+    """
+    path = os.path.join(folder, ".gitignore")
+    pattern = f"/{name}"
+    content = ""
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            content = f.read()
+    if pattern not in content.splitlines():
+        with open(path, "a") as f:
+            # Ensure pattern starts on a new line
+            if content and not content.endswith("\n"):
+                f.write("\n")
+            f.write(f"{pattern}\n")
+
+
+def _link(src: str, dst: str):
+    # Hard link file into place, copying if links are not supported or the store is on another drive
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+        os.chmod(dst, stat.S_IWRITE | stat.S_IREAD)
+
+
+class BlobStore:
+    """Content addressed store of large files, named by the sha256 of their content
+
+    Files at or above the size threshold are moved into the store and hard linked back into place, with a pointer file
+    holding their name, size and hash written alongside. The file is added to the gitignore of its folder, so git only
+    tracks the pointer. Identical files are only stored once. Stored files are made read only, as they are hard linked
+    into place.
+    """
+
+    def __init__(self, path: str, threshold: int):
+        """Setup blob store
+
+        Args:
+            path (str): Folder holding the store
+            threshold (int): Size in bytes from which files are moved to the store
+        """
+        self.path = path
+        self.threshold = threshold
+
+    def blob_path(self, digest: str):
+        """Gets the path of a blob in the store
+
+        Args:
+            digest (str): sha256 of blob
+
+        Returns:
+            str: Path to blob
+        """
+        return os.path.join(self.path, digest[:2], digest)
+
+    def put(self, path: str):
+        """Moves a file into the store, removing it if the store already holds the same content
+
+        Args:
+            path (str): Path of file
+
+        Returns:
+            str: sha256 of file
+        """
+        digest = _hash(path)
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            os.remove(path)
+            return digest
+        # Move file next to the blob under a unique name, then link it into place without replacing a blob stored
+        # by another worker in the meantime
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp_path = f"{blob}.{uuid.uuid4().hex}.tmp"
+        shutil.move(path, tmp_path)
+        try:
+            os.link(tmp_path, blob)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Hard links not supported, rename does not replace an existing file on Windows
+            try:
+                os.rename(tmp_path, blob)
+            except FileExistsError:
+                pass
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        os.chmod(blob, stat.S_IREAD)
+        return digest
+
+    def stash(self, folder: str, skip: list = None):
+        """Moves files in a folder at or above the size threshold to the store, linking them back into place next to a pointer file
+
+        Files already linked to the blob of their pointer are left as they are.
+
+        Args:
+            folder (str): Folder to check
+            skip (list, optional): Names of files which are always left in place. Defaults to None.
+
+        Returns:
+            list: Paths of pointer files written
+        """
+        pointers = []
+        skip = (skip or []) + [".gitignore"]
+        for root, dirs, files in os.walk(folder):
+            for f in files:
+                src = os.path.join(root, f)
+                # Skip small files, existing pointers, files which must stay in place and files already stored
+                if f.endswith(POINTER_POSTFIX) or f in skip or os.path.getsize(src) < self.threshold or self._stored(src):
+                    continue
+                size = os.path.getsize(src)
+                digest = self.put(src)
+                # Link file back into place, only tracking its pointer in git
+                _link(self.blob_path(digest), src)
+                ignore(root, f)
+                pointer = f"{src}{POINTER_POSTFIX}"
+                util.export_obj(pointer, {"name": f, "sha256": digest, "size": size})
+                pointers.append(pointer)
+        return pointers
+
+    def _stored(self, path: str):
+        # Check if a file is linked to the blob of its pointer
+        pointer = f"{path}{POINTER_POSTFIX}"
+        if not os.path.exists(pointer):
+            return False
+        with open(pointer, "r") as f:
+            blob = self.blob_path(json.load(f)["sha256"])
+        return os.path.exists(blob) and os.path.samefile(path, blob)
+
+    def resolve(self, path: str):
+        """Gets the path holding the content of a file, following its pointer into the store if it has been stashed
+
+        Args:
+            path (str): Path of file
+
+        Returns:
+            str: Path of file, or of its blob if only a pointer is present
+        """
+        pointer = f"{path}{POINTER_POSTFIX}"
+        if os.path.exists(path) or not os.path.exists(pointer):
+            return path
+        with open(pointer, "r") as f:
+            meta = json.load(f)
+        blob = self.blob_path(meta["sha256"])
+        if not os.path.exists(blob):
+            raise Exception(f"Blob {meta['sha256']} for {pointer} not found in store")
+        return blob
+
+    def restore(self, pointer: str, out_dir: str):
+        """Restores the file of a pointer, hard linking it from the store where possible
+
+        Args:
+            pointer (str): Path of pointer file
+            out_dir (str): Folder to restore the file to
+
+        Returns:
+            str: Path of restored file
+        """
+        with open(pointer, "r") as f:
+            meta = json.load(f)
+        blob = self.blob_path(meta["sha256"])
+        if not os.path.exists(blob):
+            raise Exception(f"Blob {meta['sha256']} for {pointer} not found in store")
+        dst = os.path.join(out_dir, meta["name"])
+        if os.path.exists(dst):
+            os.remove(dst)
+        _link(blob, dst)
+        return dst
+
+
+def _extract(backup_dir: str, rev: str, out_dir: str):
+    # Extract a snapshot of the backup repo to a folder
+    proc = subprocess.Popen(["git", "-C", backup_dir, "archive", "--format=tar", rev], stdout=subprocess.PIPE)
+    with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+        tar.extractall(out_dir)
+    if proc.wait() != 0:
+        raise Exception(f"Could not extract {rev} from {backup_dir}")
+
+
+def rehydrate(backup_dir: str, out_dir: str, logger: logging, rev: str = None, store_dir: str = None):
+    """Writes a full copy of a backup, replacing pointer files with the files they point to
+
+    Pointers are replaced in every folder of the copy, including the change tracking baselines and deltas of items.
+
+    Args:
+        backup_dir (str): Backup directory for config
+        out_dir (str): Output directory
+        logger (logging): logging object to pass to tool for logging purposes
+        rev (str, optional): Git revision of the snapshot to restore, the backup dir as it is if not supplied. Defaults to None.
+        store_dir (str, optional): Folder holding the store. Defaults to the store in the backup dir.
+
+    Returns:
+        int: Number of files restored from the store
+    """
+    store = BlobStore(store_dir or os.path.join(backup_dir, BLOB_DIR), 0)
+    os.makedirs(out_dir, exist_ok=True)
+    # Copy snapshot
+    if rev:
+        log.post(logger, f" - Extracting {rev}")
+        _extract(backup_dir, rev, out_dir)
+    else:
+        log.post(logger, " - Copying backup")
+        ignore = shutil.ignore_patterns(*SKIP_DIRS, f"*{util.STAGING_POSTFIX}", download.PART_DIR, f"{st.STATE_FILE}*")
+        shutil.copytree(backup_dir, out_dir, ignore=ignore, dirs_exist_ok=True)
+    # Replace pointers
+    count = 0
+    for root, dirs, files in os.walk(out_dir):
+        for f in files:
+            if f.endswith(POINTER_POSTFIX):
+                pointer = os.path.join(root, f)
+                store.restore(pointer, root)
+                os.remove(pointer)
+                count += 1
+    log.post(logger, f" - Restored {count} files from the blob store")
+    return count
+
+
+# Facilitate access to module standalone
+if __name__ == "__main__":
+    """Tool to rehydrate a backup snapshot from the blob store"""
+    # Get file path
+    app_dir = os.path.dirname(__file__)
+    # Setup argparse if not called as a module
+    import argparse
+    desc = "This tool writes a full copy of a backup, restoring large files held in the blob store"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("backupdir", help="Backup directory of the config", type=pathlib.Path)
+    parser.add_argument("outputdir", help="Output directory", type=pathlib.Path)
+    parser.add_argument("-r", dest="rev", default=None, help="Git revision of the snapshot to restore, i.e. a commit hash (Default current backup)")
+    parser.add_argument("-s", dest="store", default=None, type=pathlib.Path, help="Blob store folder (Default .blobs in the backup directory)")
+    parser.add_argument(
+        "-v",
+        action="store_true",
+        dest="verbose",
+        help="Verbose, also logs debug messages",
+    )
+    parser.add_argument(
+        "-q",
+        action="store_false",
+        dest="nolog",
+        help="Do not log script progress to file",
+    )
+    # Parse args
+    args = parser.parse_args()
+    # Setup logger
+    log_level = logging.DEBUG if args.verbose else logging.INFO
+    logger = log.setup("blobs", app_dir=app_dir, active=args.nolog, level=log_level)
+    # Update script log
+    tsstart = datetime.now()
+    tsstart_str = tsstart.strftime("%m/%d/%Y %H:%M:%S")
+    log.post(logger, f"Script started at {tsstart_str}")
+    try:
+        # Run rehydrate
+        rehydrate(str(args.backupdir), str(args.outputdir), logger, args.rev, str(args.store) if args.store else None)
+    except Exception:
+        # Catch everything else
+        msg = "Script failed unexpectedly"
+        log.post(logger, msg, logging.ERROR)
+        logger.exception(msg)
+    finally:
+        # Update log
+        tsend = datetime.now()
+        tsend_str = tsend.strftime("%m/%d/%Y %H:%M:%S")
+        sec = int((tsend - tsstart).total_seconds())
+        log.post(logger, f"Script finished at {tsend_str} after {sec} seconds")
@@ -0,0 +1,388 @@
+# /usr/bin/python3
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import shutil
+import pathlib
+from datetime import datetime, timedelta
+import log
+import util
+import blobs as bl
+
+"""Incremental feature service backups, storing the changes extracted since the last server generation alongside a periodic full baseline"""
+
+# Folder in the item dir holding the baseline and deltas
+CHANGES_DIR = "changes"
+# Name of change tracking state file in the changes folder
+STATE_FILE = "state.json"
+# Default number of days between full baselines
+DEFAULT_BASELINE_DAYS = 7.0
+# Number of features requested per page when taking a baseline
+PAGE_SIZE = 2000
+# Seconds between status checks of asynchronous change extracts
+POLL_INTERVAL = 5
+
+
+def _write_json(path: str, data: object):
+    # Write to a temp file then move into place so a partial file is never left behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True, default=str)
+    os.replace(tmp_path, path)
+
+
+def load_state(changes_dir: str):
+    """Loads change tracking state for an item
+
+    Args:
+        changes_dir (str): Changes folder for the item
+
+    Returns:
+        dict: State, or None if no baseline has been taken
+    """
+    try:
+        with open(os.path.join(changes_dir, STATE_FILE), "r") as f:
+            return json.load(f)
+    except IOError:
+        return None
+
+
+def set_export(changes_dir: str, name: str):
+    """Records the name of the full export taken alongside the current baseline, which is kept until the next baseline
+
+    Args:
+        changes_dir (str): Changes folder for the item
+        name (str): File name of the export in the item dir
+    """
+    state = load_state(changes_dir)
+    if state:
+        state["export"] = name
+        _write_json(os.path.join(changes_dir, STATE_FILE), state)
+
+
+def supported(service: dict):
+    """Checks if a feature service supports change tracking
+
+    Args:
+        service (dict): Feature service definition
+
+    Returns:
+        bool: True if changes can be extracted from the service
+    """
+    return "ChangeTracking" in service.get("capabilities", "") and "serverGens" in service
+
+
+def _fields(props: dict):
+    # Get the field names and types of a layer, used to detect schema changes
+    return sorted([f["name"], f.get("type")] for f in props.get("fields", []))
+
+
+def stale(state: dict, service: dict, layers: dict = None):
+    """Checks if changes can no longer be extracted against a baseline
+
+    Args:
+        state (dict): Change tracking state
+        service (dict): Feature service definition
+        layers (dict, optional): Layer and table definitions of the service, fields are only compared if supplied. Defaults to None.
+
+    Returns:
+        str: Reason a new baseline is required, None if changes can be extracted
+    """
+    # Check layers have not been added or removed
+    ids = {str(lyr["id"]) for lyr in service.get("layers", []) + service.get("tables", [])}
+    if ids != set(state["layers"]):
+        return "Layers have changed"
+    # Check stored server generations are still tracked by the service
+    min_gens = {g["id"]: g.get("minServerGen") for g in service.get("changeTrackingInfo", {}).get("layerServerGens", [])}
+    for gen in state["layerServerGens"]:
+        if min_gens.get(gen["id"]) is not None and gen["serverGen"] < min_gens[gen["id"]]:
+            return "Changes since the last backup are no longer tracked"
+    # Check layer schemas have not changed, states written by earlier versions hold no fields
+    if layers:
+        for lyr in layers.get("layers", []) + layers.get("tables", []):
+            fields = state["layers"].get(str(lyr["id"]), {}).get("fields")
+            if fields is not None and fields != _fields(lyr):
+                return "Layer schema has changed"
+    return None
+
+
+def _service(item):
+    # Get feature service definition
+    return item._gis._con.get(item.url, {"f": "json"})
+
+
+def baseline(item, service: dict, changes_dir: str, logger: logging, layers: dict = None):
+    """Takes a full baseline of every layer and table in a feature service, saved as a JSON lines file per layer
+
+    The server generation is recorded before features are queried, so edits made while the baseline is taken are
+    picked up by the next delta. The baseline is built in a staging folder which only replaces the previous baseline
+    and its deltas once complete, so a failed baseline leaves the previous one in place.
+
+    Args:
+        item (Item): Feature service item
+        service (dict): Feature service definition
+        changes_dir (str): Changes folder for the item
+        logger (logging): logging object to pass to tool for logging purposes
+        layers (dict, optional): Layer and table definitions of the service, requested per layer if not supplied. Defaults to None.
+    """
+    # Update status
+    logger.debug(" > Change tracking baseline")
+    # Index layer definitions
+    definitions = {}
+    if layers:
+        definitions = {lyr["id"]: lyr for lyr in layers.get("layers", []) + layers.get("tables", [])}
+    # Setup staging folders, clearing out any left by an interrupted baseline
+    parent, name = os.path.split(os.path.abspath(changes_dir))
+    new_dir = os.path.join(parent, f".{name}{util.STAGING_POSTFIX}")
+    old_dir = os.path.join(parent, f".{name}.old{util.STAGING_POSTFIX}")
+    for d in [new_dir, old_dir]:
+        if os.path.exists(d):
+            shutil.rmtree(d)
+    baseline_dir = os.path.join(new_dir, "baseline")
+    os.makedirs(baseline_dir)
+    os.makedirs(os.path.join(new_dir, "deltas"))
+    try:
+        # Record server generation
+        server_gen = service["serverGens"]["serverGen"]
+        state_layers = {}
+        for lyr in service.get("layers", []) + service.get("tables", []):
+            # Get object id field
+            url = f"{item.url}/{lyr['id']}"
+            props = definitions[lyr["id"]] if lyr["id"] in definitions else item._gis._con.get(url, {"f": "json"})
+            oid_field = props.get("objectIdField", "OBJECTID")
+            state_layers[str(lyr["id"])] = {"name": lyr["name"], "oidField": oid_field, "fields": _fields(props)}
+            # Page through features in object id order, writing each to file
+            with open(os.path.join(baseline_dir, f"{lyr['id']}.jsonl"), "w") as f:
+                last_oid = -1
+                while True:
+                    params = {
+                        "f": "json",
+                        "where": f"{oid_field} > {last_oid}",
+                        "outFields": "*",
+                        "returnGeometry": "true",
+                        "orderByFields": oid_field,
+                        "resultRecordCount": PAGE_SIZE,
+                    }
+                    res = item._gis._con.post(f"{url}/query", params)
+                    features = res.get("features", [])
+                    for feature in features:
+                        f.write(json.dumps(feature, sort_keys=True))
+                        f.write("\n")
+                    if not features:
+                        break
+                    last_oid = features[-1]["attributes"][oid_field]
+        # Write state
+        state = {
+            "baseline": datetime.now().isoformat(),
+            "layers": state_layers,
+            "layerServerGens": [{"id": int(k), "serverGen": server_gen} for k in state_layers],
+            "deltas": [],
+        }
+        _write_json(os.path.join(new_dir, STATE_FILE), state)
+    except Exception:
+        # Leave previous baseline untouched
+        shutil.rmtree(new_dir, ignore_errors=True)
+        raise
+    # Swap in new baseline, replacing the previous baseline and its deltas
+    if os.path.exists(changes_dir):
+        os.replace(changes_dir, old_dir)
+    os.replace(new_dir, changes_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+
+def delta(item, state: dict, changes_dir: str, logger: logging):
+    """Extracts the adds, updates and deletes made to a feature service since the last stored server generation
+
+    Args:
+        item (Item): Feature service item
+        state (dict): Change tracking state
+        changes_dir (str): Changes folder for the item
+        logger (logging): logging object to pass to tool for logging purposes
+    """
+    # Update status
+    logger.debug(" > Change tracking delta")
+    # Request changes
+    params = {
+        "f": "json",
+        "layers": json.dumps([int(k) for k in state["layers"]]),
+        "layerServerGens": json.dumps(state["layerServerGens"]),
+        "returnInserts": "true",
+        "returnUpdates": "true",
+        "returnDeletes": "true",
+        "returnAttachments": "false",
+        "dataFormat": "json",
+    }
+    res = item._gis._con.post(f"{item.url}/extractChanges", params)
+    # Wait for result if extract is run asynchronously
+    if "statusUrl" in res:
+        while True:
+            status = item._gis._con.get(res["statusUrl"], {"f": "json"})
+            if status.get("status", "").lower() == "completed":
+                res = item._gis._con.get(status["resultUrl"], {"f": "json"})
+                break
+            elif status.get("status", "").lower() == "failed":
+                raise Exception(f"Could not extract changes: {item.itemid}")
+            time.sleep(POLL_INTERVAL)
+    # Check for an error payload
+    if "layerServerGens" not in res:
+        raise Exception(f"Could not extract changes: {item.itemid}: {res.get('error', res)}")
+    # Write delta if anything changed
+    edits = [e for e in res.get("edits", []) if any(e.get("features", {}).values())]
+    if edits:
+        name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        delta_data = {"from": state["layerServerGens"], "to": res["layerServerGens"], "edits": edits}
+        _write_json(os.path.join(changes_dir, "deltas", name), delta_data)
+        state["deltas"].append(name)
+    # Update state
+    state["layerServerGens"] = res["layerServerGens"]
+    _write_json(os.path.join(changes_dir, STATE_FILE), state)
+
+
+def backup(item, item_dir: str, baseline_days: float, logger: logging, layers: dict = None):
+    """Backs up a feature service incrementally, extracting changes since the last backup or taking a new baseline when one is due
+
+    A new baseline is also taken if layers or their schemas have changed, the stored server generations are older than
+    the service still tracks, or the changes cannot be extracted.
+
+    Args:
+        item (Item): Feature service item
+        item_dir (str): Output directory for the item
+        baseline_days (float): Number of days between full baselines
+        logger (logging): logging object to pass to tool for logging purposes
+        layers (dict, optional): Layer and table definitions of the service. Defaults to None.
+
+    Returns:
+        bool: True if a delta was extracted and a full export is not required
+    """
+    # Check service supports change tracking
+    service = _service(item)
+    if not supported(service):
+        logger.debug(" > Change tracking not enabled, running full export")
+        return False
+    # Check if a baseline is due
+    changes_dir = os.path.join(item_dir, CHANGES_DIR)
+    state = load_state(changes_dir)
+    if state:
+        baseline_date = datetime.fromisoformat(state["baseline"])
+        if baseline_date + timedelta(days=baseline_days) > datetime.now():
+            # Take a new baseline if changes can no longer be extracted against the current one
+            reason = stale(state, service, layers)
+            if reason:
+                logger.info(f" > {reason}, taking a new change tracking baseline")
+            else:
+                try:
+                    # Extract changes
+                    delta(item, state, changes_dir, logger)
+                    return True
+                except Exception:
+                    logger.exception(" > Could not extract changes, taking a new change tracking baseline")
+    # Take baseline
+    baseline(item, service, changes_dir, logger, layers)
+    return False
+
+
+def replay(item_dir: str, out_dir: str, logger: logging, store_dir: str = None):
+    """Replays the deltas of an item onto its baseline, writing a full copy of each layer as a JSON lines file
+
+    Baseline and delta files which have been moved to the blob store are read from the store.
+
+    Args:
+        item_dir (str): Backup directory for the item
+        out_dir (str): Output directory for replayed layers
+        logger (logging): logging object to pass to tool for logging purposes
+        store_dir (str, optional): Folder holding the blob store. Defaults to the store in the backup dir of the item.
+    """
+    store = bl.BlobStore(store_dir or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(item_dir))), bl.BLOB_DIR), 0)
+    changes_dir = os.path.join(item_dir, CHANGES_DIR)
+    state = load_state(changes_dir)
+    if not state:
+        raise Exception(f"No change tracking baseline found in {item_dir}")
+    os.makedirs(out_dir, exist_ok=True)
+    # Load baseline into a database so layers of any size can be replayed
+    db_path = os.path.join(out_dir, "replay.sqlite")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    con = sqlite3.connect(db_path)
+    try:
+        for lyr_id, lyr in state["layers"].items():
+            con.execute(f"CREATE TABLE layer_{lyr_id} (oid INTEGER PRIMARY KEY, feature TEXT)")
+            with open(store.resolve(os.path.join(changes_dir, "baseline", f"{lyr_id}.jsonl")), "r") as f:
+                rows = ((json.loads(line)["attributes"][lyr["oidField"]], line.strip()) for line in f)
+                con.executemany(f"INSERT INTO layer_{lyr_id} VALUES (?, ?)", rows)
+        # Apply deltas in order
+        for name in state["deltas"]:
+            log.post(logger, f" - Applying {name}")
+            with open(store.resolve(os.path.join(changes_dir, "deltas", name)), "r") as f:
+                delta_data = json.load(f)
+            for edit in delta_data["edits"]:
+                lyr_id = str(edit["id"])
+                oid_field = state["layers"][lyr_id]["oidField"]
+                features = edit.get("features", {})
+                rows = [
+                    (ft["attributes"][oid_field], json.dumps(ft, sort_keys=True))
+                    for ft in features.get("adds", []) + features.get("updates", [])
+                ]
+                con.executemany(f"INSERT OR REPLACE INTO layer_{lyr_id} VALUES (?, ?)", rows)
+                con.executemany(f"DELETE FROM layer_{lyr_id} WHERE oid = ?", [(i,) for i in features.get("deleteIds", [])])
+        # Write out layers
+        for lyr_id in state["layers"]:
+            with open(os.path.join(out_dir, f"{lyr_id}.jsonl"), "w") as f:
+                for (feature,) in con.execute(f"SELECT feature FROM layer_{lyr_id} ORDER BY oid"):
+                    f.write(feature)
+                    f.write("\n")
+    finally:
+        con.close()
+        os.remove(db_path)
+
+
+# Facilitate access to module standalone
+if __name__ == "__main__":
+    """Tool to replay the deltas of an incremental feature service backup into a full copy"""
+    # Get file path
+    app_dir = os.path.dirname(__file__)
+    # Setup argparse if not called as a module
+    import argparse
+    desc = "This tool replays the change tracking deltas of a feature service backup onto its baseline, writing a full copy of each layer"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("itemdir", help="Backup directory of the item", type=pathlib.Path)
+    parser.add_argument("outputdir", help="Output directory", type=pathlib.Path)
+    parser.add_argument("-s", dest="store", default=None, type=pathlib.Path, help="Blob store folder (Default .blobs in the backup directory)")
+    parser.add_argument(
+        "-v",
+        action="store_true",
+        dest="verbose",
+        help="Verbose, also logs debug messages",
+    )
+    parser.add_argument(
+        "-q",
+        action="store_false",
+        dest="nolog",
+        help="Do not log script progress to file",
+    )
+    # Parse args
+    args = parser.parse_args()
+    # Setup logger
+    log_level = logging.DEBUG if args.verbose else logging.INFO
+    logger = log.setup("changes", app_dir=app_dir, active=args.nolog, level=log_level)
+    # Update script log
+    tsstart = datetime.now()
+    tsstart_str = tsstart.strftime("%m/%d/%Y %H:%M:%S")
+    log.post(logger, f"Script started at {tsstart_str}")
+    try:
+        # Run replay
+        replay(str(args.itemdir), str(args.outputdir), logger, str(args.store) if args.store else None)
+    except Exception:
+        # Catch everything else
+        msg = "Script failed unexpectedly"
+        log.post(logger, msg, logging.ERROR)
+        logger.exception(msg)
+    finally:
+        # Update log
+        tsend = datetime.now()
+        tsend_str = tsend.strftime("%m/%d/%Y %H:%M:%S")
+        sec = int((tsend - tsstart).total_seconds())
+        log.post(logger, f"Script finished at {tsend_str} after {sec} seconds")
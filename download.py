@@ -0,0 +1,166 @@
+# /usr/bin/python3
+
+import os
+import re
+import json
+import hashlib
+import requests
+
+"""Download layer used for item data and service exports, streaming to a part file which is resumed if interrupted and only moved into place once complete"""
+
+# Size of chunks streamed to disk
+CHUNK_SIZE = 1024 * 1024
+# Seconds to wait for the server to respond
+TIMEOUT = 300
+# Name of folder holding partial downloads
+PART_DIR = ".partial"
+# Characters which cannot be used in a file name
+INVALID_CHARS = r'[\\/:*?"<>|\0]' if os.name == "nt" else r"[/\0]"
+
+
+def part_dir(item_dir: str):
+    """Gets the partial download folder for an item dir, kept alongside the item folders so partial files survive the item dir being reset
+
+    Args:
+        item_dir (str): Output directory for the item
+
+    Returns:
+        str: Path to partial download folder
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(item_dir)), PART_DIR)
+
+
+def item_file_name(item):
+    """Gets the file name the ArcGIS API for Python saves the data of an item as, so existing backups keep their names
+
+    The item name, or title if it has no name, is used as is. If it cannot be used as a file name it is stripped down
+    to letters, numbers, spaces and dots, falling back to the item id.
+
+    Args:
+        item (Item): Arcgis Online item
+
+    Returns:
+        str: File name
+    """
+    name = item["name"] or item["title"]
+    if name and not re.search(INVALID_CHARS, name):
+        return name
+    return re.sub(r"[^a-zA-Z0-9 \n\.]", "", name or "") or item.itemid
+
+
+def _session(gis):
+    # Reuse the connection session of the GIS so auth and connection pooling are shared
+    session = getattr(gis._con, "_session", None)
+    return session if session is not None else requests.Session()
+
+
+def _expected_size(resp):
+    # Get the total size from the range header of a resumed download
+    if resp.status_code == 206:
+        match = re.match(r"bytes \d+-\d+/(\d+)", resp.headers.get("Content-Range", ""))
+        return int(match.group(1)) if match else None
+    # Content-Length is the encoded size, so can only be checked if the body is not compressed
+    length = resp.headers.get("Content-Length")
+    if length is None or resp.headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    return int(length)
+
+
+def fetch(gis, url: str, out_path: str, params: dict = None, partial_dir: str = None, chunk_size: int = CHUNK_SIZE):
+    """Streams a url to a file in fixed size chunks
+
+    Data is written to a part file which is resumed with a HTTP Range request if a previous download was cut off.
+    The part file is only renamed to out_path once its size matches the size reported by the server,
+    otherwise it is kept for the next attempt to resume from and an exception is raised.
+
+    Args:
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        url (str): URL to download
+        out_path (str): Path to save the download to
+        params (dict, optional): Query parameters for the request. Defaults to None.
+        partial_dir (str, optional): Folder to hold the part file. Defaults to the folder of out_path.
+        chunk_size (int, optional): Size of chunks streamed to disk. Defaults to CHUNK_SIZE.
+
+    Returns:
+        int: Size of the downloaded file in bytes
+    """
+    # Setup part file, named after the url so the same download is resumed on the next run
+    partial_dir = partial_dir or os.path.dirname(out_path)
+    os.makedirs(partial_dir, exist_ok=True)
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    part_path = os.path.join(partial_dir, f"{key}.part")
+    meta_path = f"{part_path}.json"
+    # Setup request
+    params = dict(params or {})
+    query = dict(params)
+    token = getattr(gis._con, "token", None)
+    if token:
+        params["token"] = token
+    headers = {}
+    # Check for a resumable part file
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validator = None
+    if offset and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            validator = json.load(f).get("validator")
+    if offset and validator:
+        # Only resume if the file on the server is unchanged, otherwise the full file is returned
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+    # Request data
+    with _session(gis).get(url, params=params, headers=headers, stream=True, timeout=TIMEOUT) as resp:
+        # Discard part file and restart if it cannot be resumed
+        if resp.status_code == 416:
+            os.remove(part_path)
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            return fetch(gis, url, out_path, query, partial_dir, chunk_size)
+        resp.raise_for_status()
+        # Check if the server resumed the download
+        if resp.status_code == 206:
+            mode = "ab"
+        else:
+            mode = "wb"
+            offset = 0
+        # Get the expected size of the completed file
+        expected = _expected_size(resp)
+        # Store validator so the download can be resumed if cut off
+        validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+        if validator and resp.headers.get("Accept-Ranges", "none") != "none":
+            with open(meta_path, "w") as f:
+                json.dump({"url": url, "validator": validator}, f)
+        # Stream data to disk
+        with open(part_path, mode) as f:
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                offset += len(chunk)
+    # Keep part file to resume from if the download was cut off
+    if expected is not None and offset != expected:
+        raise Exception(f"Incomplete download of {url}: got {offset} of {expected} bytes")
+    # Move completed download into place
+    os.replace(part_path, out_path)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    return offset
+
+
+def item_data(item, out_dir: str, file_name: str = None, partial_dir: str = None):
+    """Downloads the data of an item
+
+    Args:
+        item (Item): Arcgis Online item to download
+        out_dir (str): Folder to save the download to
+        file_name (str, optional): File name for download. Defaults to the file name the ArcGIS API for Python would use.
+        partial_dir (str, optional): Folder to hold the part file. Defaults to the partial download folder for out_dir.
+
+    Returns:
+        str: Path to downloaded file
+    """
+    # Setup paths
+    file_name = file_name or item_file_name(item)
+    out_path = os.path.join(out_dir, file_name)
+    partial_dir = partial_dir or part_dir(out_dir)
+    # Download data
+    url = f"{item._gis._portal.resturl}content/items/{item.itemid}/data"
+    fetch(item._gis, url, out_path, partial_dir=partial_dir)
+    return out_path
@@ -0,0 +1,138 @@
+# /usr/bin/python3
+
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING
+import log
+import download
+import metrics
+
+# Type hints only, Item is imported when an export is run
+if TYPE_CHECKING:
+    from arcgis.gis import Item
+
+"""Service export pipeline, allowing export jobs for many services to be queued on AGOL at the same time"""
+
+# Postfix applied to the title of temporary export items
+POSTFIX = "_tmpbackup"
+# Default number of export jobs in flight on the server
+DEFAULT_JOBS = 4
+# Seconds between export job status checks
+POLL_INTERVAL = 5
+
+
+def export(item: "Item", fmt: str, item_dir: str, logger: logging, poll_interval: float = POLL_INTERVAL):
+    """Exports a service to the item dir, submitting the export job, polling until it completes, then downloading and deleting the export item
+
+    Args:
+        item (Item): Service item to export
+        fmt (str): AGOL export format (see agol.EXPORT_FORMATS values)
+        item_dir (str): Output directory for the item
+        logger (logging): logging object to pass to tool for logging purposes
+        poll_interval (float, optional): Seconds between export job status checks. Defaults to POLL_INTERVAL.
+
+    Returns:
+        str: Path to exported file
+    """
+    from arcgis.gis import Item
+    # Setup title
+    title = f"{item['title']}{POSTFIX}"
+    export_item = None
+    try:
+        # Submit export job
+        logger.debug(" > Service export submitted")
+        with metrics.span("export", item.itemid, "submit"):
+            job = item.export(title=title, export_format=fmt, wait=False, tags="Backup")
+            export_item = job["exportItem"] if "exportItem" in job else Item(item._gis, job["exportItemId"])
+        # Poll job until complete
+        with metrics.span("export", item.itemid, "wait"):
+            while True:
+                status = export_item.status(job_id=job["jobId"], job_type="export")
+                if status["status"].lower() == "failed":
+                    raise Exception(f"Could not export item: {item.itemid}")
+                elif status["status"].lower() == "completed":
+                    break
+                time.sleep(poll_interval)
+        # Grab data
+        logger.debug(" > Service export downloading")
+        with metrics.span("export", item.itemid, "download"):
+            return download.item_data(export_item, item_dir, file_name=download.item_file_name(export_item).replace(POSTFIX, ''))
+    finally:
+        # Try to delete export
+        if export_item is not None:
+            try:
+                export_item.delete()
+            except Exception:
+                pass
+
+
+class ExportPipeline:
+    """Runs service exports in the background, capping the number of export jobs in flight on the server
+
+    Exports are queued with submit as items are backed up. Each job is submitted to AGOL, polled and downloaded
+    on its own worker so time spent queued on the server overlaps with other exports and item backups.
+    """
+
+    def __init__(self, logger: logging, jobs: int = DEFAULT_JOBS, poll_interval: float = POLL_INTERVAL):
+        """Setup export pipeline
+
+        Args:
+            logger (logging): logging object to pass to tool for logging purposes
+            jobs (int, optional): Maximum number of export jobs in flight on the server. Defaults to DEFAULT_JOBS.
+            poll_interval (float, optional): Seconds between export job status checks. Defaults to POLL_INTERVAL.
+        """
+        self._logger = logger
+        self._poll_interval = poll_interval
+        self._pool = ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="export")
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, item: "Item", fmt: str, item_dir: str, logger: logging, on_done=None):
+        """Queues a service export
+
+        Args:
+            item (Item): Service item to export
+            fmt (str): AGOL export format (see agol.EXPORT_FORMATS values)
+            item_dir (str): Output directory for the item
+            logger (logging): Item logging object
+            on_done (callable, optional): Called with a success flag and the path of the exported file once the export has finished. Defaults to None.
+        """
+        future = metrics.submit(self._pool, self._run, item, fmt, item_dir, logger, on_done)
+        with self._lock:
+            self._futures[future] = logger
+
+    def _run(self, item: "Item", fmt: str, item_dir: str, logger: logging, on_done):
+        # Run export, notifying caller of the result
+        try:
+            path = export(item, fmt, item_dir, logger, self._poll_interval)
+        except Exception:
+            if on_done:
+                on_done(False, None)
+            raise
+        if on_done:
+            on_done(True, path)
+
+    def join(self):
+        """Waits for all queued exports to finish
+
+        Returns:
+            int: Number of failed exports
+        """
+        failed = 0
+        try:
+            # Collect results as they complete
+            with self._lock:
+                futures = list(self._futures)
+            for future in as_completed(futures):
+                item_logger = self._futures[future]
+                try:
+                    future.result()
+                    log.post(item_logger, " > Service export complete")
+                except Exception:
+                    failed += 1
+                    item_logger.exception(" > Service Export Failed")
+        finally:
+            self._pool.shutdown()
+        return failed
@@ -0,0 +1,246 @@
+# /usr/bin/python3
+
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+import metrics
+
+"""Request governor shared by every connection to a portal, limiting request rate and concurrency and retrying throttled requests"""
+
+# Default requests per second allowed to a portal, a fixed cap which is not adapted
+DEFAULT_RATE = 20.0
+# Default number of requests allowed in a burst
+DEFAULT_BURST = 40
+# Concurrency limit of a new governor
+INITIAL_LIMIT = 8
+# Bounds of the concurrency limit
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+# Number of times a throttled or failed request is retried
+MAX_RETRIES = 5
+# Base and maximum seconds to back off between retries
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 120.0
+# Status codes which are retried
+RETRY_STATUS = [429, 500, 502, 503, 504]
+# Status codes which indicate the portal is throttling requests
+THROTTLE_STATUS = [429, 503]
+# Methods which are safe to resend after the server may have processed them
+IDEMPOTENT_METHODS = ["GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"]
+# Status codes retried for other methods, where the server has refused the request without processing it
+UNPROCESSED_STATUS = [429]
+
+# Governors keyed by portal host
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+class Governor:
+    """Limits requests to a portal with a token bucket and an AIMD concurrency limit
+
+    The token bucket caps the request rate at a fixed rate, only the concurrency limit adapts. The concurrency limit
+    grows by one each time a full limit of requests succeeds and is halved whenever the portal throttles a request, so
+    the number of requests in flight settles near what the portal allows.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST, limit: int = INITIAL_LIMIT, logger: logging = None):
+        """Setup governor
+
+        Args:
+            rate (float, optional): Requests per second. Defaults to DEFAULT_RATE.
+            burst (int, optional): Number of requests allowed in a burst. Defaults to DEFAULT_BURST.
+            limit (int, optional): Initial concurrency limit. Defaults to INITIAL_LIMIT.
+            logger (logging, optional): logging object to pass to tool for logging purposes. Defaults to None.
+        """
+        self._logger = logger or logging.getLogger(__name__)
+        self._cond = threading.Condition()
+        # Token bucket
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        # Concurrency limit
+        self.limit = max(MIN_LIMIT, min(MAX_LIMIT, limit))
+        self._inflight = 0
+        self._healthy = 0
+
+    def _take_token(self):
+        # Wait for a token from the bucket
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+                self._refilled = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def acquire(self):
+        """Waits for a free request slot and a token, call release once the response is received
+        """
+        with self._cond:
+            while self._inflight >= self.limit:
+                self._cond.wait()
+            self._inflight += 1
+        if self.rate:
+            self._take_token()
+
+    def release(self, throttled: bool = False):
+        """Releases a request slot, adjusting the concurrency limit
+
+        Args:
+            throttled (bool, optional): Flag to indicate the portal throttled the request. Defaults to False.
+        """
+        with self._cond:
+            self._inflight -= 1
+            if throttled:
+                # Multiplicative decrease
+                limit = max(MIN_LIMIT, self.limit // 2)
+                if limit != self.limit:
+                    self._logger.debug(f"Request throttled, concurrency limit reduced to {limit}")
+                self.limit = limit
+                self._healthy = 0
+            else:
+                # Additive increase once a full limit of requests has succeeded
+                self._healthy += 1
+                if self._healthy >= self.limit and self.limit < MAX_LIMIT:
+                    self.limit += 1
+                    self._healthy = 0
+            self._cond.notify_all()
+
+
+def backoff(attempt: int, retry_after: str = None):
+    """Gets the seconds to wait before retrying a request
+
+    Args:
+        attempt (int): Number of attempts made so far
+        retry_after (str, optional): Retry-After header of the response, in seconds or as a HTTP date. Defaults to None.
+
+    Returns:
+        float: Seconds to wait
+    """
+    # Honour Retry-After if supplied
+    if retry_after:
+        try:
+            return min(BACKOFF_MAX, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                return min(BACKOFF_MAX, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+            except (TypeError, ValueError):
+                pass
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _connect_error(err: Exception):
+    # Check if a request failed while connecting, before anything was sent to the server
+    if isinstance(err, requests.ConnectTimeout):
+        return True
+    reason = getattr(err.args[0], "reason", None) if err.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class GovernedAdapter(BaseAdapter):
+    """Transport adapter sending requests through a governor, retrying throttled and failed requests with backoff
+
+    Idempotent requests are retried on any retryable status, timeout or dropped connection. Other requests, such as a
+    POST which may start an export, are only retried when the portal refused them (HTTP 429) or the connection could
+    not be made, so they are never sent twice.
+    """
+
+    def __init__(self, governor: Governor, adapter: BaseAdapter = None, retries: int = MAX_RETRIES):
+        """Setup adapter
+
+        Args:
+            governor (Governor): Governor for the portal
+            adapter (BaseAdapter, optional): Adapter to send requests with. Defaults to a new HTTPAdapter.
+            retries (int, optional): Number of times a request is retried. Defaults to MAX_RETRIES.
+        """
+        super().__init__()
+        self.governor = governor
+        self.adapter = adapter or HTTPAdapter()
+        self.retries = retries
+
+    def send(self, request, **kwargs):
+        # Streamed uploads cannot be replayed, so are sent once
+        retries = 0 if hasattr(request.body, "read") else self.retries
+        idempotent = request.method in IDEMPOTENT_METHODS
+        retry_status = RETRY_STATUS if idempotent else UNPROCESSED_STATUS
+        attempt = 0
+        while True:
+            self.governor.acquire()
+            throttled = False
+            try:
+                resp = self.adapter.send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                self.governor.release()
+                if attempt >= retries or not (idempotent or _connect_error(err)):
+                    raise
+                delay = backoff(attempt)
+            else:
+                throttled = resp.status_code in THROTTLE_STATUS
+                self.governor.release(throttled)
+                # Count request against the current timing span
+                metrics.count(int(resp.headers.get("Content-Length") or 0))
+                if resp.status_code not in retry_status or attempt >= retries:
+                    return resp
+                delay = backoff(attempt, resp.headers.get("Retry-After"))
+                resp.close()
+            # Wait and retry
+            attempt += 1
+            self.governor._logger.debug(f"Retrying {urlparse(request.url).path} in {delay:.1f}s (attempt {attempt})")
+            time.sleep(delay)
+
+    def close(self):
+        self.adapter.close()
+
+
+def get(portal: str, rate: float = None, logger: logging = None):
+    """Gets the governor for a portal, shared by every connection to the same portal host
+
+    Args:
+        portal (str): Portal url
+        rate (float, optional): Requests per second, updates the rate of an existing governor. Defaults to DEFAULT_RATE.
+        logger (logging, optional): logging object to pass to tool for logging purposes. Defaults to None.
+
+    Returns:
+        Governor: Governor for the portal
+    """
+    key = urlparse(portal).netloc or portal
+    with _governors_lock:
+        if key not in _governors:
+            _governors[key] = Governor(rate=rate or DEFAULT_RATE, logger=logger)
+        elif rate:
+            _governors[key].rate = rate
+        return _governors[key]
+
+
+def install(gis, portal: str, rate: float = None, logger: logging = None):
+    """Mounts the governor for a portal on the connection session of a GIS, wrapping the adapters already mounted
+
+    Args:
+        gis (GIS): arcgis.gis.GIS object from the Arcgis for Python API
+        portal (str): Portal url
+        rate (float, optional): Requests per second. Defaults to DEFAULT_RATE.
+        logger (logging, optional): logging object to pass to tool for logging purposes. Defaults to None.
+
+    Returns:
+        Governor: Governor for the portal, None if the connection has no session
+    """
+    session = getattr(gis._con, "_session", None)
+    if session is None:
+        return None
+    governor = get(portal, rate, logger)
+    for prefix in ["https://", "http://"]:
+        adapter = session.get_adapter(prefix)
+        if not isinstance(adapter, GovernedAdapter):
+            session.mount(prefix, GovernedAdapter(governor, adapter))
+    return governor
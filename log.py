@@ -42,9 +42,31 @@ def post(logger: logging, msg: str, level: int = logging.INFO):
         msg (str): Message to send to console and logger
         level (int, optional): Level used to describe message. Defaults to logging.INFO.
     """
+    # Apply item prefix if posting through an item logger
+    if isinstance(logger, logging.LoggerAdapter):
+        msg, _ = logger.process(msg, {})
+        logger = logger.logger
     # Update console
     print(msg)
     # Clear out colour formatters
     msg = msg
     # Update log
     logger.log(level, msg)
+
+
+class ItemLogger(logging.LoggerAdapter):
+    """Logger adapter which prefixes messages with the item they relate to, keeping logs readable when items are processed concurrently
+    """
+
+    def __init__(self, logger: logging, item: str):
+        """Setup item logger
+
+        Args:
+            logger (logging): logging object to wrap
+            item (str): Item id or label used to prefix messages
+        """
+        super().__init__(logger, {"item": item})
+
+    def process(self, msg: str, kwargs: dict):
+        # Prefix message with item
+        return f"[{self.extra['item']}] {msg}", kwargs
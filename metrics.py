@@ -0,0 +1,232 @@
+# /usr/bin/python3
+
+import os
+import json
+import time
+import threading
+import contextlib
+import contextvars
+from datetime import datetime
+
+"""Timing spans for items, components, exports and admin entities, written as a JSON lines run report and a Prometheus textfile"""
+
+# Name of report folder in the backup dir
+REPORT_DIR = ".reports"
+# Number of run reports kept in the report folder
+REPORT_KEEP = 30
+# Prefix of Prometheus metrics
+PROM_PREFIX = "agol_backup"
+
+# Recorder and span of the running backup, copied to worker threads by submit
+_recorder = contextvars.ContextVar("recorder", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """Timed unit of work, holding its duration, result, request count and bytes transferred
+    """
+
+    def __init__(self, recorder, kind: str, id: str, component: str = None, parent=None):
+        self.recorder = recorder
+        self.kind = kind
+        self.id = id
+        self.component = component
+        self.parent = parent
+        self.result = "Success"
+        self.requests = 0
+        self.bytes = 0
+        self.started = time.time()
+        self.duration = None
+
+    def add(self, requests: int = 0, size: int = 0):
+        """Adds requests and bytes to the span and its parents
+
+        Args:
+            requests (int, optional): Number of requests. Defaults to 0.
+            size (int, optional): Bytes transferred. Defaults to 0.
+        """
+        with self.recorder.lock:
+            span = self
+            while span is not None:
+                span.requests += requests
+                span.bytes += size
+                span = span.parent
+
+    def to_dict(self):
+        """Gets span as a report record
+
+        Returns:
+            dict: Report record
+        """
+        return {
+            "ts": datetime.fromtimestamp(self.started).isoformat(),
+            "kind": self.kind,
+            "id": self.id,
+            "component": self.component,
+            "duration": round(self.duration, 3) if self.duration is not None else None,
+            "result": self.result,
+            "requests": self.requests,
+            "bytes": self.bytes,
+        }
+
+
+class _NullSpan:
+    # Span used when nothing is being recorded
+    result = None
+
+    def add(self, requests: int = 0, size: int = 0):
+        pass
+
+
+class Recorder:
+    """Collects the spans of a backup run
+    """
+
+    def __init__(self, label: str):
+        """Setup recorder
+
+        Args:
+            label (str): Label of the config being backed up
+        """
+        self.label = label
+        self.started = time.time()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def activate(self):
+        """Makes this the recorder for spans started in the current context
+
+        Returns:
+            Token: Token to pass to deactivate
+        """
+        return _recorder.set(self)
+
+    def deactivate(self, token):
+        """Restores the previous recorder
+
+        Args:
+            token (Token): Token returned by activate
+        """
+        _recorder.reset(token)
+
+    def write(self, report_dir: str, prom_dir: str = None):
+        """Writes the run report and Prometheus textfile
+
+        Args:
+            report_dir (str): Folder for JSON lines run reports
+            prom_dir (str, optional): Folder for the Prometheus textfile, i.e. the node exporter textfile collector folder. Defaults to report_dir.
+
+        Returns:
+            str: Path of run report
+        """
+        with self.lock:
+            spans = [s.to_dict() for s in self.spans]
+        # Write run report
+        os.makedirs(report_dir, exist_ok=True)
+        name = datetime.fromtimestamp(self.started).strftime("%Y%m%d_%H%M%S")
+        report_path = os.path.join(report_dir, f"run_{name}.jsonl")
+        with open(report_path, "a") as f:
+            for s in spans:
+                s["config"] = self.label
+                f.write(json.dumps(s, sort_keys=True))
+                f.write("\n")
+        # Remove old reports
+        reports = sorted(f for f in os.listdir(report_dir) if f.startswith("run_") and f.endswith(".jsonl"))
+        for f in reports[:-REPORT_KEEP]:
+            os.remove(os.path.join(report_dir, f))
+        # Write textfile, moved into place so the collector never reads a partial file
+        prom_dir = prom_dir or report_dir
+        os.makedirs(prom_dir, exist_ok=True)
+        prom_path = os.path.join(prom_dir, f"{PROM_PREFIX}_{self.label}.prom")
+        with open(f"{prom_path}.tmp", "w") as f:
+            f.write(self._prometheus(spans))
+        os.replace(f"{prom_path}.tmp", prom_path)
+        return report_path
+
+    def _prometheus(self, spans: list):
+        # Aggregate spans by kind, component and result
+        totals = {}
+        for s in spans:
+            key = (s["kind"], s["component"] or "", s["result"])
+            t = totals.setdefault(key, [0, 0.0, 0, 0])
+            t[0] += 1
+            t[1] += s["duration"] or 0
+            t[2] += s["requests"]
+            t[3] += s["bytes"]
+        metrics = [
+            ("span_count", "gauge", "Number of spans in the last run", 0),
+            ("span_seconds", "gauge", "Seconds spent in spans in the last run", 1),
+            ("span_requests", "gauge", "Requests made in spans in the last run", 2),
+            ("span_bytes", "gauge", "Bytes transferred in spans in the last run", 3),
+        ]
+        lines = []
+        for name, mtype, desc, i in metrics:
+            lines.append(f"# HELP {PROM_PREFIX}_{name} {desc}")
+            lines.append(f"# TYPE {PROM_PREFIX}_{name} {mtype}")
+            for (kind, component, result), t in sorted(totals.items()):
+                labels = f'config="{self.label}",kind="{kind}",component="{component}",result="{result}"'
+                lines.append(f"{PROM_PREFIX}_{name}{{{labels}}} {round(t[i], 3)}")
+        lines.append(f"# HELP {PROM_PREFIX}_run_seconds Duration of the last run")
+        lines.append(f"# TYPE {PROM_PREFIX}_run_seconds gauge")
+        lines.append(f'{PROM_PREFIX}_run_seconds{{config="{self.label}"}} {round(time.time() - self.started, 3)}')
+        lines.append(f"# HELP {PROM_PREFIX}_last_run_timestamp_seconds Time the last run finished")
+        lines.append(f"# TYPE {PROM_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f'{PROM_PREFIX}_last_run_timestamp_seconds{{config="{self.label}"}} {round(time.time(), 3)}')
+        return "\n".join(lines) + "\n"
+
+
+@contextlib.contextmanager
+def span(kind: str, id: str, component: str = None):
+    """Times a unit of work, recorded by the active recorder if there is one
+
+    The span is marked as an Error if an exception is raised, its result can also be set directly.
+
+    Args:
+        kind (str): Kind of work, i.e. item, component, export or admin
+        id (str): Item id, username or group id
+        component (str, optional): Component of the work, i.e. data or metadata. Defaults to None.
+
+    Yields:
+        Span: Span of the work
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        yield _NullSpan()
+        return
+    current = Span(recorder, kind, id, component, _span.get())
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException:
+        current.result = "Error"
+        raise
+    finally:
+        _span.reset(token)
+        current.duration = time.time() - current.started
+        with recorder.lock:
+            recorder.spans.append(current)
+
+
+def count(size: int = 0):
+    """Counts a request against the current span
+
+    Args:
+        size (int, optional): Bytes transferred. Defaults to 0.
+    """
+    current = _span.get()
+    if current is not None:
+        current.add(1, size)
+
+
+def submit(pool, fn, *args, **kwargs):
+    """Submits work to a thread pool, carrying over the current recorder and span
+
+    Args:
+        pool (ThreadPoolExecutor): Pool to submit to
+        fn (callable): Function to run
+
+    Returns:
+        Future: Future of the submitted work
+    """
+    ctx = contextvars.copy_context()
+    return pool.submit(ctx.run, fn, *args, **kwargs)
@@ -0,0 +1,210 @@
+# /usr/bin/python3
+
+import os
+import time
+import sqlite3
+import pathlib
+import threading
+
+"""Backup state index, recording the result of each item and component backup in a single SQLite database in the backup dir"""
+
+# Name of state database in the backup dir
+STATE_FILE = ".backup_state.db"
+# Margin applied to hours_diff so items run on schedule when a run starts slightly early
+DUE_MARGIN = 0.98
+
+
+class State:
+    """Backup state index
+
+    Holds one row per item and component with the last attempt, last success, source modified time, bytes written,
+    duration, result code and a digest of the source where it has no modified time of its own. Times are stored as seconds since epoch. Access is serialised so the index can be
+    shared by worker threads.
+    """
+
+    def __init__(self, backup_dir: str, readonly: bool = False):
+        """Open state database, creating it if it does not exist
+
+        In read only mode the database is never created or migrated. It is opened with mode=ro and copied into a
+        temporary table which takes any writes, and a missing database is treated as empty.
+
+        Args:
+            backup_dir (str): Backup directory for config
+            readonly (bool, optional): Flag to leave the database on disk untouched. Defaults to False.
+        """
+        self.path = os.path.join(backup_dir, STATE_FILE)
+        self._lock = threading.Lock()
+        if not readonly:
+            self._con = sqlite3.connect(self.path, check_same_thread=False)
+        elif os.path.exists(self.path):
+            self._con = sqlite3.connect(f"{pathlib.Path(self.path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._con = sqlite3.connect(":memory:", check_same_thread=False)
+        with self._lock, self._con:
+            self._con.execute(
+                f"""CREATE {'TEMP ' if readonly else ''}TABLE IF NOT EXISTS runs (
+                    itemid TEXT NOT NULL,
+                    component TEXT NOT NULL,
+                    last_attempt REAL,
+                    last_success REAL,
+                    source_modified REAL,
+                    bytes INTEGER,
+                    duration REAL,
+                    result TEXT,
+                    digest TEXT,
+                    PRIMARY KEY (itemid, component)
+                )"""
+            )
+            # Copy index into the temporary table in read only mode, taking the columns written by earlier versions
+            if readonly:
+                columns = ", ".join(r[1] for r in self._con.execute("PRAGMA main.table_info(runs)"))
+                if columns:
+                    self._con.execute(f"INSERT INTO temp.runs ({columns}) SELECT {columns} FROM main.runs")
+            # Add columns missing from indexes written by earlier versions
+            else:
+                columns = [r[1] for r in self._con.execute("PRAGMA table_info(runs)")]
+                if "digest" not in columns:
+                    self._con.execute("ALTER TABLE runs ADD COLUMN digest TEXT")
+
+    def close(self):
+        """Close state database
+        """
+        with self._lock:
+            self._con.close()
+
+    def record(self, itemid: str, component: str, result: str, success: bool, started: float = None, source_modified: float = None, size: int = None, digest: str = None):
+        """Records the result of a backup
+
+        Args:
+            itemid (str): Item id, or admin component name
+            component (str): Component backed up, item for the item as a whole
+            result (str): Result code
+            success (bool): Flag to indicate if the backup succeeded, last success is only updated on success
+            started (float, optional): Time backup started in seconds since epoch, used to calculate duration. Defaults to None.
+            source_modified (float, optional): Time source was last modified in seconds since epoch. Defaults to None.
+            size (int, optional): Number of bytes written. Defaults to None.
+            digest (str, optional): Digest of the source. Defaults to None.
+        """
+        now = time.time()
+        duration = now - started if started else None
+        with self._lock, self._con:
+            self._con.execute(
+                """INSERT INTO runs (itemid, component, last_attempt, last_success, source_modified, bytes, duration, result, digest)
+                VALUES (:itemid, :component, :now, CASE WHEN :success THEN :now END, :modified, :bytes, :duration, :result, :digest)
+                ON CONFLICT (itemid, component) DO UPDATE SET
+                    last_attempt = excluded.last_attempt,
+                    last_success = COALESCE(excluded.last_success, runs.last_success),
+                    source_modified = COALESCE(excluded.source_modified, runs.source_modified),
+                    bytes = COALESCE(excluded.bytes, runs.bytes),
+                    duration = excluded.duration,
+                    result = excluded.result,
+                    digest = COALESCE(excluded.digest, runs.digest)""",
+                {
+                    "itemid": itemid,
+                    "component": component,
+                    "now": now,
+                    "success": success,
+                    "modified": source_modified,
+                    "bytes": size,
+                    "duration": duration,
+                    "result": result,
+                    "digest": digest,
+                },
+            )
+
+    def last_success(self, itemid: str, component: str = "item"):
+        """Gets the time of the last successful backup
+
+        Args:
+            itemid (str): Item id, or admin component name
+            component (str, optional): Component backed up. Defaults to "item".
+
+        Returns:
+            float: Time of last success in seconds since epoch, None if never successful
+        """
+        with self._lock:
+            row = self._con.execute(
+                "SELECT last_success FROM runs WHERE itemid = ? AND component = ?", (itemid, component)
+            ).fetchone()
+        return row[0] if row else None
+
+    def source(self, itemid: str, component: str = "item"):
+        """Gets the source modified time and digest recorded by the last successful backup
+
+        Args:
+            itemid (str): Item id, or admin component name
+            component (str, optional): Component backed up. Defaults to "item".
+
+        Returns:
+            tuple: Source modified time in seconds since epoch and digest, each None if not recorded
+        """
+        with self._lock:
+            row = self._con.execute(
+                "SELECT source_modified, digest FROM runs WHERE itemid = ? AND component = ? AND last_success IS NOT NULL",
+                (itemid, component),
+            ).fetchone()
+        return row if row else (None, None)
+
+    def forget(self, itemids: list, component: str = "item"):
+        """Removes the records of items which no longer exist
+
+        Args:
+            itemids (list): Item ids to remove
+            component (str, optional): Component backed up. Defaults to "item".
+        """
+        with self._lock, self._con:
+            self._con.executemany("DELETE FROM runs WHERE itemid = ? AND component = ?", [(i, component) for i in itemids])
+
+    def seed(self, itemid: str, last_success: float, component: str = "item"):
+        """Seeds the last success of an item not yet in the index, used to carry over timestamps from earlier versions
+
+        Args:
+            itemid (str): Item id, or admin component name
+            last_success (float): Time of last success in seconds since epoch
+            component (str, optional): Component backed up. Defaults to "item".
+        """
+        with self._lock, self._con:
+            self._con.execute(
+                "INSERT OR IGNORE INTO runs (itemid, component, last_success, result) VALUES (?, ?, ?, 'Seeded')",
+                (itemid, component, last_success),
+            )
+
+    def missing(self, itemids: list, component: str = "item"):
+        """Gets the item ids which have no record in the index
+
+        Args:
+            itemids (list): Item ids to check
+            component (str, optional): Component backed up. Defaults to "item".
+
+        Returns:
+            list: Item ids with no record
+        """
+        with self._lock:
+            known = {r[0] for r in self._con.execute("SELECT itemid FROM runs WHERE component = ?", (component,))}
+        return [i for i in itemids if i not in known]
+
+    def due(self, schedule: dict, component: str = "item", now: float = None):
+        """Gets the items which are due for backup in a single query
+
+        Args:
+            schedule (dict): Hours between backups keyed by item id, items with 0 hours are never due and items with no hours are always due
+            component (str, optional): Component backed up. Defaults to "item".
+            now (float, optional): Time to check against in seconds since epoch. Defaults to now.
+
+        Returns:
+            list: Due item ids
+        """
+        now = now or time.time()
+        with self._lock:
+            self._con.execute("CREATE TEMP TABLE IF NOT EXISTS schedule (itemid TEXT PRIMARY KEY, hours_diff REAL)")
+            self._con.execute("DELETE FROM schedule")
+            self._con.executemany("INSERT INTO schedule VALUES (?, ?)", schedule.items())
+            rows = self._con.execute(
+                """SELECT s.itemid FROM schedule s
+                LEFT JOIN runs r ON r.itemid = s.itemid AND r.component = :component
+                WHERE s.hours_diff IS NULL
+                    OR s.hours_diff < 0
+                    OR (s.hours_diff > 0 AND (r.last_success IS NULL OR r.last_success + s.hours_diff * :margin * 3600 < :now))""",
+                {"component": component, "margin": DUE_MARGIN, "now": now},
+            ).fetchall()
+        return [r[0] for r in rows]
@@ -2,9 +2,16 @@
 
 import os
 import shutil
+import filecmp
 import json
+import threading
 from datetime import datetime
 
+# Postfix of staging dirs created alongside the dirs they stage
+STAGING_POSTFIX = ".staging"
+# Name of file in the backup dir recording paths changed since the last commit
+PENDING_FILE = ".pending_changes"
+
 
 def setup_dir(item_dir: str):
     """Removes existing dir and recreates a folder to hold new data, primarily used to facilitate change tracking
@@ -22,6 +29,210 @@ def setup_dir(item_dir: str):
     os.makedirs(item_dir)
 
 
+class ChangeSet:
+    """Paths written or removed during a run, collected so only those paths need to be staged in git
+
+    If a journal is supplied every path is also appended to it as it is recorded, and the journal is only cleared once
+    the paths have been committed. Paths left by a run which crashed or failed to commit are loaded from the journal
+    and committed by the next run.
+    """
+
+    def __init__(self, journal: str = None):
+        """Setup change set
+
+        Args:
+            journal (str, optional): Path of journal file to persist recorded paths in. Defaults to None.
+        """
+        self._paths = set()
+        self._trees = set()
+        self._lock = threading.Lock()
+        self.journal = journal
+        # Load paths left by an earlier run
+        if journal and os.path.exists(journal):
+            with open(journal, "r") as f:
+                for line in f:
+                    try:
+                        kind, path = json.loads(line)
+                    except ValueError:
+                        # Skip a line cut short by a crash
+                        continue
+                    (self._trees if kind == "d" else self._paths).add(path)
+
+    def __len__(self):
+        return len(self._paths) + len(self._trees)
+
+    def _append(self, kind: str, paths: list):
+        # Append paths to journal, called with the lock held
+        if self.journal and paths:
+            with open(self.journal, "a") as f:
+                f.writelines(json.dumps([kind, p]) + "\n" for p in paths)
+
+    def add(self, paths: list):
+        """Records files which were written or removed
+
+        Args:
+            paths (list): Paths of files
+        """
+        paths = [os.path.abspath(p) for p in paths]
+        with self._lock:
+            self._paths.update(paths)
+            self._append("f", paths)
+
+    def add_tree(self, path: str):
+        """Records a folder whose contents are managed outside a staged dir, so everything under it is checked
+
+        Args:
+            path (str): Path of folder
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self._trees.add(path)
+            self._append("d", [path])
+
+    def pop(self):
+        """Gets and clears recorded paths, the journal keeps them until done is called
+
+        Returns:
+            tuple: Set of file paths and set of folder paths
+        """
+        with self._lock:
+            paths, trees = self._paths, self._trees
+            self._paths, self._trees = set(), set()
+        return paths, trees
+
+    def restore(self, paths: set, trees: set):
+        """Puts back popped paths which could not be committed
+
+        Args:
+            paths (set): File paths returned by pop
+            trees (set): Folder paths returned by pop
+        """
+        with self._lock:
+            self._paths.update(paths)
+            self._trees.update(trees)
+
+    def done(self):
+        """Clears popped paths from the journal once they are committed, keeping paths recorded since
+        """
+        if not self.journal:
+            return
+        with self._lock:
+            tmp_path = f"{self.journal}.tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(json.dumps(["f", p]) + "\n" for p in self._paths)
+                f.writelines(json.dumps(["d", p]) + "\n" for p in self._trees)
+            os.replace(tmp_path, self.journal)
+            if not self._paths and not self._trees:
+                os.remove(self.journal)
+
+
+class StagedDir:
+    """Directory staged alongside its target, on commit only files which have changed are written to the target
+
+    Files are written to the staging directory, then compared against the target. New and changed files are moved
+    into place with an atomic replace, files missing from the staging directory are removed and unchanged files are
+    left untouched so their timestamps and git index entries stay valid.
+    """
+
+    def __init__(self, target: str, keep: list = None, changes: ChangeSet = None):
+        """Setup staging directory for target
+
+        Args:
+            target (str): Directory to stage changes for
+            keep (list, optional): Names of files or folders in target which are managed elsewhere and left untouched on commit. Defaults to None.
+            changes (ChangeSet, optional): Change set to record written and removed paths in on commit. Defaults to None.
+        """
+        self.target = target
+        self.keep = keep or []
+        self.changes = changes
+        # Setup staging dir next to target so files can be moved atomically
+        parent, name = os.path.split(os.path.abspath(target))
+        self.path = os.path.join(parent, f".{name}{STAGING_POSTFIX}")
+        # Clear out any staging dir left by an interrupted run
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Commit changes if successful and not discarded, otherwise leave target untouched
+        if exc_type is None and os.path.exists(self.path):
+            self.commit()
+        else:
+            self.discard()
+
+    def commit(self):
+        """Applies changes in staging dir to target and removes staging dir
+
+        Returns:
+            list: Paths in target which were written or removed
+        """
+        changed = []
+        staged = set()
+        # Move new and changed files into place
+        for root, dirs, files in os.walk(self.path):
+            rel_dir = os.path.relpath(root, self.path)
+            for f in files:
+                src = os.path.join(root, f)
+                dst = os.path.normpath(os.path.join(self.target, rel_dir, f))
+                staged.add(dst)
+                # Skip unchanged files
+                if os.path.isfile(dst) and filecmp.cmp(src, dst, shallow=False):
+                    continue
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(src, dst)
+                changed.append(dst)
+        # Remove files which are no longer present
+        if os.path.exists(self.target):
+            for root, dirs, files in os.walk(self.target, topdown=False):
+                # Skip kept files and folders
+                rel_root = os.path.relpath(root, self.target)
+                if rel_root.split(os.sep)[0] in self.keep:
+                    continue
+                for f in files:
+                    if rel_root == os.curdir and f in self.keep:
+                        continue
+                    dst = os.path.normpath(os.path.join(root, f))
+                    if dst not in staged:
+                        os.remove(dst)
+                        changed.append(dst)
+                # Remove empty folders
+                if root != self.target and not os.listdir(root):
+                    os.rmdir(root)
+        else:
+            os.makedirs(self.target, exist_ok=True)
+        # Clean up staging dir
+        shutil.rmtree(self.path)
+        # Record changes
+        if self.changes is not None:
+            self.changes.add(changed)
+        return changed
+
+    def discard(self):
+        """Removes staging dir, leaving target untouched
+        """
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+
+def dir_size(path: str):
+    """Gets the total size of files in a directory
+
+    Args:
+        path (str): Directory to measure
+
+    Returns:
+        int: Total size of files in bytes
+    """
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            size += os.path.getsize(os.path.join(root, f))
+    return size
+
+
 def clean_dict(d: dict):
     """Cleans an Arcgis for Python API dict object by coping only dictionary items and removing system vars (i.e. those starting with '_')
 
@@ -42,6 +253,27 @@ def clean_dict(d: dict):
     return data
 
 
+def clean_record(itm: object):
+    """Cleans an Arcgis for Python API list entry by coping only dictionary items and removing system vars (i.e. those starting with '_')
+
+    Args:
+        itm (object): Entry to clean
+
+    Returns:
+        [dict]: Cleaned dict object
+    """
+    # Update to dict
+    d = itm.__dict__.copy()
+    for k in list(d.keys()):
+        # Remove sys variables
+        if k.startswith("_"):
+            del d[k]
+        # Remove last login and numviews as it defaults essentially to now/last update + 1 and is always picked up in GIT change tracking
+        if k in ['lastLogin', 'numViews']:
+            del d[k]
+    return d
+
+
 def clean_list(d: list):
     """Cleans an Arcgis for Python API list object by coping only dictionary items and removing system vars (i.e. those starting with '_')
 
@@ -52,20 +284,7 @@ def clean_list(d: list):
         [dict]: Cleaned dict object
     """
     # Process items in list
-    data = []
-    for itm in d:
-        # Update to dict
-        data.append(itm.__dict__.copy())
-    for d in data:
-        for k in list(d.keys()):
-            # Remove sys variables
-            if k.startswith("_"):
-                del d[k]
-            # Remove last login and numviews as it defaults essentially to now/last update + 1 and is always picked up in GIT change tracking
-            if k in ['lastLogin', 'numViews']:
-                del d[k]
-    # Return cleaned list
-    return data
+    return [clean_record(itm) for itm in d]
 
 
 def export_agolclass(out_path: str, data: object):
@@ -86,16 +305,24 @@ def export_agolclass(out_path: str, data: object):
 def export_agolclass_list(out_path: str, data: object):
     """Export an Arcgis for Python API class list object to path in json format
 
+    Entries are cleaned and written one at a time, so data can be a generator and is never held in memory as a
+    whole. The output is identical to dumping the cleaned list with json.dump.
+
     Args:
         out_path (str):  File path for export
-        data (object): Data to export
+        data (object): Data to export, any iterable
     """
     # Open file object
     with open(out_path, "w") as f:
-        # Clean dicts
-        d = clean_list(data)
-        # Dump data
-        json.dump(d, f, indent=2, sort_keys=True, default=str)
+        sep = "[\n"
+        for itm in data:
+            # Clean and dump entry, indented to sit within the list
+            d = json.dumps(clean_record(itm), indent=2, sort_keys=True, default=str)
+            f.write(sep)
+            f.write("  " + d.replace("\n", "\n  "))
+            sep = ",\n"
+        # Close list, matching json.dump for empty lists
+        f.write("[]" if sep == "[\n" else "\n]")
 
 
 def export_obj(out_path: str, data: object):